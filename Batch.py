@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+###################################################
+#   	  Batch analysis of patients, without GUI
+#       launch with : python Batch.py patient1/ patient2/ ...
+# 		   	----
+#           	P. Lansonneur 2019
+###################################################
+
+import numpy as np
+import argparse, csv, json
+import os, time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from Volume import RTDosiVolume
+from Loaders import FindDicomFiles, ReadDicomHeaders, SerieGeometry, LoadDosi, LoadROI
+from DVH import ComputeDVH
+
+METRICS = ['volume', 'Dmin', 'Dmean', 'Dmax', 'D98', 'D95', 'D50', 'D2']
+
+def Number(x):
+    """
+    JSON-friendly number (NaN becomes null)
+    """
+    x = float(x)
+    return None if np.isnan(x) else x
+
+def PatientNames(dirnames):
+    """
+    Return the output name of each patient directory: its path relative to the directories
+    common to all of them, so that e.g. A/CT and B/CT give A_CT and B_CT
+    """
+    paths = [os.path.abspath(d) for d in dirnames]
+    common = os.path.commonpath(paths) if len(paths)>1 else os.path.dirname(paths[0])
+    return [os.path.relpath(p, common).replace(os.sep, '_') if p!=common else os.path.basename(p) for p in paths]
+
+def AnalysePatient(dirname, output, nbins=1000, supersampling=2, masks=False, name=None):
+    """
+    Analyse the CT, RT-DOSE and RT-STRUCT files found in the directory 'dirname':
+    write the DVHs (CSV), the dose and structure statistics (JSON) and,
+    optionally, the masks of the structures on the dose grid (NPZ) in 'output', as 'name'.
+    Return one row of metrics per structure.
+    Each patient is analysed on a single thread, patients being run in parallel (see main).
+    """
+    if name is None:    name = PatientNames([dirname])[0]
+    files = FindDicomFiles(dirname)
+    if 'RTDOSE' not in files:   raise ValueError('no RT-DOSE file in {0}'.format(dirname))
+
+    dosi = LoadDosi(RTDosiVolume(), files['RTDOSE'][0])
+    roiset = LoadROI(files['RTSTRUCT'][0], workers=1) if 'RTSTRUCT' in files else None # DVHs on the dose grid: no CT slice index
+
+    stats = dosi.Statistics()
+    results = {'patient': name, 'files': {k: len(v) for k, v in files.items()},
+               'dose': {'max': Number(stats['max']), 'percentiles': {str(p): Number(v) for p, v in stats['percentiles'].items()}},
+               'structures': []}
+    rows = []
+
+    if 'CT' in files:
+        # CT geometry from the headers only, its pixels are not needed
+        shape, dtype, spacing, origin, slope, intercept = SerieGeometry(ReadDicomHeaders(files['CT'], workers=1)[1])
+        results['CT'] = {'shape': list(shape), 'spacing': spacing, 'origin': origin}
+
+    if roiset is not None:
+        DVHs = ComputeDVH(roiset, dosi, nbins=nbins, supersampling=supersampling, workers=1)
+
+        with open(os.path.join(output, name + '_DVH.csv'), 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['Dose (Gy)'] + ['{0} (%)'.format(DVH['name']) for DVH in DVHs])
+            for j, dose in enumerate(DVHs[0]['dose'] if DVHs else []):
+                writer.writerow(['{0:.3f}'.format(dose)] + ['{0:.2f}'.format(100*DVH['cumulative'][j]) for DVH in DVHs])
+
+        for DVH in DVHs:
+            structure = {m: Number(DVH[m]) for m in METRICS}
+            structure.update({'name': str(DVH['name']), 'V': {str(x): Number(v) for x, v in DVH['V'].items()}})
+            results['structures'].append(structure)
+            rows.append(dict([('patient', name), ('structure', str(DVH['name']))] + [(m, structure[m]) for m in METRICS]))
+
+        if masks:
+            np.savez_compressed(os.path.join(output, name + '_masks.npz'),
+                                **{'{0:03d}_{1}'.format(i, roiset.infos[i,0]): roiset.Mask(i, dosi) for i in range(roiset.N_ROI)}) # names may repeat
+
+    with open(os.path.join(output, name + '.json'), 'w') as f:
+        json.dump(results, f, indent=2)
+
+    return rows
+
+def main(args=None):
+
+    parser = argparse.ArgumentParser(description='Compute DVHs, dose statistics and masks of many patients, without GUI.')
+    parser.add_argument('patients', nargs='+', help='patient directories, holding the CT, RT-DOSE and RT-STRUCT files')
+    parser.add_argument('-o', '--output', default='results', help='output directory (default: results)')
+    parser.add_argument('-j', '--workers', type=int, default=None, help='number of processes (default: number of CPUs)')
+    parser.add_argument('--nbins', type=int, default=1000, help='number of DVH dose bins (default: 1000)')
+    parser.add_argument('--supersampling', type=int, default=2, help='sub-voxels per voxel side of the DVH masks (default: 2)')
+    parser.add_argument('--masks', action='store_true', help='save the masks of the structures on the dose grid')
+    args = parser.parse_args(args)
+
+    os.makedirs(args.output, exist_ok=True)
+    t0 = time.time()
+    rows, done = [], 0
+
+    with ProcessPoolExecutor(args.workers) as pool:
+        tasks = {pool.submit(AnalysePatient, d, args.output, args.nbins, args.supersampling, args.masks, name): d
+                 for d, name in zip(args.patients, PatientNames(args.patients))}
+        for task in as_completed(tasks):
+            try:
+                rows += task.result()
+                done += 1
+                print('{0} done'.format(tasks[task]))
+            except Exception as e:  print('{0} failed: {1}'.format(tasks[task], e))
+
+    with open(os.path.join(args.output, 'summary.csv'), 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=['patient', 'structure'] + METRICS)
+        writer.writeheader()
+        writer.writerows(sorted(rows, key=lambda r: (r['patient'], r['structure'])))
+
+    t = time.time() - t0
+    print('{0} patients analysed in {1:.1f} s ({2:.1f} patients per minute)'.format(done, t, 60*done/t if t>0 else 0))
+
+if __name__ == '__main__':
+    main()
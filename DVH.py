@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+###################################################
+#   	      Dose-volume histograms
+# 		   	----
+#           	P. Lansonneur 2019
+###################################################
+
+import numpy as np
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+def ROIDVH(roiset, i, dosi, edges, supersampling=2, V=(5,10,20,30,40,50)):
+    """
+    Return the DVH of the ROI 'i' in the dosimetry volume 'dosi', as a dictionary.
+    Voxels are weighted by the fraction of their volume inside the ROI
+    (see ROISet.MaskBox) and histogrammed over the dose bins 'edges'.
+    'dose', 'differential' (cc per bin) and 'cumulative' (fraction of the ROI volume
+    receiving at least each dose) describe the DVH; 'volume' (cc), 'Dmin', 'Dmean', 'Dmax',
+    'D98', 'D95', 'D50', 'D2' (Gy) and 'V' (fraction of the volume receiving V[x] Gy or more) are metrics.
+    """
+    box, weights = roiset.MaskBox(i, dosi, supersampling)
+    inside = (weights>0)
+    dose = np.asarray(dosi.volume[box], dtype=np.float32)[inside]
+    volume = weights[inside].astype(np.float32)*(0.001*np.prod(np.abs(dosi.spacing))) # cc
+
+    nbins = len(edges) - 1
+    index = np.clip(((dose - edges[0])/(edges[1] - edges[0])).astype(int), 0, nbins-1)
+    differential = np.bincount(index, weights=volume, minlength=nbins)
+    total = np.sum(volume)
+
+    DVH = {'name': roiset.infos[i,0], 'color': roiset.infos[i,5], 'dose': edges[:-1], 'differential': differential, 'volume': total}
+    DVH['cumulative'] = np.cumsum(differential[::-1])[::-1]/total if total>0 else np.zeros(nbins)
+
+    if(total>0):
+        # dose received by the hottest x% of the volume
+        order = np.argsort(dose)[::-1]
+        cumul = np.cumsum(volume[order])/total
+        Dx = lambda x: float(dose[order][min(np.searchsorted(cumul, x), len(order)-1)])
+        DVH.update({'Dmin': float(dose.min()), 'Dmean': float(np.sum(dose*volume)/total), 'Dmax': float(dose.max()),
+                    'D98': Dx(0.98), 'D95': Dx(0.95), 'D50': Dx(0.5), 'D2': Dx(0.02)})
+        DVH['V'] = {x: float(np.sum(volume[dose>=x])/total) for x in V}
+    else:
+        DVH.update({'Dmin': np.nan, 'Dmean': np.nan, 'Dmax': np.nan, 'D98': np.nan, 'D95': np.nan, 'D50': np.nan, 'D2': np.nan})
+        DVH['V'] = {x: np.nan for x in V}
+
+    return DVH
+
+def ComputeDVH(roiset, dosi, indices=None, nbins=1000, supersampling=2, workers=None):
+    """
+    Compute the DVH of the ROIs 'indices' (all of them by default) in one pass,
+    one ROI per task on a thread pool. All the DVHs share the same dose bins.
+    Return a list of dictionaries (see ROIDVH)
+    """
+    if indices is None:     indices = range(roiset.N_ROI)
+    Dmax = dosi.Statistics()['max']
+    edges = np.linspace(0, Dmax if Dmax>0 else 1., nbins+1)
+
+    with ThreadPoolExecutor(workers) as pool:
+        return list(pool.map(lambda i: ROIDVH(roiset, i, dosi, edges, supersampling), indices))
+
+def ExportDVH(DVHs, filename):
+    """
+    Export DVH data
+    """
+    with open(filename, 'w') as f:
+        f.write('Dose, Volume (%)\n')
+
+        for DVH in DVHs:
+            f.write('\nStructure: {0}\n'.format(DVH['name']))
+            for i,j in zip(DVH['dose'], DVH['cumulative']):     f.write('{0:.3f}, {1:.2f}\n'.format(i,100*j))
+
+def ShowDVH(self):
+    """
+    Display the cumulative DVH of every ROI loaded
+    """
+    # GUI imports kept here so that ComputeDVH and ExportDVH run without Qt
+    from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg, NavigationToolbar2QT
+    from matplotlib.figure import Figure
+    from PyQt5.QtWidgets import QFileDialog, QPushButton, QVBoxLayout, QWidget
+
+    if not (self.myROISet.open and self.myDosiVolume.open):
+        self.statusBar().showMessage('Open a dosimetry and structures first')
+        return
+
+    self.statusBar().showMessage('Calculating DVH..')
+    t0 = time.time()
+    self.DVHData = ComputeDVH(self.myROISet, self.myDosiVolume)
+    self.statusBar().showMessage('DVH computed in {0:.2f} s'.format(time.time() - t0))
+
+    print('Structure        \tvolume (cc)\tDmean (Gy)\tDmax (Gy)\tD95 (Gy)\tV20 (%)')
+    for DVH in self.DVHData:
+        print('{0}\t{1:.1f}\t\t{2:.2f}\t\t{3:.2f}\t\t{4:.2f}\t\t{5:.1f}'.format(str(DVH['name']).ljust(17), DVH['volume'], DVH['Dmean'], DVH['Dmax'], DVH['D95'], 100*DVH['V'][20]))
+
+    fc = FigureCanvasQTAgg(Figure(facecolor='lightgrey'))
+    ax = fc.figure.gca()
+    fc.figure.subplots_adjust(left=0.08,right=0.8, bottom=0.09, top=0.96)
+
+    for DVH in self.DVHData:
+        if(DVH['volume']>0):    ax.plot(DVH['dose'], 100*DVH['cumulative'], label=DVH['name'], color=DVH['color'])
+
+    ax.set_ylabel('Volume (%)')
+    ax.set_xlabel('Dose (Gy)')
+    ax.legend(bbox_to_anchor=(1.02,1),loc='upper left', frameon=False)
+
+    def Export():
+        filename, _ = QFileDialog.getSaveFileName(self.DVHWindow, "Export DVH", "./DVH.txt", "text (*.txt)")
+        if filename:
+            ExportDVH(self.DVHData, filename)
+            print('DVH saved !')
+
+    self.DVHWindow = QWidget()
+    self.DVHWindow.setWindowTitle('DVH')
+    self.DVHWindow.resize(900, 590)
+    layout = QVBoxLayout()
+    layout.addWidget(fc)
+    layout.addWidget(NavigationToolbar2QT(fc, self.DVHWindow))
+    layout.addWidget(QPushButton('Export..', clicked=Export))
+    self.DVHWindow.setLayout(layout)
+    self.DVHWindow.show()
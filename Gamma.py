@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+###################################################
+#   	  Gamma index between dose distributions
+# 		   	----
+#           	P. Lansonneur 2019
+###################################################
+
+import numpy as np
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait
+from Volume import RTDosiVolume
+from Histogram import ValueHistogram
+
+evaluatedVolume = None      # evaluated dose of the worker processes, see InitWorker
+
+def Offsets(step, radius):
+    """
+    Return the search offsets (mm) on a cubic grid of pitch 'step' within 'radius',
+    as a (N,3) array sorted by distance, and their distances
+    """
+    n = int(np.floor(radius/step))
+    r = np.arange(-n, n+1)*step
+    offsets = np.stack(np.meshgrid(r, r, r, indexing='ij'), axis=-1).reshape(-1,3)
+    distances = np.sqrt(np.sum(offsets**2, axis=1))
+    keep = (distances<=radius)
+    order = np.argsort(distances[keep], kind='stable')
+    return offsets[keep][order], distances[keep][order]
+
+def InitWorker(volume):
+    global evaluatedVolume
+    evaluatedVolume = volume
+
+def GammaChunk(base, reference, tolerance, offsets, distances, dta, max_gamma=2., stop=1.):
+    """
+    Return the gamma index of a chunk of reference points.
+    'base' are their (3,N) fractional indices in the evaluated dose (see InitWorker), 'reference' their dose
+    and 'tolerance' their dose difference criterion; 'offsets' are the search offsets in evaluated voxels,
+    sorted by 'distances' (mm). A point is searched until the distance alone exceeds its gamma,
+    or until its gamma is below 'stop'. Gammas are capped at 'max_gamma'.
+    """
+    from scipy.ndimage import map_coordinates
+
+    gamma2 = np.full(len(reference), max_gamma**2)
+    active = np.arange(len(reference))
+
+    for offset, distance in zip(offsets, distances):
+        d2 = (distance/dta)**2
+        active = active[(gamma2[active]>d2) & (gamma2[active]>stop**2)] # early exit
+        if not active.size: break
+        evaluated = map_coordinates(evaluatedVolume, base[:,active] + offset[:,None], order=1, mode='constant', cval=np.nan)
+        gamma2[active] = np.fmin(gamma2[active], d2 + ((evaluated - reference[active])/tolerance[active])**2)
+
+    return np.sqrt(gamma2).astype(np.float32)
+
+def GammaIndex(reference, evaluated, dta=3., dd=3., threshold=10., local=False, max_gamma=2., step=None, stop=1.,
+               chunk=100000, workers=None, progress=None, cancel=None):
+    """
+    Return the 3D gamma index of the dose 'evaluated' against the dose 'reference' (RTDosiVolume),
+    as an RTDosiVolume on the reference grid, NaN below the low-dose threshold.
+    'dta' is the distance to agreement (mm), 'dd' the dose difference (% of the reference maximum,
+    or of the local reference dose if 'local') and 'threshold' the low-dose threshold (% of the reference maximum).
+    The evaluated dose is interpolated (trilinear) on offsets of pitch 'step' (dta/3 by default)
+    within max_gamma*dta, nearest first, so that the search of a point stops early (see GammaChunk):
+    with stop=1, pass/fail is exact but gammas below 1 are upper bounds (stop=0 for exact values).
+    Chunks of points are computed on a process pool ('workers'=0: in this process), of spawned processes:
+    the GUI calls it from a worker thread, and forking a process with live Qt, BLAS and executor threads can deadlock.
+    The workers only receive the evaluated dose array and the chunks of reference points.
+    progress(done, total) reports the chunks done, and the event 'cancel' stops the computation.
+    """
+    from Loaders import Check
+
+    dose = np.asarray(reference.volume, dtype=np.float32)
+    Dmax = reference.Statistics()['max']
+    index = np.nonzero(dose>=threshold/100.*Dmax)
+    points = dose[index]
+    tolerance = dd/100.*(points if local else np.full(len(points), Dmax, dtype=np.float32))
+    tolerance = np.maximum(tolerance, 1e-6*max(Dmax, 1e-9))
+
+    # reference points and search offsets in evaluated voxel units (see RTGeneralVolume.Index)
+    base = np.array([evaluated.Index(ax, reference.Position(ax, index[ax])) for ax in range(3)])
+    offsets, distances = Offsets(dta/3. if step is None else step, max_gamma*dta)
+    offsets = offsets*np.array(evaluated.direction, dtype=float)/np.array(evaluated.spacing, dtype=float)
+
+    volume = np.ascontiguousarray(evaluated.volume, dtype=np.float32)
+    gamma = np.full(np.shape(dose), np.nan, dtype=np.float32)
+    chunks = [slice(k, k+chunk) for k in range(0, len(points), chunk)]
+    args = lambda s: (base[:,s], points[s], tolerance[s], offsets, distances, dta, max_gamma, stop)
+
+    if(workers==0):
+        InitWorker(volume)
+        for k, s in enumerate(chunks):
+            Check(cancel)
+            gamma[tuple(i[s] for i in index)] = GammaChunk(*args(s))
+            if progress is not None:    progress(k+1, len(chunks))
+
+    else:
+        with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'), initializer=InitWorker, initargs=(volume,)) as pool:
+            tasks = [pool.submit(GammaChunk, *args(s)) for s in chunks]
+            try:
+                for k, (s, task) in enumerate(zip(chunks, tasks)):
+                    while not wait([task], timeout=0.1).done:  Check(cancel)
+                    gamma[tuple(i[s] for i in index)] = task.result()
+                    if progress is not None:    progress(k+1, len(chunks))
+            except BaseException:
+                for task in tasks:  task.cancel()
+                raise
+
+    result = RTDosiVolume()
+    result.Assign(reference) # geometry of the reference
+    result.volume = gamma
+    result.slope, result.intercept = 1., 0.
+    result.filename, result.stream = '', None
+    result.histogram = ValueHistogram(gamma)
+    result.ClearStatistics()
+    result.open = True
+    return result
+
+def PassRate(gamma):
+    """
+    Return the fraction of the points of a gamma volume passing (gamma <= 1)
+    """
+    values = gamma.volume[np.isfinite(gamma.volume)]
+    return float(np.mean(values<=1)) if values.size else np.nan
+
+def CompareDoseFile(reference, filepath, progress=None, cancel=None, **options):
+    """
+    Load the dose file 'filepath' (RT-DOSE, or MetaImage/NIfTI in Gy) and return its gamma index against the dose 'reference' (see GammaIndex)
+    """
+    from Loaders import LoadDosi, LoadImage, IMAGE_EXTENSIONS
+    if filepath.lower().endswith(IMAGE_EXTENSIONS): evaluated = LoadImage(RTDosiVolume(), filepath, cancel=cancel)
+    else:   evaluated = LoadDosi(RTDosiVolume(), filepath, cancel=cancel)
+    return GammaIndex(reference, evaluated, progress=progress, cancel=cancel, **options)
+
+def ShowGamma(self):
+    """
+    Compare a dose file with the dosimetry opened (gamma index),
+    the gamma index being overlaid on the views
+    """
+    # GUI imports kept here so that GammaIndex runs without Qt
+    from PyQt5.QtWidgets import QCheckBox, QComboBox, QDoubleSpinBox, QFileDialog, QFormLayout, QLabel, QPushButton, QWidget
+    from OpenFile import LoadTask, StartLoad
+
+    if not self.myDosiVolume.open:
+        self.statusBar().showMessage('Open a dosimetry first')
+        return
+
+    def SpinBox(value, minimum, maximum, suffix):
+        box = QDoubleSpinBox(suffix=suffix, singleStep=0.5)
+        box.setRange(minimum, maximum)
+        box.setValue(value)
+        return box
+
+    dta = SpinBox(3., 0.1, 20., ' mm')
+    dd = SpinBox(3., 0.1, 20., ' %')
+    threshold = SpinBox(10., 0., 100., ' %')
+    normalization = QComboBox()
+    normalization.addItems(['global', 'local'])
+    result = QLabel('')
+
+    def Show(checked):
+        self.myGammaVolume.show = checked
+        self.UpdateAll()
+
+    show = QCheckBox('Show on the views', checked=self.myGammaVolume.show, toggled=Show)
+
+    def Compute():
+        filepath, _ = QFileDialog.getOpenFileName(self.GammaWindow, "Evaluated dose", "./", "Dose (*.dcm *.mhd *.mha *.nii *.nii.gz)")
+        if not filepath:    return
+
+        def Done(gamma):
+            self.myGammaVolume = gamma
+            self.myGammaVolume.show = show.isChecked()
+            result.setText('{0:.1f} % of the points pass (gamma <= 1)'.format(100*PassRate(gamma)))
+            self.UpdateAll()
+
+        reference = RTDosiVolume()
+        reference.Assign(self.myDosiVolume) # the dosimetry may be replaced while computing
+        task = LoadTask(CompareDoseFile, reference, filepath, dta=dta.value(), dd=dd.value(),
+                        threshold=threshold.value(), local=(normalization.currentText()=='local'))
+        StartLoad(self, task, 'Computing gamma index ...', Done, success='Gamma index computed')
+
+    self.GammaWindow = QWidget()
+    self.GammaWindow.setWindowTitle('Gamma index')
+    layout = QFormLayout()
+    layout.addRow('Distance to agreement', dta)
+    layout.addRow('Dose difference', dd)
+    layout.addRow('Normalization', normalization)
+    layout.addRow('Low-dose threshold', threshold)
+    layout.addRow(QPushButton('Compare with dose file...', clicked=Compute))
+    layout.addRow(result)
+    layout.addRow(show)
+    self.GammaWindow.setLayout(layout)
+    self.GammaWindow.show()
@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+###################################################
+#   	  Histograms of the CT and dose volumes
+# 		   	----
+#           	P. Lansonneur 2019
+###################################################
+
+import numpy as np
+import threading
+
+class Histogram():
+    """
+    Histogram of the raw pixel values of a volume, on fixed bins of 'width' raw values from 'low',
+    accumulated slice by slice while the volume is decoded (one np.bincount per slice).
+    Physical values are raw*slope + intercept.
+    """
+
+    def __init__(self, low=-32768, width=1, nbins=65536, slope=1., intercept=0.):
+
+        self.low = int(low)                                             # raw value of the first bin
+        self.width = int(width)                                         # raw values per bin
+        self.nbins = int(nbins)                                         # number of bins
+        self.slope = float(slope)                                       # rescale slope
+        self.intercept = float(intercept)                               # rescale intercept
+        self.counts = np.zeros(self.nbins, dtype=np.int64)              # voxels per bin
+        self.lock = threading.Lock()
+
+    def Like(self):
+        """
+	Return an empty histogram with the same bins
+	"""
+        return Histogram(self.low, self.width, self.nbins, self.slope, self.intercept)
+
+    def Add(self, raw):
+        """
+	Add raw values to the histogram: integers, or floats rounded to the nearest integer.
+	Values outside the bins are ignored.
+	"""
+        raw = np.asarray(raw).ravel()
+        if(raw.dtype.kind in 'iu')and(raw.dtype.itemsize==2)and(self.width==1)and(self.nbins==65536)and(self.low==(-32768 if raw.dtype.kind=='i' else 0)):
+            counts = np.bincount(raw.view(np.uint16), minlength=65536) # 16-bit values: one bin each
+            if(raw.dtype.kind=='i'):    counts = np.roll(counts, 32768)
+        else:
+            if(raw.dtype.kind=='f'):    raw = np.rint(raw[np.isfinite(raw)])
+            index = raw.astype(np.int64) - self.low
+            if(self.width>1):   index //= self.width
+            counts = np.bincount(index[(index>=0)&(index<self.nbins)], minlength=self.nbins)
+
+        with self.lock:
+            self.counts += counts
+
+    def AddValues(self, values):
+        """
+	Add physical values to the histogram
+	"""
+        self.Add((np.asarray(values, dtype=np.float64) - self.intercept)/self.slope)
+
+    def Total(self):
+        return int(np.sum(self.counts))
+
+    def Value(self, index):
+        """
+	Return the physical value at the (fractional) bin 'index', bin i spanning [i, i+1)
+	"""
+        return (self.low + np.asarray(index)*self.width - 0.5)*self.slope + self.intercept
+
+    def Percentiles(self, percentiles):
+        """
+	Return the physical values (bin centres) of percentiles of the histogram
+	"""
+        cumul = np.cumsum(self.counts)
+        if(cumul[-1]==0):   return np.full(len(percentiles), np.nan)
+        index = np.searchsorted(cumul, np.asarray(percentiles, dtype=float)/100.*cumul[-1])
+        return self.Value(np.minimum(index, self.nbins-1) + 0.5)
+
+    def Bins(self, nbins=256):
+        """
+	Return the edges (physical values) and the counts of the histogram
+	over its populated range, merged into at most 'nbins' bins
+	"""
+        populated = np.flatnonzero(self.counts)
+        if not populated.size:  return self.Value(np.array([0, 1])), np.zeros(1, dtype=np.int64)
+
+        first, last = populated[0], populated[-1] + 1
+        factor = -(-(last - first)//nbins)
+        n = -(-(last - first)//factor)
+        counts = np.zeros(n*factor, dtype=np.int64)
+        counts[:last-first] = self.counts[first:last]
+        return self.Value(first + np.arange(n+1)*factor), counts.reshape(n, factor).sum(axis=1)
+
+    def Sparse(self):
+        """
+	Return the histogram as a JSON-friendly dictionary, see FromSparse
+	"""
+        populated = np.flatnonzero(self.counts)
+        return {'low': self.low, 'width': self.width, 'nbins': self.nbins, 'slope': self.slope, 'intercept': self.intercept,
+                'index': populated.tolist(), 'counts': self.counts[populated].tolist()}
+
+def FromSparse(sparse):
+    histogram = Histogram(sparse['low'], sparse['width'], sparse['nbins'], sparse['slope'], sparse['intercept'])
+    histogram.counts[np.asarray(sparse['index'], dtype=np.int64)] = sparse['counts']
+    return histogram
+
+def VolumeHistogram(volume, histogram):
+    """
+    Accumulate the raw values of 'volume' into 'histogram' slice by slice (no copy of the whole volume)
+    """
+    for image in (volume if np.ndim(volume)==3 else [volume]):  histogram.Add(image)
+    return histogram
+
+def ValueHistogram(volume, nbins=65536):
+    """
+    Return the histogram of the physical values 'volume' (no raw values known, e.g. a rescaled dose),
+    on 'nbins' bins spanning their range
+    """
+    finite = [image[np.isfinite(image)] for image in (volume if np.ndim(volume)==3 else [volume])]
+    finite = [image for image in finite if image.size]
+    low = min([float(np.min(image)) for image in finite], default=0.)
+    high = max([float(np.max(image)) for image in finite], default=0.)
+    histogram = Histogram(low=0, nbins=nbins, slope=(high - low)/(nbins - 1) if high>low else 1., intercept=low)
+    for image in finite:    histogram.AddValues(image)
+    return histogram
+
+def RegionHistogram(volume, histogram, roiset, i):
+    """
+    Return the histogram of the volume 'volume' within the ROI 'i', on the bins of 'histogram',
+    from the cached mask of the ROI (see ROISet.MaskBox)
+    """
+    box, mask = roiset.MaskBox(i, volume)
+    region = histogram.Like()
+    region.AddValues(volume.Rescale(np.asarray(volume.volume[box])[mask]))
+    return region
+
+def ShowHistogram(self):
+    """
+    Display the histograms of the CT and of the dose accumulated while loading,
+    in the whole volume or in a ROI, and set the percentiles of the AUTO scale
+    """
+    # GUI imports kept here so that Histogram runs without Qt
+    from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg, NavigationToolbar2QT
+    from matplotlib.figure import Figure
+    from PyQt5.QtWidgets import QComboBox, QDoubleSpinBox, QFormLayout, QVBoxLayout, QWidget
+
+    ct, dosi = self.myCTVolume, self.myDosiVolume
+    volumes = [(v, title) for v, title in [(ct, 'CT'), (dosi, 'Dose (Gy)')] if v.open and v.histogram is not None]
+    if not volumes:
+        self.statusBar().showMessage('Open a CT or a dosimetry first')
+        return
+
+    fc = FigureCanvasQTAgg(Figure(facecolor='lightgrey'))
+    axes = fc.figure.subplots(len(volumes), 1, squeeze=False)[:,0]
+    fc.figure.subplots_adjust(left=0.1, right=0.95, bottom=0.1, top=0.95, hspace=0.35)
+
+    region = QComboBox()
+    region.addItem('Whole volume')
+    if self.myROISet.open:  region.addItems([str(self.myROISet.infos[i,0]) for i in range(self.myROISet.N_ROI)])
+
+    def SpinBox(value):
+        box = QDoubleSpinBox(suffix=' %', decimals=2, singleStep=0.5)
+        box.setRange(0., 100.)
+        box.setValue(value)
+        return box
+
+    low, high = SpinBox(self.myWindowLevel.autoPercentiles[0]), SpinBox(self.myWindowLevel.autoPercentiles[1])
+
+    def Plot():
+        i = region.currentIndex() - 1
+        for ax, (volume, title) in zip(axes, volumes):
+            histogram = volume.histogram if(i<0) else RegionHistogram(volume, volume.histogram, self.myROISet, i)
+            edges, counts = histogram.Bins(512 if volume is ct else 256)
+            ax.clear()
+            ax.stairs(counts, edges, fill=True, color='grey' if volume is ct else 'r')
+            ax.set_yscale('log')
+            ax.set_xlabel(title)
+            ax.set_ylabel('Voxels')
+            if volume is ct:
+                ax.axvspan(*self.myWindowLevel.Range(), color='b', alpha=0.1, label='display range')
+                for value in histogram.Percentiles([low.value(), high.value()]):    ax.axvline(value, color='b', linestyle='--', linewidth=1)
+        fc.draw_idle()
+
+    def SetPercentiles():
+        self.myWindowLevel.autoPercentiles = (low.value(), max(high.value(), low.value()))
+        self.SetScale('AUTO')
+        Plot()
+
+    region.currentIndexChanged.connect(Plot)
+    low.valueChanged.connect(SetPercentiles)
+    high.valueChanged.connect(SetPercentiles)
+
+    self.HistogramWindow = QWidget()
+    self.HistogramWindow.setWindowTitle('Histogram')
+    self.HistogramWindow.resize(700, 550)
+    form = QFormLayout()
+    form.addRow('Region', region)
+    form.addRow('AUTO scale, low percentile', low)
+    form.addRow('AUTO scale, high percentile', high)
+    layout = QVBoxLayout()
+    layout.addLayout(form)
+    layout.addWidget(fc)
+    layout.addWidget(NavigationToolbar2QT(fc, self.HistogramWindow))
+    self.HistogramWindow.setLayout(layout)
+    Plot()
+    self.HistogramWindow.show()
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+###################################################
+#   	  Isodose lines of the dose slices
+# 		   	----
+#           	P. Lansonneur 2019
+###################################################
+
+import numpy as np
+import contourpy
+import threading
+import weakref
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from MPR import PixelToExtent
+
+def Contours(image, levels, norm=None):
+    """
+    Return the isodose lines of a dose slice, as a list of (level index, [(N,2) arrays])
+    in (column, row) coordinates. Levels are relative to 'norm', or to the slice maximum if None.
+    """
+    scale = np.nanmax(image) if norm is None else norm
+    if not scale>0:    return []        # no isodose on an empty slice
+
+    z = np.asarray(image, dtype=np.float64)
+    if np.isnan(z).any():   z = np.ma.masked_invalid(z)
+    generator = contourpy.contour_generator(z=z, line_type=contourpy.LineType.Separate)
+    return [(k, generator.lines(scale*level)) for k, level in enumerate(levels)]
+
+class IsodoseCache():
+    """
+    Least recently used cache of the isodose lines, keyed by the dose volume, the axis,
+    the dose slice, the orientation, the levels and the normalization.
+    Lines of the neighbouring slices are computed ahead on a background worker.
+    Dose volumes are only weakly referenced: the lines of a replaced volume are dropped with it.
+    """
+
+    def __init__(self, size=512, prefetch=4, workers=1):
+
+        self.lines = OrderedDict()                                      # weak reference to the volume, slice shape and lines, see Contours
+        self.size = size                                                # maximum number of cached slices
+        self.prefetch = prefetch                                        # neighbouring slices computed ahead
+        self.queued = set()                                             # keys waiting for a worker
+        self.lock = threading.RLock()                                   # reentrant: volumes may be freed under it, see Release
+        self.pool = ThreadPoolExecutor(workers)                         # background workers
+
+    def Key(self, volume, ax, slice_, rot, levels, norm):
+        return (id(volume), ax, slice_, rot, tuple(levels), norm)
+
+    def Get(self, key, volume):
+        with self.lock:
+            entry = self.lines.get(key)
+            if entry is None or entry[0]() is not volume:  return None # id(volume) reused by another array
+            self.lines.move_to_end(key)
+            return entry[1]
+
+    def Put(self, key, volume, lines):
+        with self.lock:
+            self.lines[key] = (weakref.ref(volume, self.Release), lines)
+            self.lines.move_to_end(key)
+            while len(self.lines)>self.size:    self.lines.popitem(last=False)
+
+    def Release(self, ref):
+        """
+	Drop the lines of a volume that has been freed
+	"""
+        with self.lock:
+            for key in [k for k, entry in self.lines.items() if entry[0] is ref]:   del self.lines[key]
+
+    def Compute(self, dosi, volume, ax, slice_, rot, levels, norm):
+        key = self.Key(volume, ax, slice_, rot, levels, norm)
+        lines = self.Get(key, volume)
+        if lines is None:
+            image = dosi.image(ax, slice_, rot, volume)
+            lines = (np.shape(image), Contours(image, levels, norm))
+            self.Put(key, volume, lines)
+        return lines
+
+    def Prefetch(self, dosi, volume, ax, slice_, rot, levels, norm):
+        """
+	Queue the lines of the slices around 'slice_', nearest first
+	"""
+        n = np.shape(volume)[ax-1]
+        for d in range(1, self.prefetch+1):
+            for s in [slice_+d, slice_-d]:
+                if(s<0)or(s>=n):    continue
+                key = self.Key(volume, ax, s, rot, levels, norm)
+                if key in self.queued or self.Get(key, volume) is not None:  continue
+                self.queued.add(key)
+
+                def work(key=key, s=s, ref=weakref.ref(volume)):
+                    volume = ref()
+                    if volume is None:  # replaced before its turn
+                        self.queued.discard(key)
+                        return
+                    try:    self.Compute(dosi, volume, ax, s, rot, levels, norm)
+                    except Exception as e:  print('Isodose {0} failed: {1}'.format(key, e))
+                    finally:    self.queued.discard(key)
+
+                self.pool.submit(work)
+
+    def Lines(self, dosi, ct, ax, slice_ct, rot=False):
+        """
+	Return the isodose segments to overlay on the slice "slice_ct" along axis 'ax' of the CT volume,
+	in data coordinates, with the index of their level, or None if this slice is outside the dosimetry volume
+	"""
+        volume, slice_, grid = dosi.Source(ct, ax, slice_ct)
+        if(slice_<0):   return None
+
+        levels = np.asarray(dosi.levels, dtype=float)
+        norm = dosi.Statistics(volume)['slice max'][ax-1][slice_] if(dosi.showOption==1) else dosi.D_PTV
+        norm = float(norm)
+        (rows, cols), lines = self.Compute(dosi, volume, ax, slice_, rot, levels, norm)
+        self.Prefetch(dosi, volume, ax, slice_, rot, levels, norm)
+
+        # (column, row) to data coordinates, on the pixel centres of the dose image shown with imshow(extent=ext)
+        ext = grid.extent_(ax, rot)
+
+        segments, indices = [], []
+        for k, level_lines in lines:
+            for line in level_lines:
+                segments.append(PixelToExtent(line, ext, (rows, cols)))
+                indices.append(k)
+        return segments, np.array(indices, dtype=int)
+
+    def Clear(self):
+        with self.lock:
+            self.lines.clear()
@@ -0,0 +1,596 @@
+# -*- coding: utf-8 -*-
+###################################################
+#   	  Load DICOM CT, RT-DOSE and RT-STRUCT files,
+#   	  MetaImage and NIfTI images
+# 		   	----
+#           	P. Lansonneur 2019
+###################################################
+
+import numpy as np
+import pydicom, pydicom.uid
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+import threading
+from ROI import ROISet
+from Histogram import Histogram, FromSparse, VolumeHistogram, ValueHistogram
+
+class LoadCancelled(Exception):
+    """
+    Raised by the loaders when their 'cancel' event is set
+    """
+
+def Check(cancel):
+    if cancel is not None and cancel.is_set():  raise LoadCancelled('loading cancelled')
+
+def SlicePosition(ds):
+    """
+    Return the position (mm) of a slice along the scan axis
+    """
+    if('ImagePositionPatient' in ds):   return float(ds.ImagePositionPatient[2])
+    return float(ds.SliceLocation)
+
+def ReadDicomHeaders(filelist, workers=None):
+    """
+    Read the headers of a DICOM serie, stopping before the pixel data.
+    Return the file names and the headers sorted by slice position
+    """
+    with ThreadPoolExecutor(workers) as pool:
+        headers = list(pool.map(partial(pydicom.dcmread, stop_before_pixels=True), filelist))
+
+    order = np.argsort([SlicePosition(ds) for ds in headers], kind='stable')
+    return [filelist[i] for i in order], [headers[i] for i in order]
+
+def PixelType(ds):
+    """
+    Return the numpy type of the stored pixel values
+    """
+    return np.dtype(('u','i')[int(ds.PixelRepresentation)] + str(int(ds.BitsAllocated)//8))
+
+def DecodeSlice(filepath, volume, index, rescale=True):
+    """
+    Decode the pixel data of 'filepath' straight into volume[index,:,:]
+    """
+    ds = pydicom.dcmread(filepath)
+    if('TransferSyntaxUID' not in ds.file_meta):   ds.file_meta.TransferSyntaxUID = pydicom.uid.ImplicitVRLittleEndian
+    volume[index,:,:] = ds.pixel_array
+    if not rescale: return
+    if ("RescaleSlope" in ds):	volume[index,:,:] *= float(ds.RescaleSlope)
+    if ("RescaleIntercept" in ds):	volume[index,:,:] += float(ds.RescaleIntercept)
+
+def SerieGeometry(headers, compact=True):
+    """
+    Return the shape, the pixel type, the spacing, the origin, the slope and the intercept
+    of the volume of a sorted DICOM serie, from its headers only.
+    With compact=True and a serie-wide rescale, the raw pixel type (e.g. int16) is kept
+    and the rescale slope/intercept are to be applied per displayed slice.
+    Otherwise the volume is to be rescaled while decoding, as float32 (slope 1, intercept 0).
+    """
+    ds = headers[0]
+    slicelocation = np.array([SlicePosition(h) for h in headers])
+
+    slopes = set(float(h.get('RescaleSlope', 1.)) for h in headers)
+    intercepts = set(float(h.get('RescaleIntercept', 0.)) for h in headers)
+    compact = compact and len(slopes)==1 and len(intercepts)==1
+    slope, intercept = (slopes.pop(), intercepts.pop()) if compact else (1., 0.)
+
+    sp = ds.PixelSpacing
+    spacing = [float(slicelocation[1] - slicelocation[0]) if len(slicelocation)>1 else 1.,float(sp[1]), float(sp[0])]
+    origin = [float(slicelocation[0]),float(ds.ImagePositionPatient[1]),float(ds.ImagePositionPatient[0])]
+
+    shape = (len(headers), int(ds.Rows), int(ds.Columns))
+    return shape, PixelType(ds) if compact else np.dtype(np.float32), spacing, origin, slope, intercept
+
+class SliceStream():
+    """
+    Decoding state of a serie displayed while its slices are decoded:
+    the slices decoded so far, and the slice wanted by the viewer ('focus'),
+    around which the next slices are decoded.
+    """
+
+    def __init__(self, n, focus=0):
+
+        self.decoded = np.zeros(n, dtype=bool)                          # decoded slices
+        self.taken = np.zeros(n, dtype=bool)                            # slices decoded or being decoded
+        self.focus = focus                                              # slice to decode first, set by the viewer
+        self.lock = threading.Lock()
+
+    def Next(self):
+        """
+	Return the slice to decode next, the nearest to the focus, or None when all are taken
+	"""
+        with self.lock:
+            free = np.flatnonzero(~self.taken)
+            if not free.size:   return None
+            index = int(free[np.argmin(np.abs(free - self.focus))])
+            self.taken[index] = True
+            return index
+
+    def Count(self):
+        return int(np.count_nonzero(self.decoded))
+
+def DecodeSerie(filelist, volume, rescale=False, order=None, workers=None, progress=None, cancel=None, first=None, stream=None, histogram=None):
+    """
+    Decode the slices of a sorted DICOM serie into 'volume', in the order 'order' (all the slices by default),
+    or in the order asked by the SliceStream 'stream'.
+    The first slice is decoded before the others, on a thread pool.
+    progress(done, total) is called after each slice and first() after the first one.
+    The raw values of each slice are added to 'histogram' once decoded (see Histogram).
+    Raise LoadCancelled as soon as the event 'cancel' is set.
+    """
+    lock = threading.Lock()
+    count = [0]
+
+    def Decode(index):
+        Check(cancel)
+        DecodeSlice(filelist[index], volume, index, rescale)
+        if histogram is not None:   histogram.Add(volume[index])
+        if stream is not None:  stream.decoded[index] = True
+        with lock:
+            count[0] += 1
+            done = count[0]
+        if progress is not None:    progress(done, len(filelist) if stream is not None else len(order))
+
+    if stream is not None:
+        def Worker():
+            index = stream.Next()
+            while index is not None:
+                Decode(index)
+                index = stream.Next()
+
+        workers = workers or min(32, (os.cpu_count() or 1) + 4)
+        with ThreadPoolExecutor(workers) as pool:
+            for task in [pool.submit(Worker) for i in range(workers)]:  task.result()
+        return
+
+    order = list(range(len(filelist)) if order is None else order)
+    if not order:   return
+    Decode(order[0])
+    if first is not None:   first()
+    with ThreadPoolExecutor(workers) as pool:
+        list(pool.map(Decode, order[1:]))
+
+def ReadDicomSerie(filelist, workers=None, compact=True):
+    """
+    Read a DICOM serie.
+    The slices are sorted from their headers only, then decoded on a thread pool
+    straight into a preallocated volume at their final position (see SerieGeometry).
+    Return the volume, the spacing, the origin, the slope, the intercept and the sorted headers
+    """
+    filelist, headers = ReadDicomHeaders(filelist, workers)
+    shape, dtype, spacing, origin, slope, intercept = SerieGeometry(headers, compact)
+
+    volume = np.empty(shape, dtype=dtype)
+    DecodeSerie(filelist, volume, rescale=(dtype==np.float32), workers=workers) # float32 volumes are rescaled while decoding
+
+    return volume, spacing, origin, slope, intercept, headers
+
+def LoadDicomFile(ct, filepath, progress=None, cancel=None):
+    """
+    Load a single DICOM image (or multi-frame) file 'filepath' into the volume 'ct'.
+    progress(done, total) reports the loading, and the event 'cancel' stops it
+    """
+    ds = pydicom.read_file(filepath)
+    Check(cancel)
+    ds.file_meta.TransferSyntaxUID = pydicom.uid.ImplicitVRLittleEndian 
+    ct.volume = ds.pixel_array
+    ct.slope, ct.intercept = 1., 0.
+
+    try:
+        ct.spacing[0:1] = ds.PixelSpacing
+        ct.origin[0:1] = ds.ImagePositionPatient
+        
+    except Exception:
+        ct.spacing = ds.PixelSpacing
+        ct.origin = ds.ImagePositionPatient
+
+    if (ds.Modality == 'RTDOSE'):
+        if ("DoseGridScaling" in ds):	ct.volume = float(ds.DoseGridScaling)*ct.volume
+        
+    else:
+        if ("RescaleSlope" in ds):	ct.volume = float(ds.RescaleSlope)*ct.volume
+        if ("RescaleIntercept" in ds):	ct.volume = ct.volume + float(ds.RescaleIntercept)
+
+    if(len(np.shape(ct.volume))==3):
+        ct.spacing = [ float(ds.GridFrameOffsetVector[1] - ds.GridFrameOffsetVector[0]), float(ct.spacing[1]),float(ct.spacing[0])]
+        ct.origin = [float(ct.origin[2]),float(ct.origin[1]),float(ct.origin[0])]
+
+    ct_swapZ =(ds.ImageOrientationPatient[0:3] == [1, 0, 0])
+    ct_swapY =(ds.ImageOrientationPatient[3:6] == [0, 1, 0])
+
+    if(len(np.shape(ct.volume))==3):
+        ct.dim_x = np.shape(ct.volume)[0]
+        ct.dim_y = np.shape(ct.volume)[1]
+        ct.dim_z = np.shape(ct.volume)[2]
+
+        ### Dealing with image orientation
+        #print '  ct_swapY, ct_swapZ :', ct_swapY, ct_swapZ
+
+        if(ct_swapY == True):
+            # flip volume, Y direction
+            ct.volume = np.flip(ct.volume,1) 
+            ct.origin[1] = ct.origin[1] + ct.dim_y*ct.spacing[1]
+            
+        if(ct_swapZ == True):
+            # flip volume, Z direction
+            ct.volume = np.flip(ct.volume,2) 
+            ct.origin[2] = ct.origin[2] + ct.dim_z*ct.spacing[2]
+            
+        if(ct_swapZ == True)and(ct_swapY == True):      ct.spacing[1], ct.spacing[2] = ct.spacing[2], ct.spacing[1]
+        ct.direction = [1, -1 if ct_swapY else 1, -1 if ct_swapZ else 1]
+        
+    if(len(np.shape(ct.volume))==2):
+        ct.dim_x = np.shape(ct.volume)[0]
+        ct.dim_y = np.shape(ct.volume)[1]
+        ct.dim_z = 0
+
+    ct.histogram = ValueHistogram(ct.volume)
+    ct.open = True
+    if progress is not None:    progress(1, 1)
+    return ct
+
+def FindDicomFiles(dirname):
+    """
+    Return the DICOM files found in 'dirname' and its subdirectories,
+    sorted by modality: {'CT': [...], 'RTDOSE': [...], 'RTSTRUCT': [...], ...}
+    """
+    files = {}
+    for root, dirs, names in os.walk(dirname):
+        for name in sorted(names):
+            if not name.endswith('.dcm'):   continue
+            filepath = os.path.join(root, name)
+            ds = pydicom.dcmread(filepath, stop_before_pixels=True, specific_tags=['Modality'])
+            files.setdefault(str(ds.get('Modality', '')), []).append(filepath)
+    return files
+
+def LoadDicomSerie(ct, filelist, cache=None, progress=None, cancel=None, first=None):
+    """
+    Load the DICOM serie 'filelist' into the volume 'ct',
+    from the volume cache 'cache' if the serie is there.
+    The geometry of 'ct' is set from the headers and first(ct) is called at once,
+    so that the serie can be displayed while its slices are decoded: ct.stream tells the slices
+    decoded so far, and the slices nearest to ct.stream.focus are decoded first (see SliceStream).
+    progress(done, total) reports the decoded slices, and the event 'cancel' stops the loading (see DecodeSerie)
+    """
+    ct_swapY, ct_swapZ = False, False
+
+    # looking for a cached volume
+    ds = pydicom.dcmread(filelist[0], stop_before_pixels=True)
+    key = cache.Key(ds.get('SeriesInstanceUID', ''), filelist) if cache is not None else None
+    cached = cache.Load(key) if cache is not None else None
+
+    if cached is not None:
+        ct.volume, infos = cached
+        ct.spacing, ct.origin = infos['spacing'], infos['origin']
+        ct.slope, ct.intercept = infos.get('slope', 1.), infos.get('intercept', 0.)
+        ct.direction = infos.get('direction', [1, 1, 1])
+        ct.dim_x, ct.dim_y, ct.dim_z = np.shape(ct.volume)
+        if 'histogram' in infos:    ct.histogram = FromSparse(infos['histogram'])
+        else:   ct.histogram = VolumeHistogram(ct.volume, Histogram(low=0 if ct.volume.dtype.kind=='u' else -32768, slope=ct.slope, intercept=ct.intercept))
+
+    else:
+        # creating volume
+        filelist, headers = ReadDicomHeaders(filelist)
+        shape, dtype, ct.spacing, ct.origin, ct.slope, ct.intercept = SerieGeometry(headers)
+        Check(cancel)
+        volume = np.zeros(shape, dtype=dtype) # undecoded slices are blank
+        ct.volume = volume
+        ct.dim_x, ct.dim_y, ct.dim_z = np.shape(ct.volume)
+
+        ds = headers[0]
+        ct_swapZ =(ds.ImageOrientationPatient[0:3] == [1, 0, 0])
+        ct_swapY =(ds.ImageOrientationPatient[3:6] == [0, 1, 0])
+
+        # Dealing with image orientation
+        if ct_swapY:
+            ct.volume = np.flip(ct.volume,1) # flip volume, Y direction
+            ct.origin[1] += ct.dim_y*ct.spacing[1]
+
+        if ct_swapZ:
+            ct.volume = np.flip(ct.volume,2) # flip volume, Z direction
+            ct.origin[2] += ct.dim_z*ct.spacing[2]
+
+        if ct_swapZ and ct_swapY:   ct.spacing[1], ct.spacing[2] = ct.spacing[2], ct.spacing[1]
+        ct.direction = [1, -1 if ct_swapY else 1, -1 if ct_swapZ else 1]
+        ct.open = True
+
+        # decoding into the (possibly flipped) volume, from the middle slice outwards by default
+        ct.stream = SliceStream(len(filelist), focus=len(filelist)//2)
+        ct.histogram = Histogram(low=0 if dtype.kind=='u' else -32768, slope=ct.slope, intercept=ct.intercept)
+        if first is not None:   first(ct)
+        DecodeSerie(filelist, volume, rescale=(dtype==np.float32), progress=progress, cancel=cancel, stream=ct.stream, histogram=ct.histogram)
+        ct.stream = None
+
+        if cache is not None:
+            cache.Save(key, ct.volume, spacing=ct.spacing, origin=ct.origin, direction=ct.direction, slope=ct.slope, intercept=ct.intercept,
+                       histogram=ct.histogram.Sparse())
+
+    ct.open = True
+    return ct
+
+def LoadDosi(dosi, filepath, cache=None, progress=None, cancel=None):
+    """
+    Load the RT-DOSE file 'filepath' into the dosimetry volume 'dosi',
+    from the volume cache 'cache' if the file is there.
+    progress(done, total) reports the steps of the loading, and the event 'cancel' stops it
+    """
+    dosi_swapY,dosi_swapZ = False, False
+    report = progress if progress is not None else (lambda done, total: None)
+
+    ds = pydicom.dcmread(filepath, stop_before_pixels=True)
+    key = cache.Key(ds.get('SeriesInstanceUID', ''), [filepath]) if cache is not None else None
+    cached = cache.Load(key) if cache is not None else None
+
+    if cached is not None:
+        dosi.volume, infos = cached
+        dosi.spacing, dosi.origin = infos['spacing'], infos['origin']
+        dosi.direction = infos.get('direction', [1, 1, 1])
+        dosi.dim_x, dosi.dim_y, dosi.dim_z = np.shape(dosi.volume)
+        dosi.histogram = FromSparse(infos['histogram']) if 'histogram' in infos else ValueHistogram(dosi.volume)
+
+    else:
+        report(0, 3)
+        ds = pydicom.read_file(filepath)
+        ds.file_meta.TransferSyntaxUID = pydicom.uid.ImplicitVRLittleEndian 
+        Check(cancel)
+        raw = ds.pixel_array
+        dosi.volume = raw.astype(np.float32)
+        dosi.volume *= np.float32(ds.DoseGridScaling)
+        # histogram of the raw dose values, 65536 bins at most
+        dosi.histogram = VolumeHistogram(raw, Histogram(low=0, width=max(1, int(np.max(raw))//65536 + 1), slope=float(ds.DoseGridScaling)))
+        del raw
+        report(1, 3)
+        Check(cancel)
+        sp = ds.PixelSpacing
+        dosi.spacing = [ float(ds.GridFrameOffsetVector[1] - ds.GridFrameOffsetVector[0]), float(sp[1]),float(sp[0])]
+        dosi.origin = ds.ImagePositionPatient
+        dosi.origin = [float(dosi.origin[2]),float(dosi.origin[1]),float(dosi.origin[0])]
+        dosi_swapZ =(ds.ImageOrientationPatient[0:3] == [1, 0, 0])
+        dosi_swapY =(ds.ImageOrientationPatient[3:6] == [0, 1, 0])
+
+        dosi.dim_x = np.shape(dosi.volume)[0]
+        dosi.dim_y = np.shape(dosi.volume)[1]        
+        if(len(np.shape(dosi.volume))==3):   dosi.dim_z = np.shape(dosi.volume)[2]
+        if(len(np.shape(dosi.volume))==2):   dosi.dim_z = 1
+
+        # Dealing with image orientation
+        if(dosi_swapY == True):
+            dosi.volume = np.flip(dosi.volume,1) # flip volume
+            dosi.origin[1] += dosi.dim_y*dosi.spacing[1]		
+        if(dosi_swapZ == True):
+            dosi.volume = np.flip(dosi.volume,2) # flip volume
+            dosi.origin[2] += dosi.dim_z*dosi.spacing[2]
+        if(dosi_swapY == True)and(dosi_swapZ == True):
+            dosi.spacing[1], dosi.spacing[2] = dosi.spacing[2], dosi.spacing[1]
+
+        dosi.direction = [1, -1 if dosi_swapY else 1, -1 if dosi_swapZ else 1]
+        if cache is not None:
+            cache.Save(key, dosi.volume, spacing=dosi.spacing, origin=dosi.origin, direction=dosi.direction, histogram=dosi.histogram.Sparse())
+
+    report(2, 3)
+    Check(cancel)
+    dosi.open = True
+    dosi.ClearStatistics()
+    dosi.Statistics() # computed once on load
+    report(3, 3)
+    return dosi
+
+IMAGE_EXTENSIONS = ('.mhd', '.mha', '.nii', '.nii.gz')                   # images read with SimpleITK, see LoadImage
+
+# pixel types of the MetaImage and NIfTI-1 headers
+MET_TYPES = {'MET_CHAR': 'i1', 'MET_UCHAR': 'u1', 'MET_SHORT': 'i2', 'MET_USHORT': 'u2', 'MET_INT': 'i4', 'MET_UINT': 'u4',
+             'MET_LONG': 'i4', 'MET_ULONG': 'u4', 'MET_LONG_LONG': 'i8', 'MET_ULONG_LONG': 'u8', 'MET_FLOAT': 'f4', 'MET_DOUBLE': 'f8'}
+NIFTI_TYPES = {2: 'u1', 4: 'i2', 8: 'i4', 16: 'f4', 64: 'f8', 256: 'i1', 512: 'u2', 768: 'u4', 1024: 'i8', 1280: 'u8'}
+
+def MapMetaImage(filepath, shape):
+    """
+    Return the pixels of the uncompressed MetaImage 'filepath' (.mhd/.raw or .mha) memory-mapped read-only,
+    in the (z, y, x) 'shape', or None if they cannot be mapped (compressed, byte-swapped, several data files)
+    """
+    header, offset = {}, 0
+    with open(filepath, 'rb') as f:
+        for line in f:
+            offset += len(line)
+            key, _, value = line.decode('latin-1').partition('=')
+            header[key.strip()] = value.strip()
+            if(key.strip()=='ElementDataFile')or(offset>65536):  break
+
+    datafile = header.get('ElementDataFile', '')
+    if(header.get('CompressedData', 'False').lower()=='true')or(int(header.get('ElementNumberOfChannels', 1))!=1):  return None
+    if(datafile in ['', 'LIST'])or('%' in datafile)or(header.get('ElementType') not in MET_TYPES):   return None
+    msb = header.get('BinaryDataByteOrderMSB', header.get('ElementByteOrderMSB', 'False')).lower()=='true'
+    dtype = np.dtype(MET_TYPES[header['ElementType']]).newbyteorder('>' if msb else '<')
+    if not dtype.isnative:  return None
+
+    datapath = filepath if(datafile=='LOCAL') else os.path.join(os.path.dirname(filepath), datafile)
+    if(datafile!='LOCAL'):  offset = int(header.get('HeaderSize', 0))
+    nbytes = int(np.prod(shape))*dtype.itemsize
+    if(offset<0):   offset = os.path.getsize(datapath) - nbytes    # data at the end of the file
+    if(offset<0)or(os.path.getsize(datapath)<offset + nbytes):  return None
+    return np.memmap(datapath, dtype=dtype, mode='r', offset=offset, shape=tuple(shape))
+
+def MapNifti(filepath, shape):
+    """
+    Return the pixels of the uncompressed NIfTI-1 file 'filepath' memory-mapped read-only, in the (z, y, x) 'shape',
+    with their rescale slope and intercept, or None if they cannot be mapped
+    """
+    with open(filepath, 'rb') as f:     header = f.read(348)
+    if(len(header)<348):    return None
+    order = [o for o in '<>' if np.frombuffer(header, o + 'i4', 1, 0)[0]==348]
+    if not order:   return None # NIfTI-2
+    order = order[0]
+
+    datatype = int(np.frombuffer(header, order + 'i2', 1, 70)[0])
+    offset = int(np.frombuffer(header, order + 'f4', 1, 108)[0])
+    slope, intercept = [float(x) for x in np.frombuffer(header, order + 'f4', 2, 112)]
+    if datatype not in NIFTI_TYPES: return None
+    dtype = np.dtype(NIFTI_TYPES[datatype]).newbyteorder(order)
+    if not dtype.isnative:  return None
+    if(os.path.getsize(filepath)<offset + int(np.prod(shape))*dtype.itemsize):  return None
+    if(slope==0)or not np.isfinite(slope):  slope, intercept = 1., 0.   # no rescale
+    return np.memmap(filepath, dtype=dtype, mode='r', offset=offset, shape=tuple(shape)), slope, intercept
+
+def ReadImageChunks(reader, shape, cache=None, key=None, progress=None, cancel=None, chunk=16):
+    """
+    Read the image of the SimpleITK ImageFileReader 'reader' (image information read) by slabs of 'chunk' slices,
+    with its region extraction (streamed by the image readers supporting it), into a memory-mapped volume
+    of the cache 'cache' under 'key' if it is enabled (see VolumeCache.Create), or into memory.
+    progress(done, total) reports the slabs read, and the event 'cancel' stops the reading
+    """
+    import SimpleITK as sitk
+
+    cached = cache.Load(key) if cache is not None else None
+    if cached is not None:  return cached[0]
+
+    if(reader.GetDimension()==2):   return sitk.GetArrayFromImage(reader.Execute()).reshape(shape)
+
+    n, ny, nx = shape
+    array = None
+    for z in range(0, n, chunk):
+        Check(cancel)
+        reader.SetExtractIndex([0, 0, z])
+        reader.SetExtractSize([nx, ny, min(chunk, n - z)])
+        image = reader.Execute()
+        slab = sitk.GetArrayViewFromImage(image)                        # valid while 'image' is
+        if array is None:
+            array = cache.Create(key, shape, slab.dtype) if cache is not None else None
+            if array is None:   array = np.empty(shape, dtype=slab.dtype)
+        array[z:z+len(slab)] = slab
+        if progress is not None:    progress(min(z + chunk, n), n)
+
+    if isinstance(array, np.memmap):    array = cache.Commit(key, array)
+    return array
+
+def OrientImage(volume, array, origin, spacing, direction):
+    """
+    Set to 'volume' the pixels 'array', in the (z, y, x) index order of an ITK image, and its geometry:
+    origin and spacing along x, y, z and direction cosines (3x3, row-major), in mm.
+    The volume follows the conventions of the DICOM loaders: its axes are along the patient z, y and x axes,
+    z increasing and y, x decreasing with the index (see RTGeneralVolume.Position).
+    Axes are permuted and flipped as views of 'array', without copy. Oblique directions are rounded to the nearest axis.
+    """
+    D = np.reshape(np.asarray(direction, dtype=float), (3,3))          # column i: direction of the index axis i (x, y, z)
+    patient = list(np.argmax(np.abs(D), axis=0))                       # patient axis (x, y, z) of each index axis
+    if(len(set(patient))<3):    raise ValueError('unsupported image direction {0}'.format(list(direction)))
+    if(np.abs(D[patient, range(3)]).min()<0.999):   print('oblique image: directions rounded to the nearest axis')
+
+    # volume axis k is along the patient axis 2-k (z, y, x), index axis i is the array axis 2-i
+    index = [patient.index(2 - k) for k in range(3)]
+    array = np.transpose(array, [2 - i for i in index])
+    volume.origin, volume.spacing, volume.direction = [0., 0., 0.], [0., 0., 0.], [1, -1, -1]
+
+    for k, i in enumerate(index):
+        p, n = patient[i], np.shape(array)[k]
+        sign, step, o = np.sign(D[p,i]), float(spacing[i]), float(origin[p])
+        if(sign!=volume.direction[k]):
+            array = np.flip(array, k)
+            o += sign*(n - 1)*step                                      # first voxel after the flip
+        volume.origin[k] = o if(volume.direction[k]>0) else o + step   # origin of a flipped axis: one voxel past the first, see Position
+        volume.spacing[k] = step
+
+    volume.volume = array
+    volume.dim_x, volume.dim_y, volume.dim_z = np.shape(array)
+    return volume
+
+def ImageHistogram(volume):
+    """
+    Return the histogram of the values of a volume loaded at once (see Histogram)
+    """
+    raw = volume.volume
+    if(raw.dtype.kind in 'iu')and(raw.dtype.itemsize==2):
+        return VolumeHistogram(raw, Histogram(low=0 if raw.dtype.kind=='u' else -32768, slope=volume.slope, intercept=volume.intercept))
+    histogram = ValueHistogram(raw)
+    histogram.slope, histogram.intercept = histogram.slope*volume.slope, histogram.intercept*volume.slope + volume.intercept
+    return histogram
+
+def LoadImage(volume, filepath, cache=None, progress=None, cancel=None, chunk=16):
+    """
+    Load the MetaImage (.mhd/.raw, .mha) or NIfTI (.nii, .nii.gz) file 'filepath' into 'volume':
+    a RTCTVolume, or a RTDosiVolume (dose in Gy), with its spacing, origin and direction (see OrientImage).
+    Uncompressed pixels are memory-mapped from the file, without copy (see MapMetaImage and MapNifti).
+    Other files are read by slabs of 'chunk' slices (see ReadImageChunks), into a memory-mapped volume
+    of the volume cache 'cache' if it is enabled, so that files larger than the memory can be opened.
+    progress(done, total) reports the loading, and the event 'cancel' stops it
+    """
+    import SimpleITK as sitk
+    from Volume import RTDosiVolume
+    report = progress if progress is not None else (lambda done, total: None)
+
+    reader = sitk.ImageFileReader()
+    reader.SetFileName(filepath)
+    reader.ReadImageInformation()
+    if(reader.GetNumberOfComponents()!=1):  raise ValueError('images of {0} components are not supported'.format(reader.GetNumberOfComponents()))
+    if reader.GetDimension() not in [2, 3]: raise ValueError('images of {0} dimensions are not supported'.format(reader.GetDimension()))
+
+    size, origin, spacing, direction = reader.GetSize(), reader.GetOrigin(), reader.GetSpacing(), reader.GetDirection()
+    if(reader.GetDimension()==2):   # a single slice
+        size, origin, spacing = size + (1,), origin + (0.,), spacing + (1.,)
+        direction = direction[0:2] + (0.,) + direction[2:4] + (0., 0., 0., 1.)
+    shape = (size[2], size[1], size[0])
+    Check(cancel)
+
+    array, slope, intercept = None, 1., 0.
+    name = filepath.lower()
+    if name.endswith(('.mhd', '.mha')): array = MapMetaImage(filepath, shape)
+    if name.endswith('.nii'):
+        mapped = MapNifti(filepath, shape)
+        if mapped is not None:  array, slope, intercept = mapped
+
+    if array is None:
+        key = cache.Key(filepath, [filepath]) if cache is not None else None
+        array = ReadImageChunks(reader, shape, cache, key, lambda done, total: report(done, total + 1), cancel, chunk)
+
+    if isinstance(volume, RTDosiVolume) and (array.dtype!=np.float32 or slope!=1 or intercept!=0):
+        # doses in Gy, as float32, slab by slab
+        dose = np.empty(shape, dtype=np.float32)
+        for z in range(0, shape[0], chunk):
+            Check(cancel)
+            dose[z:z+chunk] = array[z:z+chunk]*np.float32(slope) + np.float32(intercept)
+        array, slope, intercept = dose, 1., 0.
+
+    OrientImage(volume, array, origin, spacing, direction)
+    volume.slope, volume.intercept = slope, intercept
+    Check(cancel)
+    volume.histogram = ImageHistogram(volume)
+    volume.open = True
+    if isinstance(volume, RTDosiVolume):
+        volume.ClearStatistics()
+        volume.Statistics() # computed once on load
+    report(1, 1)
+    return volume
+
+def LoadROI(filepath, ct=None, progress=None, cancel=None, workers=None):
+    """
+    Return the ROI set of the RT-STRUCT file 'filepath', its ROIs being read on 'workers' threads.
+    If the CT volume 'ct' is open, the contours of each of its slices are indexed.
+    progress(done, total) reports the ROIs read, and the event 'cancel' stops the loading
+    """
+    roiset = ROISet()
+    ds = pydicom.read_file(filepath)
+    roiset.N_ROI = len(ds.StructureSetROISequence)
+    roiset.infos = np.empty((roiset.N_ROI,7), dtype=np.object)
+
+    count = [0]
+    lock = threading.Lock()
+
+    def Read(ROI_index):
+        Check(cancel)
+        roiset.GetInfos(ds,ROI_index) # retrieve the info of the ROI
+        with lock:
+            count[0] += 1
+            done = count[0]
+        if progress is not None:    progress(done, roiset.N_ROI)
+
+    # ROIs are parsed in parallel, once pydicom has parsed the sequences they share
+    ds.ROIContourSequence, ds.StructureSetROISequence
+    with ThreadPoolExecutor(workers) as pool:
+        list(pool.map(Read, range(roiset.N_ROI)))
+##        isPTV = roiset.infos[ROI_index,0].upper().startswith('PTV')
+##        isCTV = roiset.infos[ROI_index,0].upper().startswith('CTV')
+##        isGTV = roiset.infos[ROI_index,0].upper().startswith('GTV')
+##        if(isPTV or isCTV or isGTV):    roiset.infos[ROI_index,6] = roiset.ROI_3D(roiset.infos, ROI_index)
+
+    if ct is not None and ct.open:  roiset.SliceIndex(ct) # contours of each CT slice
+
+    roiset.open = True
+    return roiset
@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+###################################################
+#   	  Oblique and curved reslicing of the volumes
+# 		   	----
+#           	P. Lansonneur 2019
+###################################################
+
+import numpy as np
+import copy
+import threading
+from collections import OrderedDict
+
+def Rotation(axis, angle):
+    """
+    Return the matrix of the rotation of 'angle' degrees about the vector 'axis'
+    """
+    x, y, z = np.asarray(axis, dtype=float)/np.linalg.norm(axis)
+    c, s = np.cos(np.deg2rad(angle)), np.sin(np.deg2rad(angle))
+    return np.array([[c + x*x*(1-c),   x*y*(1-c) - z*s, x*z*(1-c) + y*s],
+                     [y*x*(1-c) + z*s, c + y*y*(1-c),   y*z*(1-c) - x*s],
+                     [z*x*(1-c) - y*s, z*y*(1-c) + x*s, c + z*z*(1-c)]])
+
+def Extent(shape, pixel, left, stride=1):
+    """
+    Return the extent of an image of 'shape' pixels of 'pixel' mm starting at 'left' (mm),
+    centred vertically, sampled every 'stride' pixels
+    """
+    (rows, cols), p = shape, pixel
+    h, w = -(-rows//stride), -(-cols//stride)
+    x0, y1 = left + p/2. - stride*p/2., rows*p/2. - p/2. + stride*p/2.
+    return np.array([x0, x0 + w*stride*p, y1 - h*stride*p, y1])
+
+def PixelToExtent(line, extent, shape):
+    """
+    Return the (N,2) (column, row) coordinates 'line' of an image of 'shape' pixels
+    in the data coordinates of the image displayed with 'extent', e.g. contours (see Isodose.Contours)
+    """
+    rows, cols = shape
+    return np.column_stack([extent[0] + (line[:,0] + 0.5)*(extent[1] - extent[0])/cols,
+                            extent[3] - (line[:,1] + 0.5)*(extent[3] - extent[2])/rows])
+
+class Plane():
+    """
+    Oblique plane, in patient coordinates (mm) along the volume axes (see RTGeneralVolume.Position):
+    through 'centre', of unit normal 'normal', with the unit vectors 'u' along its columns (left to right)
+    and 'v' along its rows (bottom to top), sampled on 'shape' (rows, columns) pixels of 'pixel' mm.
+    """
+
+    def __init__(self, centre, normal, u, v, shape=(256,256), pixel=1.):
+
+        self.centre = np.asarray(centre, dtype=float)                   # centre of the plane
+        self.normal = np.asarray(normal, dtype=float)/np.linalg.norm(normal)
+        self.u = np.asarray(u, dtype=float)/np.linalg.norm(u)           # columns direction
+        self.v = np.asarray(v, dtype=float)/np.linalg.norm(v)           # rows direction (upwards)
+        self.shape = (int(shape[0]), int(shape[1]))                     # rows, columns
+        self.pixel = float(pixel)                                       # pixel size (mm)
+
+    def Offset(self):
+        """
+	Return the position of the plane along its normal (mm)
+	"""
+        return float(np.dot(self.centre, self.normal))
+
+    def Moved(self, distance):
+        """
+	Return a copy of the plane moved by 'distance' mm along its normal
+	"""
+        plane = copy.copy(self)
+        plane.centre = self.centre + distance*self.normal
+        return plane
+
+    def Rotate(self, axis, angle):
+        """
+	Rotate the plane by 'angle' degrees about the vector 'axis' through its centre
+	"""
+        R = Rotation(axis, angle)
+        self.normal, self.u, self.v = R.dot(self.normal), R.dot(self.u), R.dot(self.v)
+
+    def Key(self):
+        """
+	Return the geometry of the sampling grid of the plane, whatever its offset along its normal
+	"""
+        through = self.centre - self.Offset()*self.normal              # centre projected on the parallel plane through 0
+        return ('plane',) + tuple(np.round(np.concatenate([through, self.normal, self.u, self.v]), 6)) + self.shape + (self.pixel,)
+
+    def Points(self):
+        """
+	Return the (3, rows, columns) coordinates (mm) of the pixel centres of the plane at offset 0
+	"""
+        rows, cols = self.shape
+        h = (np.arange(cols) - (cols - 1)/2.)*self.pixel
+        v = ((rows - 1)/2. - np.arange(rows))*self.pixel
+        through = self.centre - self.Offset()*self.normal
+        return through[:,None,None] + self.u[:,None,None]*h[None,None,:] + self.v[:,None,None]*v[None,:,None]
+
+    def Steps(self):
+        """
+	Return the (3,1,1) displacement (mm) of the pixels per mm of offset
+	"""
+        return self.normal[:,None,None]
+
+    def Extent(self, stride=1):
+        """
+	Return the extent of the plane images (mm, relative to its centre), see Reslicer.Reslice
+	"""
+        return Extent(self.shape, self.pixel, -self.shape[1]*self.pixel/2., stride)
+
+class CurvedPlane():
+    """
+    Curved plane: the surface swept by the polyline 'curve' ((N,3) coordinates in mm) along the unit vector 'axis',
+    sampled every 'pixel' mm along the curve (columns) and along 'axis' over 'height' mm centred on the curve (rows).
+    Its offset moves the curve along its local normal, perpendicular to 'axis'.
+    """
+
+    def __init__(self, curve, axis, height=200., pixel=1., offset=0.):
+
+        self.curve = np.asarray(curve, dtype=float)                     # vertices of the curve
+        self.axis = np.asarray(axis, dtype=float)/np.linalg.norm(axis)  # sweep direction (upwards)
+        self.pixel = float(pixel)                                       # pixel size (mm)
+        self.offset = float(offset)                                     # displacement along the local normal (mm)
+
+        # curve resampled every pixel along its length
+        lengths = np.concatenate([[0], np.cumsum(np.linalg.norm(np.diff(self.curve, axis=0), axis=1))])
+        s = np.arange(0, lengths[-1] + 1e-9, self.pixel)
+        self.samples = np.array([np.interp(s, lengths, self.curve[:,i]) for i in range(3)])  # (3, columns)
+        self.length = lengths[-1]
+        self.shape = (max(int(round(height/self.pixel)), 1), len(s))
+
+    def Offset(self):
+        return self.offset
+
+    def Moved(self, distance):
+        plane = copy.copy(self)
+        plane.offset = self.offset + distance
+        return plane
+
+    def Key(self):
+        return ('curve', self.curve.tobytes(), tuple(np.round(self.axis, 6)), self.shape, self.pixel)
+
+    def Points(self):
+        rows = self.shape[0]
+        v = ((rows - 1)/2. - np.arange(rows))*self.pixel
+        return self.samples[:,None,:] + self.axis[:,None,None]*v[None,:,None]
+
+    def Steps(self):
+        """
+	Return the (3,1,columns) local normals of the curve, perpendicular to its axis
+	"""
+        tangent = np.gradient(self.samples, axis=1) if self.shape[1]>1 else np.zeros((3,1))
+        normal = np.cross(self.axis[:,None], tangent, axis=0)
+        norm = np.linalg.norm(normal, axis=0)
+        normal[:, norm>0] /= norm[norm>0]
+        return normal[:,None,:]
+
+    def Extent(self, stride=1):
+        return Extent(self.shape, self.pixel, 0., stride)
+
+def ViewPlane(volume, view, tilt=0., spin=0., size=512):
+    """
+    Return the plane through the centre of 'volume' oriented as the view along axis 'view' (rotated, see RTMainWindow.rot1),
+    tilted by 'tilt' degrees about its horizontal axis and spun by 'spin' degrees about its vertical axis.
+    It covers the volume in any orientation, on 'size' pixels per side at most.
+    """
+    k = view - 1
+    a, b = [i for i in range(3) if i!=k]                                # axes along the rows and the columns of the view
+    e = np.eye(3)
+    direction = np.asarray(volume.direction, dtype=float)
+    shape = np.array(np.shape(volume.volume))
+    spacing = np.abs(np.asarray(volume.spacing, dtype=float))
+
+    centre = [float(volume.Position(i, (shape[i] - 1)/2.)) for i in range(3)]
+    diagonal = float(np.linalg.norm(shape*spacing))
+    pixel = max(min(spacing), diagonal/size)
+    n = 2*int(np.ceil(diagonal/pixel/2.)) + 1                         # odd: a pixel at the centre
+
+    plane = Plane(centre, e[k]*direction[k], e[b]*direction[b], e[a]*direction[a], (n, n), pixel)
+    if tilt:    plane.Rotate(plane.u, tilt)
+    if spin:    plane.Rotate(plane.v, spin)
+    return plane
+
+class Reslicer():
+    """
+    Reslicing of volumes on oblique or curved planes, in a single map_coordinates call per plane.
+    The voxel indices of the pixels of a plane are computed once per plane and volume geometry
+    (least recently used cache): moving the plane along its normal only adds its offset times its steps.
+    """
+
+    def __init__(self, size=8):
+
+        self.grids = OrderedDict()                                      # voxel indices and steps of each plane and volume geometry
+        self.size = size                                                # maximum number of cached grids
+        self.lock = threading.Lock()
+
+    def Grid(self, plane, volume):
+        """
+	Return the (3, rows, columns) fractional voxel indices in 'volume' of the pixels of 'plane' at offset 0,
+	and the indices displacement per mm of offset (see Plane.Steps)
+	"""
+        key = (plane.Key(), np.shape(volume.volume), tuple(np.ravel(volume.origin).tolist()),
+               tuple(np.ravel(volume.spacing).tolist()), tuple(np.ravel(volume.direction).tolist()))
+        with self.lock:
+            entry = self.grids.get(key)
+            if entry is not None:
+                self.grids.move_to_end(key)
+                return entry
+
+        points, steps = plane.Points(), plane.Steps()
+        base = np.empty(np.shape(points), dtype=np.float32)
+        step = np.empty(np.shape(steps), dtype=np.float32)
+        for ax in range(3):
+            base[ax] = volume.Index(ax, points[ax])
+            step[ax] = volume.Index(ax, steps[ax]) - volume.Index(ax, 0.)
+
+        with self.lock:
+            self.grids[key] = (base, step)
+            while len(self.grids)>self.size:    self.grids.popitem(last=False)
+        return base, step
+
+    def Coordinates(self, plane, volume, stride=1):
+        """
+	Return the (3, rows, columns) fractional voxel indices in 'volume' of the pixels of 'plane',
+	one pixel out of 'stride' along each side
+	"""
+        base, step = self.Grid(plane, volume)
+        if(stride>1):   base, step = base[:,::stride,::stride], step[:,:,::stride]
+        return base + np.float32(plane.Offset())*step
+
+    def Reslice(self, plane, volume, data=None, stride=1, order=1, cval=np.nan):
+        """
+	Return the image (float32) of the volume 'volume', or of the array 'data' on its grid, on 'plane'
+	(trilinear interpolation by default, 'cval' outside the volume).
+	With 'stride', one pixel out of 'stride' is computed along each side (see Plane.Extent),
+	e.g. while the plane is moved.
+	"""
+        from scipy.ndimage import map_coordinates
+        data = volume.volume if data is None else data
+        return map_coordinates(data, self.Coordinates(plane, volume, stride), order=order, mode='constant', cval=cval, output=np.float32)
+
+    def Mask(self, plane, roiset, i, grid, stride=1):
+        """
+	Return the boolean image of the ROI 'i' on 'plane', from its cached mask on the grid of the volume 'grid'
+	(see ROISet.MaskBox), nearest voxel
+	"""
+        from scipy.ndimage import map_coordinates
+        box, mask = roiset.MaskBox(i, grid)
+        coordinates = self.Coordinates(plane, grid, stride)
+        if not mask.size:   return np.zeros(np.shape(coordinates)[1:], dtype=bool)
+        coordinates -= np.array([s.start for s in box], dtype=np.float32)[:,None,None]
+        return map_coordinates(mask.view(np.uint8), coordinates, order=0, mode='constant', cval=0, output=np.uint8)>0
+
+    def Clear(self):
+        with self.lock:
+            self.grids.clear()
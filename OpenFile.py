@@ -1,34 +1,88 @@
-import matplotlib.pyplot as P
-import numpy as np
-import SimpleITK as sitk
-import pydicom, pydicom.uid
-from pydicom.dataset import Dataset, FileDataset
-import datetime, time
 import os
-import vtk
-from vtk.qt.QVTKRenderWindowInteractor import QVTKRenderWindowInteractor
 import warnings
 warnings.filterwarnings("ignore", message="numpy.dtype size changed")
 warnings.filterwarnings("ignore", message="No contour levels were found")
 warnings.filterwarnings("ignore", message="converting a masked element to nan")
-from matplotlib.path import Path
-import matplotlib.patches as patches
-from scipy.ndimage import rotate, zoom, map_coordinates
-from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg
-from matplotlib.figure import Figure
-import sys
-from fbs_runtime.application_context.PyQt5 import ApplicationContext
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from PyQt5.QtWidgets import QFileDialog
-from PyQt5 import QtCore, QtGui, Qt
-from PyQt5.QtWidgets import *
-from ROI import ROISet
+from PyQt5 import QtCore
+from Volume import RTCTVolume, RTDosiVolume
+# pydicom and the loaders are imported on first use, to start faster
+
+class LoadTask(QtCore.QObject):
+    """
+    Run a loader of Loaders.py on a background worker, with a 'cancel' event.
+    Signals deliver its progress, its preview (see LoadDicomSerie) and its result to the GUI thread.
+    """
+    progress = QtCore.pyqtSignal(int, int)                              # done, total
+    preview = QtCore.pyqtSignal(object)                                 # volume being loaded
+    done = QtCore.pyqtSignal(object)                                    # loaded volume or ROI set
+    failed = QtCore.pyqtSignal(object)                                  # exception raised
+    pool = ThreadPoolExecutor(1)                                        # loads run one after the other
+
+    def __init__(self, function, *args, preview=False, **kwargs):
+
+        super().__init__()
+        self.cancel = threading.Event()                                 # set to stop the loading
+        self.function, self.args, self.kwargs = function, args, kwargs
+        if preview: self.kwargs['first'] = self.preview.emit
+
+    def Start(self):
+        self.pool.submit(self.Run)
+
+    def Run(self):
+        try:    result = self.function(*self.args, progress=self.progress.emit, cancel=self.cancel, **self.kwargs)
+        except Exception as e:  self.failed.emit(e)
+        else:   self.done.emit(result)
+
+def StartLoad(self, task, message, done, preview=None, failed=None, success='file successfully opened!'):
+    """
+    Start a LoadTask, showing its progress and a cancel button in the status bar.
+    done(result), preview(volume) and failed(exception) are called in the GUI thread.
+    """
+    from Loaders import LoadCancelled
+
+    def Failed(e):
+        if failed is not None:  failed(e)
+        EndLoad(self, task, 'Loading cancelled' if isinstance(e, LoadCancelled) else 'Loading failed: {0}'.format(e))
+
+    self.loads.add(task)
+    self.statusBar().showMessage(message)
+    self.progressBar.setValue(0)
+    self.progressBar.show()
+    self.cancelButton.show()
+
+    task.progress.connect(self.OnLoadProgress)
+    if preview is not None: task.preview.connect(preview)
+    task.done.connect(done)
+    task.done.connect(lambda result: EndLoad(self, task, success))
+    task.failed.connect(Failed)
+    task.Start()
+
+def EndLoad(self, task, message):
+    self.loads.discard(task)
+    if not self.loads:
+        self.progressBar.hide()
+        self.cancelButton.hide()
+    self.statusBar().showMessage(message)
+
+def OnLoadProgress(self, done, total):
+    self.progressBar.setMaximum(max(total, 1))
+    self.progressBar.setValue(done)
+
+def CancelLoads(self):
+    """
+    Stop the loads in progress, keeping the data opened before them
+    """
+    for task in self.loads: task.cancel.set()
 
 def OpenFile(self, filepath=None):
 
     self.statusBar().showMessage('Opening file ...')
 
     if(filepath==False):
-        filepath, _ = QFileDialog.getOpenFileNames(self, "Open file","./","All file (*.dcm *.mhd)")
+        filepath, _ = QFileDialog.getOpenFileNames(self, "Open file","./","All file (*.dcm *.mhd *.mha *.nii *.nii.gz)")
         filepath = filepath[0]
         filename = QtCore.QFileInfo(filepath[0]).fileName()
         filedir = QtCore.QFileInfo(filepath[0]).path() # +'/'
@@ -36,200 +90,106 @@ def OpenFile(self, filepath=None):
 
     ### .dcm file ###
     if(filepath.endswith('.dcm')==True):    OpenDicomFile(self, filepath)
+
+    ### MetaImage and NIfTI files ###
+    from Loaders import IMAGE_EXTENSIONS
+    if filepath.lower().endswith(IMAGE_EXTENSIONS): OpenImage(self, filepath)
         
 def OpenDicomFile(self, filepath):
-        
-    ds = pydicom.read_file(filepath)
-    ds.file_meta.TransferSyntaxUID = pydicom.uid.ImplicitVRLittleEndian 
-    self.myCTVolume.volume = ds.pixel_array
+    """
+    Open a single DICOM file, on a background worker
+    """
+    from Loaders import LoadDicomFile
 
-    try:
-        self.myCTVolume.spacing[0:1] = ds.PixelSpacing
-        self.myCTVolume.origin[0:1] = ds.ImagePositionPatient
-        
-    except Exception:
-        self.myCTVolume.spacing = ds.PixelSpacing
-        self.myCTVolume.origin = ds.ImagePositionPatient
+    def Done(ct):
+        self.myCTVolume.Assign(ct)
+        #self.Set_axes_lim_init()
+        self.SetScales()
+        self.update()
 
-    if (ds.Modality == 'RTDOSE'):
-        if ("DoseGridScaling" in ds):	self.myCTVolume.volume = float(ds.DoseGridScaling)*self.myCTVolume.volume
-        
-    else:
-        if ("RescaleSlope" in ds):	self.myCTVolume.volume = float(ds.RescaleSlope)*self.myCTVolume.volume
-        if ("RescaleIntercept" in ds):	self.myCTVolume.volume = self.myCTVolume.volume + float(ds.RescaleIntercept)
-
-    if(len(np.shape(self.myCTVolume.volume))==3):
-        self.myCTVolume.spacing = [ float(ds.GridFrameOffsetVector[1] - ds.GridFrameOffsetVector[0]), float(self.myCTVolume.spacing[1]),float(self.myCTVolume.spacing[0])]
-        self.myCTVolume.origin = [float(self.myCTVolume.origin[2]),float(self.myCTVolume.origin[1]),float(self.myCTVolume.origin[0])]
-
-    ct_swapZ =(ds.ImageOrientationPatient[0:3] == [1, 0, 0])
-    ct_swapY =(ds.ImageOrientationPatient[3:6] == [0, 1, 0])
-
-    if(len(np.shape(self.myCTVolume.volume))==3):
-        self.myCTVolume.dim_x = np.shape(self.myCTVolume.volume)[0]
-        self.myCTVolume.dim_y = np.shape(self.myCTVolume.volume)[1]
-        self.myCTVolume.dim_z = np.shape(self.myCTVolume.volume)[2]
-
-        ### Dealing with image orientation
-        #print '  ct_swapY, ct_swapZ :', ct_swapY, ct_swapZ
-
-        if(ct_swapY == True):
-            # flip volume, Y direction
-            self.myCTVolume.volume = np.flip(self.myCTVolume.volume,1) 
-            self.myCTVolume.origin[1] = self.myCTVolume.origin[1] + self.myCTVolume.dim_y*self.myCTVolume.spacing[1]
-            
-        if(ct_swapZ == True):
-            # flip volume, Z direction
-            self.myCTVolume.volume = np.flip(self.myCTVolume.volume,2) 
-            self.myCTVolume.origin[2] = self.myCTVolume.origin[2] + self.myCTVolume.dim_z*self.myCTVolume.spacing[2]
-            
-        if(ct_swapZ == True)and(ct_swapY == True):      self.myCTVolume.spacing[1], self.myCTVolume.spacing[2] = self.myCTVolume.spacing[2], self.myCTVolume.spacing[1]
-        
-    if(len(np.shape(self.myCTVolume.volume))==2):
-        self.myCTVolume.dim_x = np.shape(self.myCTVolume.volume)[0]
-        self.myCTVolume.dim_y = np.shape(self.myCTVolume.volume)[1]
-        self.myCTVolume.dim_z = 0
+    StartLoad(self, LoadTask(LoadDicomFile, RTCTVolume(), filepath), 'Opening file ...', Done)
 
-    self.myCTVolume.open = True
-    
-    #self.Set_axes_lim_init()
-    self.SetScales()
-    self.update()
-        
-    self.statusBar().showMessage('file successfully opened!')
+def OpenImage(self, filepath):
+    """
+    Open a MetaImage (.mhd/.raw, .mha) or NIfTI (.nii, .nii.gz) CT, on a background worker (see LoadImage)
+    """
+    from Loaders import LoadImage
+
+    def Done(ct):
+        self.myCTVolume.Assign(ct)
+        self.SetScales()
+        self.UpdateAll()
+
+    StartLoad(self, LoadTask(LoadImage, RTCTVolume(), filepath, self.myCache), 'Opening image ...', Done)
     
 def OpenDicomSerie(self, dirname=None):
     """
     Open a dicom serie
     """
-    ct_swapY, ct_swapZ = False, False
-    self.statusBar().showMessage('Opening DICOM serie ... ')
-
     # Opening file
     if(dirname==False):
         filepath, _ = QFileDialog.getOpenFileNames(self, "Open file","./","DICOM (*.dcm)")
         filepath = filepath[0]
         filename = QtCore.QFileInfo(filepath[0]).fileName()
         filedir = QtCore.QFileInfo(filepath[0]).path() # +'/'
-        filelist = os.listdir(os.path.dirname(filepath))
-        #print(filelist)
-        
-    else:
-        filelist = os.listdir(dirname)
-        filepath = dirname + filelist[0]
-
-    #filename_CT = file_path
-    #dir_ini = str(file_path.rsplit('/', 1)[0])+'/'
-
-    # Getting dimensions
-    ds = pydicom.read_file(filepath)
-    sp = ds.PixelSpacing
-    ds.file_meta.TransferSyntaxUID = pydicom.uid.ImplicitVRLittleEndian
-    ct_swapZ =(ds.ImageOrientationPatient[0:3] == [1, 0, 0])
-    ct_swapY =(ds.ImageOrientationPatient[3:6] == [0, 1, 0])
-
-    self.myCTVolume.dim_x = 0
-    for f in filelist:
-        if f.endswith(".dcm"): self.myCTVolume.dim_x += 1        
-
-    self.myCTVolume.dim_y, self.myCTVolume.dim_z = np.shape(ds.pixel_array)[1], np.shape(ds.pixel_array)[0]
-
-    self.myCTVolume.volume = np.zeros((self.myCTVolume.dim_x, self.myCTVolume.dim_y,self.myCTVolume.dim_z))
-    slicelocation = np.zeros(self.myCTVolume.dim_x)
-
-    # creating volume
-    for f,i in zip(filelist,range(self.myCTVolume.dim_x)):
-        if f.endswith(".dcm"):
-            ds = pydicom.read_file(os.path.dirname(filepath)+'/'+f)
-            ds.file_meta.transfersyntaxuid = pydicom.uid.ImplicitVRLittleEndian 
-            self.myCTVolume.volume[i,:,:] = ds.pixel_array
-            if('slicelocation' in ds):  slicelocation[i] = ds.SliceLocation
-            else:   slicelocation[i] = ds.ImagePositionPatient[2]
-
-    order = np.argsort(slicelocation)
-    slicelocation = slicelocation[order] # slicelocation is now sorted
-
-    self.myCTVolume.spacing = [float(slicelocation[1] - slicelocation[0]),float(sp[1]), float(sp[0])]
-    self.myCTVolume.origin = [float(slicelocation[0]),float(ds.ImagePositionPatient[1]),float(ds.ImagePositionPatient[0])]
-    self.myCTVolume.volume = self.myCTVolume.volume[order,:,:] # volume is now sorted
-
-    if ("RescaleSlope" in ds):	self.myCTVolume.volume *= float(ds.RescaleSlope)
-    if ("RescaleIntercept" in ds):	self.myCTVolume.volume += float(ds.RescaleIntercept)
-
-    # Dealing with image orientation
-    print('ct_swapY, ct_swapZ :', ct_swapY, ct_swapZ)
-    
-    if ct_swapY:
-        self.myCTVolume.volume = np.flip(self.myCTVolume.volume,1) # flip volume, Y direction
-        self.myCTVolume.origin[1] += self.myCTVolume.dim_y*self.myCTVolume.spacing[1]
-
-    if ct_swapZ:
-        self.myCTVolume.volume = np.flip(self.myCTVolume.volume,2) # flip volume, Z direction
-        self.myCTVolume.origin[2] += self.myCTVolume.dim_z*self.myCTVolume.spacing[2]
-        
-    if ct_swapZ and ct_swapY:   self.myCTVolume.spacing[1], self.myCTVolume.spacing[2] = self.myCTVolume.spacing[2], self.myCTVolume.spacing[1]
-
-    #self.Set_axes_lim_init()
-    self.SetScales()
-    self.myCTVolume.open = True
-    self.UpdateAll()
-
-    self.statusBar().showMessage('file successfully opened!')
+        dirname = os.path.dirname(filepath)
+
+    from Loaders import LoadDicomSerie
+    filelist = [os.path.join(dirname, f) for f in os.listdir(dirname) if f.endswith(".dcm")]
+    previous = RTCTVolume()
+    previous.Assign(self.myCTVolume)
+
+    def Show(ct):
+        """
+        Show the serie as soon as its geometry is known, its slices being decoded (see LoadDicomSerie)
+        """
+        self.myCTVolume.Assign(ct)
+        #self.Set_axes_lim_init()
+        self.SetScales()
+        self.UpdateAll()
+
+    def Done(ct):
+        if self.myCTVolume.volume is not ct.volume: Show(ct)
+        self.myCTVolume.Assign(ct) # pyramid and display range of the complete volume, see Volume.Pyramid
+        self.myWindowLevel.autoFrom = None
+        self.UpdateAll()
+
+    def Failed(e):
+        if self.myCTVolume.volume is not previous.volume:
+            self.myCTVolume.Assign(previous)
+            self.SetScales()
+            self.UpdateAll()
+
+    task = LoadTask(LoadDicomSerie, RTCTVolume(), filelist, self.myCache, preview=True)
+    task.progress.connect(lambda done, total: self.RefreshStream())
+    StartLoad(self, task, 'Opening DICOM serie ... ', Done, Show, Failed)
 
 def OpenDosi(self,filepath=None): 
     """
-    Open a dosimetry file with a .dcm or .mhd extension
+    Open a dosimetry file: RT-DOSE (.dcm), MetaImage (.mhd, .mha) or NIfTI (.nii, .nii.gz) in Gy
     """
 
-    dosi_swapY,dosi_swapZ = False, False
-
-    types = [('All files', '*.dcm *.mhd'), ('DCM files', '*.dcm'), ('MHD files', '*.mhd')]
+    types = [('All files', '*.dcm *.mhd *.mha *.nii *.nii.gz'), ('DCM files', '*.dcm'), ('MHD files', '*.mhd *.mha'), ('NIfTI files', '*.nii *.nii.gz')]
 
     if(filepath==False):
-        filepath, _ = QFileDialog.getOpenFileNames(self, "Open file","./","DICOM (*.dcm)")
+        filepath, _ = QFileDialog.getOpenFileNames(self, "Open file","./",";;".join(['{0} ({1})'.format(*t) for t in types]))
         filepath = filepath[0]
         filename = QtCore.QFileInfo(filepath[0]).fileName()
         filedir = QtCore.QFileInfo(filepath[0]).path() # +'/'
 
-    self.statusBar().showMessage('Importing RD file ...')
+    from Loaders import LoadDosi, LoadImage, IMAGE_EXTENSIONS
 
-    ### .dcm file ###
-    if(filepath.endswith('.dcm')):
-        ds = pydicom.read_file(filepath)
-        ds.file_meta.TransferSyntaxUID = pydicom.uid.ImplicitVRLittleEndian 
-        self.myDosiVolume.volume = float(ds.DoseGridScaling)*ds.pixel_array
-        sp = ds.PixelSpacing
-        self.myDosiVolume.spacing = [ float(ds.GridFrameOffsetVector[1] - ds.GridFrameOffsetVector[0]), float(sp[1]),float(sp[0])]
-        self.myDosiVolume.origin = ds.ImagePositionPatient
-        self.myDosiVolume.origin = [float(self.myDosiVolume.origin[2]),float(self.myDosiVolume.origin[1]),float(self.myDosiVolume.origin[0])]
-        dosi_swapZ =(ds.ImageOrientationPatient[0:3] == [1, 0, 0])
-        dosi_swapY =(ds.ImageOrientationPatient[3:6] == [0, 1, 0])
-    
-        self.myDosiVolume.dim_x = np.shape(self.myDosiVolume.volume)[0]
-        self.myDosiVolume.dim_y = np.shape(self.myDosiVolume.volume)[1]        
-        if(len(np.shape(self.myDosiVolume.volume))==3):   self.myDosiVolume.dim_z = np.shape(self.myDosiVolume.volume)[2]
-        if(len(np.shape(self.myDosiVolume.volume))==2):   self.myDosiVolume.dim_z = 1
-
-    #print 'dosi type', dosi.dtype
-    
-    # Dealing with image orientation
-    if(dosi_swapY == True):
-        self.myDosiVolume.volume = np.flip(self.myDosiVolume.volume,1) # flip volume
-        self.myDosiVolume.origin[1] += self.myDosiVolume.dim_y*self.myDosiVolume.spacing[1]		
-    if(dosi_swapZ == True):
-        self.myDosiVolume.volume = np.flip(self.myDosiVolume.volume,2) # flip volume
-        self.myDosiVolume.origin[2] += self.myDosiVolume.dim_z*self.myDosiVolume.spacing[2]
-    if(dosi_swapY == True)and(dosi_swapZ == True):
-        self.myDosiVolume.spacing[1], self.myDosiVolume.spacing[2] = self.myDosiVolume.spacing[2], self.myDosiVolume.spacing[1]
-
-    print('dosi_swapY, dosi_swapZ :', dosi_swapY, dosi_swapZ)
+    def Done(dosi):
+        self.myDosiVolume.Assign(dosi)
+        self.myDosiVolume.show = True
+        #check1.select()
+        self.UpdateAll()
 
-    self.myDosiVolume.open = True
-    self.myDosiVolume.show = True
-    #check1.select()
-    self.UpdateAll()
+    ### .dcm file ###
+    if(filepath.endswith('.dcm')):  StartLoad(self, LoadTask(LoadDosi, RTDosiVolume(), filepath, self.myCache), 'Importing RD file ...', Done)
 
-    self.statusBar().showMessage('file successfully opened!')
+    ### MetaImage and NIfTI files ###
+    if filepath.lower().endswith(IMAGE_EXTENSIONS): StartLoad(self, LoadTask(LoadImage, RTDosiVolume(), filepath, self.myCache), 'Importing dose file ...', Done)
 
 def OpenROI(self, filepath=None):
     """
@@ -249,8 +209,6 @@ def OpenROI(self, filepath=None):
 ##        return
 
     #else:
-    self.myROISet = ROISet() # create a new ROI set
-    self.statusBar().showMessage('Opening RS file ... ')
     
     # Opening file
     if(filepath==False):
@@ -260,26 +218,17 @@ def OpenROI(self, filepath=None):
         filedir = QtCore.QFileInfo(filepath[0]).path() # +'/'
         #print(filelist)
 
-    if(filepath.endswith('.dcm')==True):
+    from Loaders import LoadROI
 
-        ds = pydicom.read_file(filepath)
-        self.myROISet.N_ROI = len(ds.StructureSetROISequence)
-        self.myROISet.infos = np.empty((self.myROISet.N_ROI,7), dtype=np.object)
-        
-        for ROI_index in range(self.myROISet.N_ROI):	
-            self.myROISet.GetInfos(ds,ROI_index) # retrieve the info for all ROI
-##                isPTV = self.myROISet.infos[ROI_index,0].upper().startswith('PTV')
-##                isCTV = self.myROISet.infos[ROI_index,0].upper().startswith('CTV')
-##                isGTV = self.myROISet.infos[ROI_index,0].upper().startswith('GTV')
-##                if(isPTV or isCTV or isGTV):    self.myROISet.infos[ROI_index,6] = self.myROISet.ROI_3D(self.myROISet.infos, ROI_index)
-
-        self.myROISet.open = True
+    def Done(roiset):
+        self.myROISet = roiset # the new ROI set
         self.myROISet.show = True
-        
-    self.statusBar().showMessage('File successfully opened!')
-    #check2.select()
-    self.UpdateAll()
-    self.showROI()
+        #check2.select()
+        self.UpdateAll()
+        self.showROI()
+
+    if(filepath.endswith('.dcm')==True):
+        StartLoad(self, LoadTask(LoadROI, filepath, self.myCTVolume), 'Opening RS file ... ', Done)
 
 ##        roimenu.entryconfig("Compute DVH...", state="normal")
 ##        roimenu.entryconfig("Crop dosimetry", state="normal")
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+###################################################
+#   	      Line profiles of the CT and dose
+# 		   	----
+#           	P. Lansonneur 2019
+###################################################
+
+import numpy as np
+
+def SampleLine(volume, grid, ax, slice_, rot, h, v):
+    """
+    Return the values of 'volume' (with the geometry of 'grid') at the points (h, v) of the view
+    along axis 'ax' (display coordinates, see RTGeneralVolume.DisplayIndex) on the slice 'slice_',
+    interpolated in a single map_coordinates call (trilinear, NaN outside the volume)
+    """
+    from scipy.ndimage import map_coordinates
+    return map_coordinates(volume, grid.DisplayIndex(ax, slice_, rot, h, v), order=1, mode='constant', cval=np.nan, output=np.float32)
+
+def LineProfile(ct, dosi, ax, slice_, rot, start, end, n=None):
+    """
+    Return the distance (mm), the CT (physical values) and the dose along the segment 'start'-'end'
+    of the view along axis 'ax' showing the CT slice 'slice_'. The dose is NaN if there is none there.
+    The segment is sampled every half CT voxel by default.
+    """
+    (h0, v0), (h1, v1) = start, end
+    length = np.hypot(h1 - h0, v1 - v0)
+    if n is None:   n = int(np.clip(2*length/min(np.abs(ct.spacing)), 2, 4000))
+    t = np.linspace(0, 1, n)
+    h, v = h0 + t*(h1 - h0), v0 + t*(v1 - v0)
+
+    CT = ct.Rescale(SampleLine(ct.volume, ct, ax, slice_, rot, h, v))
+    dose = np.full(n, np.nan, dtype=np.float32)
+    if dosi.open:
+        volume, slice_dosi, grid = dosi.Source(ct, ax, slice_)
+        if(slice_dosi>=0):  dose = SampleLine(volume, grid, ax, slice_dosi, rot, h, v)
+
+    return t*length, CT, dose
+
+def ShowProfile(self, show=True):
+    """
+    Toggle the profile tool: a line dragged with the left mouse button on a view
+    plots the CT and the dose along it (see UpdateProfile)
+    """
+    # GUI imports kept here so that LineProfile runs without Qt
+    from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg, NavigationToolbar2QT
+    from matplotlib.figure import Figure
+    from PyQt5.QtWidgets import QVBoxLayout, QWidget
+
+    self.profileMode = show
+    if not show:
+        self.profile = None
+        if self.ProfileWindow is not None:  self.ProfileWindow.hide()
+        self.UpdateAll()
+        return
+
+    if self.ProfileWindow is None:
+        fc = FigureCanvasQTAgg(Figure(facecolor='lightgrey'))
+        ax = fc.figure.gca()
+        axDose = ax.twinx()
+        fc.figure.subplots_adjust(left=0.15, right=0.88, bottom=0.12, top=0.95)
+        ax.set_xlabel('Distance (mm)')
+        ax.set_ylabel('CT')
+        axDose.set_ylabel('Dose (Gy)', color='r')
+        self.profilePlot = {'canvas': fc, 'ax': ax, 'axDose': axDose, 'limits': None, 'background': None,
+                            'ct': ax.plot([], [], 'k-', linewidth=1, animated=True)[0],
+                            'dose': axDose.plot([], [], 'r-', linewidth=1, animated=True)[0]}
+
+        def OnDraw(event):
+            # save the background for blitting and draw the profiles over it
+            self.profilePlot['background'] = fc.copy_from_bbox(fc.figure.bbox)
+            DrawProfile(self.profilePlot)
+
+        fc.mpl_connect('draw_event', OnDraw)
+
+        self.ProfileWindow = QWidget()
+        self.ProfileWindow.setWindowTitle('Profile')
+        self.ProfileWindow.resize(600, 400)
+        layout = QVBoxLayout()
+        layout.addWidget(fc)
+        layout.addWidget(NavigationToolbar2QT(fc, self.ProfileWindow))
+        self.ProfileWindow.setLayout(layout)
+
+    self.statusBar().showMessage('Drag a line on a view with the left mouse button')
+    self.ProfileWindow.show()
+
+def DrawProfile(plot):
+    plot['ax'].draw_artist(plot['ct'])
+    plot['axDose'].draw_artist(plot['dose'])
+
+def UpdateProfile(self):
+    """
+    Plot the profile along the line of the profile tool, on the slice displayed in its view.
+    While a line is dragged, the axis limits only grow (to a diagonal of the view in distance,
+    by steps of 500 for the CT and up to the maximum dose), so that the profiles are
+    blitted over the saved background rather than the whole figure being drawn again.
+    """
+    if self.profile is None or self.ProfileWindow is None:  return
+    if(np.ndim(self.myCTVolume.volume)!=3)or(self.profile['view'] not in self.rendered):    return
+
+    view = self.profile['view']
+    rot = {1: self.rot1, 2: self.rot2, 3: self.rot3}[view]
+    distance, CT, dose = LineProfile(self.myCTVolume, self.myDosiVolume, view, self.rendered[view], rot, self.profile['start'], self.profile['end'])
+
+    plot = self.profilePlot
+    plot['ct'].set_data(distance, CT)
+    plot['dose'].set_data(distance, dose)
+
+    ext = self.myCTVolume.extent_(view, rot)
+    limits = self.profile.setdefault('CT limits', (0, 500))
+    if np.isfinite(CT).any():
+        lo, hi = 500*np.floor(np.nanmin(CT)/500.), 500*np.ceil(np.nanmax(CT)/500.)
+        limits = self.profile['CT limits'] = (min(lo, limits[0]), max(hi, limits[1]))
+    Dmax = self.myDosiVolume.Statistics()['max'] if self.myDosiVolume.open else 1.
+    current = ((0, np.hypot(ext[1]-ext[0], ext[3]-ext[2])), limits, (0, 1.05*Dmax if Dmax>0 else 1.))
+
+    fc = plot['canvas']
+    if(current!=plot['limits'])or(plot['background'] is None):
+        plot['limits'] = current
+        plot['ax'].set_xlim(*current[0])
+        plot['ax'].set_ylim(*current[1])
+        plot['axDose'].set_ylim(*current[2])
+        fc.draw_idle() # the profiles are drawn after the figure, see OnDraw
+        return
+
+    fc.restore_region(plot['background'])
+    DrawProfile(plot)
+    fc.blit(fc.figure.bbox)
@@ -5,29 +5,92 @@
 #           	P. Lansonneur 2019
 ###################################################
 
-import matplotlib.pyplot as P
 import numpy as np
-import SimpleITK as sitk
-import pydicom, pydicom.uid
-from pydicom.dataset import Dataset, FileDataset
-import datetime, time
-import os
-import vtk
-from vtk.qt.QVTKRenderWindowInteractor import QVTKRenderWindowInteractor
+import itertools
 import warnings
 warnings.filterwarnings("ignore", message="numpy.dtype size changed")
 warnings.filterwarnings("ignore", message="No contour levels were found")
 warnings.filterwarnings("ignore", message="converting a masked element to nan")
-from matplotlib.path import Path
-import matplotlib.patches as patches
-from scipy.ndimage import rotate, zoom, map_coordinates
-from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg
-from matplotlib.figure import Figure
-import sys
-from fbs_runtime.application_context.PyQt5 import ApplicationContext
-from PyQt5.QtWidgets import QFileDialog
-from PyQt5 import QtCore, QtGui, Qt
-from PyQt5.QtWidgets import *
+
+def FillPolygons(polygons, shape, supersampling=1):
+    """
+    Rasterize closed polygons into a 2D array with a scanline fill.
+    'polygons' is a list of (N,2) arrays of (row, column) vertices in pixel units;
+    a pixel is inside when its centre is. The even-odd rule is used over all
+    the polygons, so that holes and nested contours are handled.
+    With supersampling=n, each pixel is split into n x n sub-pixels and
+    the fraction of the pixel inside the polygons is returned (float32).
+    """
+    n = supersampling
+    if(n>1):
+        polygons = [(p + 0.5)*n - 0.5 for p in polygons] # sub-pixel units
+        shape = (shape[0]*n, shape[1]*n)
+
+    mask = np.zeros(shape, dtype=bool)
+    polygons = [p for p in polygons if len(p)>=3]
+
+    if(len(polygons)>0):
+        # polygon edges
+        r0 = np.concatenate([p[:,0] for p in polygons])
+        c0 = np.concatenate([p[:,1] for p in polygons])
+        r1 = np.concatenate([np.roll(p[:,0],-1) for p in polygons])
+        c1 = np.concatenate([np.roll(p[:,1],-1) for p in polygons])
+
+        # rows crossed by each edge: min(r0,r1) <= row < max(r0,r1)
+        lo = np.clip(np.ceil(np.minimum(r0,r1)), 0, shape[0]).astype(int)
+        hi = np.clip(np.ceil(np.maximum(r0,r1)), 0, shape[0]).astype(int)
+        N_rows = hi - lo
+        edge = np.repeat(np.arange(len(lo)), N_rows)
+        rows = lo[edge] + np.arange(len(edge)) - np.repeat(np.cumsum(N_rows) - N_rows, N_rows)
+
+        if(len(rows)>0):
+            # column of the first pixel centre past each crossing
+            cols = c0[edge] + (rows - r0[edge])*(c1[edge] - c0[edge])/(r1[edge] - r0[edge])
+            cols = np.clip(np.ceil(cols), 0, shape[1]).astype(int)
+
+            # count the crossings in the bounding box, a pixel is inside after an odd number of them
+            rmin, rmax, cmin, cmax = rows.min(), rows.max()+1, cols.min(), cols.max()+1
+            crossings = np.bincount((rows-rmin)*(cmax-cmin) + cols-cmin, minlength=(rmax-rmin)*(cmax-cmin))
+            inside = np.cumsum(crossings.reshape(rmax-rmin, cmax-cmin), axis=1) & 1
+            cmax = min(cmax, shape[1])
+            mask[rmin:rmax, cmin:cmax] = inside[:, :cmax-cmin]
+
+    if(n>1):    return mask.reshape(shape[0]//n, n, shape[1]//n, n).mean(axis=(1,3), dtype=np.float32)
+    return mask
+
+VERTEX = np.dtype([('x', np.float64), ('y', np.float64), ('z', np.float64)])       # vertex of a contour (mm)
+CONTOUR = np.dtype([('start', np.int64), ('stop', np.int64), ('z', np.float64)])    # vertices of a contour and its plane (mm)
+
+def ContourValues(contour):
+    """
+    Return the coordinates of a ContourSequence item. While pydicom has not converted
+    its ContourData yet, these are the tokens of the raw value, much faster to parse
+    than the list of DSfloat built by pydicom.
+    """
+    if('ContourData' not in contour):  return []
+    element = contour.get_item('ContourData')
+    if isinstance(element.value, bytes):    return element.value.split(b'\\')
+    return element.value
+
+def ReadContours(item):
+    """
+    Read all the contours of a ROIContourSequence item in a single pass,
+    into one array of vertices (VERTEX structured array).
+    Return the vertices and the contours (CONTOUR structured array: offsets of
+    their vertices and plane), the vertices of contour j being vertices[start[j]:stop[j]].
+    """
+    values = [ContourValues(contour) for contour in item.get('ContourSequence', [])]
+    N_vert = np.fromiter((len(v)//3 for v in values), dtype=np.int64, count=len(values))
+    offsets = np.concatenate([[0], np.cumsum(N_vert)]).astype(np.int64)
+
+    coordinates = np.fromiter(itertools.chain.from_iterable(v[:3*n] for v, n in zip(values, N_vert)), dtype=np.float64, count=3*offsets[-1])
+    vertices = coordinates.view(VERTEX)
+
+    contours = np.empty(len(values), dtype=CONTOUR)
+    contours['start'], contours['stop'] = offsets[:-1], offsets[1:]
+    contours['z'] = np.nan
+    contours['z'][N_vert>0] = vertices['z'][offsets[:-1][N_vert>0]]
+    return vertices, contours
 
 class ROISet():
     
@@ -38,6 +101,10 @@ class ROISet():
         self.N_ROI = 0					# number of ROI
         self.infos = np.empty((1,7), dtype=np.object)	# ROI informations
         self.show = False				# show ROIs
+        self.contours = {}                              # contours of each ROI, see ReadContours()
+        self.planes = {}                                # contours of each plane, for each ROI
+        self.slices = {}                                # contours of each slice, see SliceIndex()
+        self.masks = {}                                 # cached ROI masks, see MaskBox()
 
     def GetInfos(self, ds, i):
         """
@@ -45,21 +112,20 @@ class ROISet():
 	ROI informations are saved into the array ROI_infos[i,:]
 	"""
         
-        ctrs = ds.ROIContourSequence
-        x, y, z, N_vert, N_vert_cumul = [],[],[],[],[0]
-        x, y, z = np.array([]).astype(float), np.array([]).astype(float), np.array([]).astype(float)
-
-        if('ContourSequence' in ctrs[i]):
-            for j in range(len(ctrs[i].ContourSequence)):
-                x = np.append(x,np.asfarray(ctrs[i].ContourSequence[j].ContourData[0::3],float))
-                y = np.append(y,np.asfarray(ctrs[i].ContourSequence[j].ContourData[1::3],float))
-                z = np.append(z,np.asfarray(ctrs[i].ContourSequence[j].ContourData[2::3],float))
-                N_vert = np.append(N_vert,ctrs[i].ContourSequence[j].NumberOfContourPoints) 	 # number of vertices for each contour
-                N_vert_cumul = np.append(N_vert_cumul,np.sum(N_vert[0:j]))
+        vertices, contours = ReadContours(ds.ROIContourSequence[i])
+        x, y, z = vertices['x'], vertices['y'], vertices['z']
+        N_vert_cumul = np.append(contours['start'], len(vertices))
 
         color = ds.ROIContourSequence[i].ROIDisplayColor
         color = np.array([color[0]/255.,color[1]/255.,color[2]/255.])
-        N_vert_cumul = np.array(N_vert_cumul).astype(int)
+
+        # contours of each plane (z in mm), as (N,2) arrays of vertices
+        xy = np.column_stack([x, y])
+        planes = {}
+        for start, stop, plane in contours:
+            if(stop>start): planes.setdefault(round(float(plane),2), []).append(xy[start:stop])
+        self.planes[i] = planes
+        self.contours[i] = contours
 
         self.infos[i,0] = ds.StructureSetROISequence[i].ROIName # ROI Name
         self.infos[i,1] = x					# vertices x coordinates in mm
@@ -67,7 +133,95 @@ class ROISet():
         self.infos[i,3] = z             			# vertices z coordinates in mm
         self.infos[i,4] = N_vert_cumul			        # cumulated number of vertices for each contour
         self.infos[i,5] = color					# color in RGB format
-        self.infos[i,6] = 0					# 0-1 array with same dimension as the CT volume.
+        self.infos[i,6] = 0					# 0-1 array with same dimension as the CT volume, see Mask()
+
+    def SliceIndex(self, grid):
+        """
+        Return, for each ROI, a dictionary mapping the slice number of 'grid' (along axis 0)
+        to the list of contours of this slice, as (N,2) arrays of (x,y) vertices in mm.
+        The index is built once per grid geometry, so that drawing a slice is a lookup.
+
+        Usage:
+        >>> for vertices in ROISet.SliceIndex(myCTVolume)[0].get(slice_, []): ...
+        """
+        key = (np.shape(grid.volume)[0], grid.origin[0], grid.spacing[0], grid.direction[0])
+
+        if key not in self.slices:
+            index = []
+            for i in range(self.N_ROI):
+                slices = {}
+                for z, contours in self.planes.get(i, {}).items():  slices.setdefault(int(np.rint(grid.Index(0, z))), []).extend(contours)
+                index.append(slices)
+            self.slices[key] = index
+
+        return self.slices[key]
+
+    def MaskBox(self, i, grid, supersampling=1):
+        """
+        Rasterize the ROI 'i' on the voxel grid of 'grid' (CT or dosimetry volume).
+        Each slice of the grid takes the contours of the nearest contoured plane,
+        which are scanline-filled within their bounding box (see FillPolygons).
+        Return the bounding box of the ROI in the grid (a tuple of 3 slices) and
+        the mask within this box: boolean, or the fraction of each voxel inside the ROI
+        if supersampling > 1. Masks are cached per grid.
+
+        Usage:
+        >>> box, mask = ROISet.MaskBox(0, myDosiVolume)
+        >>> dose = myDosiVolume.volume[box][mask]
+        """
+        shape = np.shape(grid.volume)
+        key = (i, supersampling, shape, tuple(grid.origin), tuple(grid.spacing), tuple(grid.direction))
+        if key in self.masks:   return self.masks[key]
+
+        x, y = self.infos[i,1], self.infos[i,2]
+        box = (slice(0,0), slice(0,0), slice(0,0))
+        mask = np.zeros((0,0,0), dtype=bool if supersampling==1 else np.float32)
+
+        # contours and their plane
+        contours = self.contours[i][self.contours[i]['stop'] - self.contours[i]['start'] >= 3]
+        mini, maxi = contours['start'], contours['stop']
+        planes = np.round(contours['z'], 2)
+
+        if(len(planes)>0):
+            # nearest contoured plane of each slice of the grid
+            P = np.unique(planes)
+            dz = np.median(np.diff(P)) if len(P)>1 else abs(grid.spacing[0])
+            z_k = grid.Position(0, np.arange(shape[0]))
+            nearest = np.abs(z_k[:,None] - P[None,:]).argmin(axis=1)
+            slices = np.where(np.abs(z_k - P[nearest]) <= dz/2.)[0]
+
+        if(len(planes)>0)and(len(slices)>0):
+            # bounding box
+            rows, cols = grid.Index(1, y), grid.Index(2, x)
+            r0, r1 = max(0, int(np.floor(rows.min()))), min(shape[1], int(np.ceil(rows.max()))+1)
+            c0, c1 = max(0, int(np.floor(cols.min()))), min(shape[2], int(np.ceil(cols.max()))+1)
+            box = (slice(slices[0], slices[-1]+1), slice(r0, max(r0,r1)), slice(c0, max(c0,c1)))
+            mask = np.zeros((slices[-1]+1-slices[0], max(0,r1-r0), max(0,c1-c0)), dtype=mask.dtype)
+
+            filled = {}
+            for k in slices:
+                j = nearest[k]
+                if j not in filled:
+                    polygons = [np.stack([rows[a:b]-r0, cols[a:b]-c0], axis=1) for a,b in zip(mini[planes==P[j]], maxi[planes==P[j]])]
+                    filled[j] = FillPolygons(polygons, mask.shape[1:], supersampling)
+                mask[k-slices[0]] = filled[j]
+
+        self.masks[key] = (box, mask)
+        return box, mask
+
+    def Mask(self, i, grid, supersampling=1):
+        """
+        Return the 3D mask of the ROI 'i' with the same dimensions as 'grid' (CT or dosimetry volume).
+        The voxel is True if it belongs to the ROI, False otherwise (see MaskBox).
+
+        Usage:
+        >>> ROISet.Mask(0, myCTVolume)
+        [[[False False ... True True False]]]
+        """
+        box, mask = self.MaskBox(i, grid, supersampling)
+        volume = np.zeros(np.shape(grid.volume), dtype=mask.dtype)
+        volume[box] = mask
+        return volume
 
 ##    def UpdateROI(array, slice_ax1, slice_ax2, slice_ax3,ext8,ext9):
 ##	"""
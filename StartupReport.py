@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+###################################################
+#   	  Startup time report of the viewer
+#       launch with : python StartupReport.py
+# 		   	----
+#           	P. Lansonneur 2019
+###################################################
+
+import argparse
+import os, subprocess, sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+LAZY = ['vtk', 'pydicom', 'SimpleITK', 'scipy']        # modules expected to load on first use only
+
+FIRST_WINDOW = """
+import time; t0 = time.perf_counter()
+import sys
+from PyQt5.QtWidgets import QApplication
+app = QApplication(sys.argv)
+import main
+t1 = time.perf_counter()
+window = main.RTMainWindow()
+window.show()
+app.processEvents()
+print(t1 - t0, time.perf_counter() - t0)
+"""
+
+def ImportTimes(module='main'):
+    """
+    Import 'module' in a new interpreter with -X importtime.
+    Return a list of (self time, cumulative time, depth, module name), times in seconds
+    """
+    out = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+                         cwd=HERE, stderr=subprocess.PIPE, stdout=subprocess.DEVNULL, universal_newlines=True).stderr
+
+    times = []
+    for line in out.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:   continue
+        self_, cumulative, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip()) - 1)//2
+        times.append((int(self_)*1e-6, int(cumulative)*1e-6, depth, name.strip()))
+    return times
+
+def FirstWindowTime():
+    """
+    Return the time (s) to import main.py and the time until the main window is shown,
+    in a new interpreter, or None if it fails
+    """
+    out = subprocess.run([sys.executable, '-c', FIRST_WINDOW], cwd=HERE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, universal_newlines=True)
+    t = out.stdout.split()[-2:]
+    try:    return (float(t[0]), float(t[1])) if len(t)==2 else None
+    except ValueError:  return None
+
+def main(args=None):
+
+    parser = argparse.ArgumentParser(description='Report the slowest imports of the viewer and its time to first window.')
+    parser.add_argument('-n', type=int, default=20, help='number of modules listed (default: 20)')
+    parser.add_argument('--module', default='main', help='module to profile (default: main)')
+    args = parser.parse_args(args)
+
+    times = ImportTimes(args.module)
+    names = [t[3] for t in times]
+    total = max([t[1] for t in times], default=0)
+
+    print('Import of {0}: {1:.3f} s, {2} modules'.format(args.module, total, len(times)))
+    print('\n{0:>10} {1:>10}  module'.format('self (s)', 'cumul (s)'))
+    for self_, cumulative, depth, name in sorted(times, key=lambda t: -t[1])[:args.n]:
+        print('{0:10.3f} {1:10.3f}  {2}{3}'.format(self_, cumulative, '  '*depth, name))
+
+    print('\nModules loaded on first use only:')
+    for name in LAZY:
+        loaded = any(n==name or n.startswith(name + '.') for n in names)
+        print('  {0:<10} {1}'.format(name, 'IMPORTED AT STARTUP' if loaded else 'ok'))
+
+    if(args.module=='main'):
+        t = FirstWindowTime()
+        if t is None:   print('\nTime to first window: failed (is a display available?)')
+        else:   print('\nTime to first window: {1:.3f} s (import {0:.3f} s)'.format(*t))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+###################################################
+#   	  Surface meshes of structures and isodoses
+# 		   	----
+#           	P. Lansonneur 2019
+###################################################
+
+import numpy as np
+import threading
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+from PyQt5 import QtCore
+
+def ImageData(array, grid, start=(0,0,0)):
+    """
+    Return a vtkImageData in patient coordinates from 'array', indexed [z,y,x]
+    like the volume of 'grid' and starting at its voxel 'start'.
+    Flipped axes are flipped back so that the image spacing is positive.
+    """
+    import vtk # loaded on first use, to start faster
+    from vtk.util import numpy_support
+    origin = []
+    for ax in range(3):
+        if(grid.direction[ax]<0):
+            array = np.flip(array, ax)
+            origin.append(float(grid.Position(ax, start[ax] + array.shape[ax] - 1)))
+        else:   origin.append(float(grid.Position(ax, start[ax])))
+
+    image = vtk.vtkImageData()
+    image.SetDimensions(array.shape[2], array.shape[1], array.shape[0])
+    image.SetSpacing(abs(grid.spacing[2]), abs(grid.spacing[1]), abs(grid.spacing[0]))
+    image.SetOrigin(origin[2], origin[1], origin[0])
+    image.GetPointData().SetScalars(numpy_support.numpy_to_vtk(np.ascontiguousarray(array).ravel(), deep=True))
+    return image
+
+def Mesh(image, value, smoothing=15, reduction=0.5):
+    """
+    Return the iso-surface 'value' of a vtkImageData as a smoothed, decimated triangle mesh
+    """
+    import vtk
+    contour = vtk.vtkFlyingEdges3D() if hasattr(vtk, 'vtkFlyingEdges3D') else vtk.vtkMarchingCubes()
+    contour.SetInputData(image)
+    contour.SetValue(0, value)
+    contour.ComputeNormalsOff()
+
+    smoother = vtk.vtkWindowedSincPolyDataFilter()
+    smoother.SetInputConnection(contour.GetOutputPort())
+    smoother.SetNumberOfIterations(smoothing)
+    smoother.SetPassBand(0.1)
+    smoother.NonManifoldSmoothingOn()
+    smoother.NormalizeCoordinatesOn()
+
+    decimate = vtk.vtkQuadricDecimation()
+    decimate.SetInputConnection(smoother.GetOutputPort())
+    decimate.SetTargetReduction(reduction)
+
+    normals = vtk.vtkPolyDataNormals()
+    normals.SetInputConnection(decimate.GetOutputPort())
+    normals.Update()
+    return normals.GetOutput()
+
+def ROIMesh(roiset, i, grid):
+    """
+    Return the surface mesh of the ROI 'i', from its mask on 'grid' (see ROISet.MaskBox)
+    """
+    box, mask = roiset.MaskBox(i, grid)
+    if not mask.any():  return None
+    mask = np.pad(mask.astype(np.uint8), 1) # closed surfaces at the box border
+    return Mesh(ImageData(mask, grid, [b.start-1 for b in box]), 0.5)
+
+def IsodoseMeshes(dosi, doses):
+    """
+    Return the isodose surfaces 'doses' (Gy) of a dosimetry volume,
+    all contoured from a single image of the dose
+    """
+    volume = np.pad(np.asarray(dosi.volume, dtype=np.float32), 1) # closed surfaces at the grid border
+    image = ImageData(volume, dosi, (-1,-1,-1))
+    del volume
+    return [Mesh(image, dose) for dose in doses]
+
+class SurfaceBuilder(QtCore.QObject):
+    """
+    Build meshes on a background worker and cache them.
+    The 'ready' signal delivers each mesh to the GUI thread.
+    """
+    ready = QtCore.pyqtSignal(object, object, object)                   # key, mesh, actor properties
+
+    def __init__(self, workers=2):
+
+        super().__init__()
+        self.meshes = {}                                                # cached meshes, with their owner
+        self.pending = set()                                            # keys of the meshes being built
+        self.keep = None                                                # keys of the meshes to cache, see Keep
+        self.lock = threading.Lock()
+        self.pool = ThreadPoolExecutor(workers)                         # background workers
+
+    def Keep(self, keys):
+        """
+        Only cache the meshes of 'keys': the others are removed, releasing the volumes they hold
+        """
+        with self.lock:
+            self.keep = set(keys)
+            for key in [k for k in self.meshes if k not in self.keep]:  del self.meshes[key]
+
+    def Build(self, key, owner, function, *args, **properties):
+        """
+        Emit 'ready' with the mesh function(*args), computed on a worker unless cached (see BuildGroup)
+        """
+        self.BuildGroup([key], owner, lambda *args: [function(*args)], args, [properties])
+
+    def BuildGroup(self, keys, owner, function, args, properties):
+        """
+        Emit 'ready' with each mesh of the list function(*args), of the keys 'keys' and actor properties 'properties',
+        computed at once on a worker unless they are cached or already being built.
+        'owner' (the ROI set or the dose array) is kept with the cached meshes,
+        so that id(owner) in the keys is not reused by another object.
+        """
+        with self.lock:
+            cached = [self.meshes[key][1] for key in keys if key in self.meshes]
+            busy = any(key in self.pending for key in keys)
+            if(len(cached)<len(keys)) and not busy: self.pending.update(keys)
+
+        if(len(cached)==len(keys)):
+            for key, mesh, props in zip(keys, cached, properties):
+                if mesh is not None:    self.ready.emit(key, mesh, props)
+            return
+        if busy:    return # emitted when built
+
+        def work():
+            try:
+                meshes = function(*args)
+                with self.lock:
+                    for key, mesh in zip(keys, meshes):
+                        if self.keep is None or key in self.keep:   self.meshes[key] = (owner, mesh)
+                for key, mesh, props in zip(keys, meshes, properties):
+                    if mesh is not None:    self.ready.emit(key, mesh, props)
+            except Exception as e:  warnings.warn('Surfaces {0} failed: {1}'.format(keys, e))
+            finally:
+                with self.lock: self.pending.difference_update(keys)
+
+        self.pool.submit(work)
+
+def ShowSurfaces(self):
+    """
+    Show the structures and the isodoses as surfaces in the 3D view
+    """
+    roiset, dosi, ct = self.myROISet, self.myDosiVolume, self.myCTVolume
+    builds = []
+
+    if roiset.open:
+        grid = ct if ct.open else dosi
+        for i in range(roiset.N_ROI):
+            builds.append((('ROI', id(roiset), id(grid.volume), i), (roiset, grid.volume), ROIMesh, (roiset, i, grid),
+                           {'color': tuple(roiset.infos[i,5]), 'opacity': 0.6}))
+
+    if dosi.open and dosi.show:
+        levels = dosi.levels
+        reference = dosi.D_PTV if dosi.showOption==2 else dosi.Statistics()['max']
+        colors = dosi.colormap((levels - levels.min())/max(np.ptp(levels), 1e-9))
+        doses = [reference*level for level in levels]
+        isodoses = ([('dose', id(dosi.volume), dose) for dose in doses], dosi.volume, IsodoseMeshes, (dosi, doses),
+                    [{'color': tuple(color[:3]), 'opacity': 0.3} for color in colors])
+    else:   isodoses = None
+
+    # surfaces of a previous ROI set or isodose levels are removed from the view and the cache,
+    # and ignored if still being built (see RTMainWindow.addSurface)
+    self.surfaceKeys = set([key for key, owner, function, args, properties in builds] + (isodoses[0] if isodoses else []))
+    self.View3D().clearSurfaces(self.surfaceKeys)
+    self.mySurfaces.Keep(self.surfaceKeys)
+    for key, owner, function, args, properties in builds:  self.mySurfaces.Build(key, owner, function, *args, **properties)
+    if isodoses:    self.mySurfaces.BuildGroup(*isodoses)
+
+    self.statusBar().showMessage('Building surfaces ...')
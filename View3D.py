@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+###################################################
+#   	  3D view of the structures and surfaces
+# 		   	----
+#           	P. Lansonneur 2019
+###################################################
+
+import numpy as np
+import vtk
+from vtk.qt.QVTKRenderWindowInteractor import QVTKRenderWindowInteractor
+from vtk.util import numpy_support
+
+class QVTKWidget(QVTKRenderWindowInteractor):
+    
+    def __init__(self):
+
+        QVTKRenderWindowInteractor.__init__(self)
+        self.ren = vtk.vtkRenderer()
+        self.GetRenderWindow().AddRenderer(self.ren)
+        self.ren.SetBackground(1, 1, 1) # white background
+   
+        self.camera = self.ren.GetActiveCamera()
+        self.ROIActors = {}                 # actor of each ROI
+        self.surfaceActors = {}             # actor of each surface mesh
+        self.update()
+
+    def createSphereSource(self):
+        
+        # Create source
+        source = vtk.vtkSphereSource()
+        source.SetCenter(0, 0, 0)
+        source.SetRadius(5.0)
+
+        # Create a mapper
+        mapper = vtk.vtkPolyDataMapper()
+        mapper.SetInputConnection(source.GetOutputPort())
+
+        # Create an actor
+        actor = vtk.vtkActor()
+        actor.SetMapper(mapper)
+        self.ren.AddActor(actor)
+
+    def addROI(self, ROISet, ROI_index):
+        """
+        Add the contours of a ROI as a single actor.
+        All the contours go into one polydata, built from the numpy arrays in bulk.
+        """
+        x = ROISet.infos[ROI_index,1]
+        y = ROISet.infos[ROI_index,2]
+        z = ROISet.infos[ROI_index,3]
+        N_vert_cumul = ROISet.infos[ROI_index,4]
+        ROI_color = ROISet.infos[ROI_index,5]
+        
+        if(len(N_vert_cumul)<=1):   return ### only surface contours
+
+        mini, maxi = N_vert_cumul[:-1], N_vert_cumul[1:]  # get 1st and last indices of each contours
+        keep = (maxi - mini >= 1)
+        mini, n = mini[keep], (maxi - mini)[keep]
+        if(len(n)==0):  return
+
+        # one closed polyline per contour, in the legacy cell layout: [n+1, i_0, ..., i_n-1, i_0, ...]
+        cell = np.repeat(np.arange(len(n)), n+2)
+        pos = np.arange(len(cell)) - np.repeat(np.cumsum(n+2) - (n+2), n+2)
+        cells = np.where(pos==0, n[cell]+1, mini[cell] + (pos-1) % n[cell])
+
+        points = vtk.vtkPoints()
+        points.SetData(numpy_support.numpy_to_vtk(np.column_stack([x, y, z]).astype(float), deep=True))
+        lines = vtk.vtkCellArray()
+        lines.SetCells(len(n), numpy_support.numpy_to_vtkIdTypeArray(cells.astype(numpy_support.get_vtk_to_numpy_typemap()[vtk.VTK_ID_TYPE]), deep=True))
+
+        pd = vtk.vtkPolyData()
+        pd.SetPoints(points)
+        pd.SetLines(lines)
+
+        # single points (e.g. POINT markers) are also drawn as vertices, a closed polyline of one point being invisible
+        single = mini[n==1]
+        if len(single):
+            verts = vtk.vtkCellArray()
+            for i in single:    verts.InsertNextCell(1, [int(i)])
+            pd.SetVerts(verts)
+
+        Mapper = vtk.vtkPolyDataMapper()
+        Mapper.SetInputDataObject(pd)
+
+        actor = vtk.vtkActor()
+        actor.SetMapper(Mapper)
+        actor.GetProperty().SetColor(ROI_color)
+        actor.GetProperty().SetPointSize(5)
+
+        if ROI_index in self.ROIActors:     self.ren.RemoveActor(self.ROIActors[ROI_index])
+        self.ROIActors[ROI_index] = actor
+        self.ren.AddActor(actor)  # add a vtkActor for each ROI
+
+    def addSurface(self, key, mesh, color=(1,1,1), opacity=1):
+        """
+        Add (or replace) the surface mesh 'key'
+        """
+        Mapper = vtk.vtkPolyDataMapper()
+        Mapper.SetInputDataObject(mesh)
+        Mapper.ScalarVisibilityOff()
+
+        actor = vtk.vtkActor()
+        actor.SetMapper(Mapper)
+        actor.GetProperty().SetColor(color)
+        actor.GetProperty().SetOpacity(opacity)
+
+        if key in self.surfaceActors:   self.ren.RemoveActor(self.surfaceActors[key])
+        self.surfaceActors[key] = actor
+        self.ren.AddActor(actor)
+        self.GetRenderWindow().Render()
+
+    def clearSurfaces(self, keep=()):
+        """
+        Remove the actors of the surface meshes, but those of the keys 'keep'
+        """
+        for key in [k for k in self.surfaceActors if k not in keep]:
+            self.ren.RemoveActor(self.surfaceActors.pop(key))
+        self.GetRenderWindow().Render()
+
+    def clearROI(self):
+        """
+        Remove the actors of all ROIs
+        """
+        for actor in self.ROIActors.values():   self.ren.RemoveActor(actor)
+        self.ROIActors = {}
+       
+    def update(self):
+        
+        self.iren = self.GetRenderWindow().GetInteractor()
+
+##        axes = vtk.vtkAxesActor()
+##        tmp = vtk.vtkOrientationMarkerWidget()
+####        rgba = [0] * 4
+####        colors.GetColor("Carrot", rgba)
+####        widget.SetOutlineColor(rgba[0], rgba[1], rgba[2])
+##        tmp.SetOrientationMarker(axes)
+##        tmp.SetInteractor(self.iren)
+##        tmp.SetViewport(0.0, 0.0, 0.4, 0.4)
+##        tmp.SetEnabled(1)
+##        tmp.InteractiveOn()
+        
+        style = vtk.vtkInteractorStyleTrackballCamera()
+        self.iren.SetInteractorStyle(style)
+        self.iren.Initialize()
+        self.iren.Start()
@@ -0,0 +1,290 @@
+# -*- coding: utf-8 -*-
+###################################################
+#   	  CT and dosimetry volumes
+# 		   	----
+#           	P. Lansonneur 2019
+###################################################
+
+import matplotlib.pyplot as P
+import numpy as np
+import threading
+
+class RTGeneralVolume():
+    
+    def __init__(self):
+
+        self.open = False					        # is opened?
+        self.dim_x = self.dim_y = self.dim_z = 100		        # scan dimensions
+        self.volume = np.zeros((self.dim_x,self.dim_y,self.dim_z), dtype=np.int16)	# volume (raw pixel values)
+        self.slope = 1.                                                 # rescale slope
+        self.intercept = 0.                                             # rescale intercept
+        self.spacing = [1, 1, 1]				        # spacing
+        self.origin = [0, 0, 0]					        # origin
+        self.direction = [1, 1, 1]                                      # index to patient axis direction (-1: flipped axis)
+        self.filename = None                                            # filename
+        self.pyramid = {}                                               # downsampled volumes {factor: volume}, see Pyramid
+        self.pyramidFrom = None                                         # volume the pyramid was built from
+        self.stream = None                                              # decoding state while the slices are streamed, see Loaders.SliceStream
+        self.histogram = None                                           # histogram of the values accumulated while loading, see Histogram
+
+    def image(self, ax, slice_=0, rot=False, volume=None, rescale=True):
+
+        if volume is None:  volume = self.volume
+
+        if(len(np.shape(volume))==3):
+          
+            if(ax==1):   im = volume[slice_,:,:].T
+            if(ax==2):   im = volume[:,slice_,:].T
+            if(ax==3):   im = volume[:,:,slice_].T
+
+        if(len(np.shape(volume))==2):  im = volume[:,:]
+
+        if rot: im = np.rot90(im)
+        
+        return self.Rescale(im) if rescale else im
+
+    def Rescale(self, array):
+        """
+        Convert raw pixel values to physical values (e.g. Hounsfield units).
+        The rescaled array is float32, or 'array' itself if there is no rescale.
+        """
+        if(self.slope==1)and(self.intercept==0):    return array
+        return array.astype(np.float32)*np.float32(self.slope) + np.float32(self.intercept)
+
+    def Index(self, ax, position):
+        """
+        Return the (fractional) voxel index along the volume axis 'ax' (0, 1 or 2)
+        of a patient coordinate in mm.
+        The origin of a flipped axis lies one voxel past its last voxel.
+        """
+        if(self.direction[ax]>0):   return (np.asarray(position) - self.origin[ax])/self.spacing[ax]
+        return (self.origin[ax] - np.asarray(position))/self.spacing[ax] - 1
+
+    def Position(self, ax, index):
+        """
+        Return the patient coordinate in mm of a voxel index along the volume axis 'ax'
+        """
+        if(self.direction[ax]>0):   return self.origin[ax] + np.asarray(index)*self.spacing[ax]
+        return self.origin[ax] - (np.asarray(index) + 1)*self.spacing[ax]
+
+    def Undecoded(self, ax, slice_=0, rot=False):
+        """
+        Return the mask of the pixels of a slice not decoded yet while the volume is streamed,
+        or None if the whole slice is there
+        """
+        if self.stream is None or np.ndim(self.volume)!=3:  return None
+        mask = self.image(ax, slice_, rot, np.broadcast_to(~self.stream.decoded[:,None,None], np.shape(self.volume)), rescale=False)
+        return mask if mask.any() else None
+
+    def RescaledVolume(self):
+        """
+        Return the whole volume in physical values, computed on demand
+        """
+        return self.Rescale(self.volume)
+
+    def Assign(self, other):
+        """
+        Take the data and geometry of another volume (e.g. loaded in the background).
+        The pyramid is rebuilt on demand.
+        """
+        for name in ['open', 'dim_x', 'dim_y', 'dim_z', 'volume', 'slope', 'intercept', 'spacing', 'origin', 'direction', 'filename', 'stream', 'histogram']:
+            setattr(self, name, getattr(other, name))
+        self.pyramidFrom = None
+        
+    def Pyramid(self, factors=(2,4,8)):
+        """
+        Return the levels of the image pyramid available so far, {factor: volume}.
+        The pyramid (block averages of 2, 4 and 8 voxels per side) is built lazily
+        in a background thread, the first time it is requested for a volume
+        (not before a streamed volume is complete).
+        """
+        if self.stream is not None: return {1: self.volume}
+        if self.pyramidFrom is not self.volume:
+            self.pyramidFrom, self.pyramid = self.volume, {1: self.volume}
+            if(np.ndim(self.volume)==3):
+                threading.Thread(target=BuildPyramid, args=(self.volume, self.pyramid, factors), daemon=True).start()
+        return self.pyramid
+
+    def DisplayIndex(self, ax, slice_, rot, h, v):
+        """
+        Return the (3,N) fractional voxel indices of the points (h, v) of the view along axis 'ax'
+        (display coordinates, see extent_) on the slice 'slice_', by inverting image()
+        """
+        a, b = [i for i in range(3) if i!=ax-1]                         # axes of the columns and rows of image()
+        n_a, n_b = np.shape(self.volume)[a], np.shape(self.volume)[b]
+        rows, cols = (n_a, n_b) if rot else (n_b, n_a)
+        ext = self.extent_(ax, rot)
+        r = (ext[3] - np.asarray(v, dtype=float))/(ext[3] - ext[2])*rows - 0.5
+        c = (np.asarray(h, dtype=float) - ext[0])/(ext[1] - ext[0])*cols - 0.5
+
+        index = np.empty((3, np.size(r)))
+        index[ax-1] = slice_
+        if rot:     index[a], index[b] = n_a - 1 - r, c
+        else:       index[a], index[b] = c, r
+        return index
+
+    def extent_(self, ax, rot=False, level=1):
+
+        if(len(np.shape(self.volume))==3):
+            dim_x, dim_y, dim_z = [(d//level)*level for d in (self.dim_x, self.dim_y, self.dim_z)] # voxels covered by the pyramid level
+            if(ax==1):   ext_=np.array([self.origin[1],self.origin[1]-dim_y*self.spacing[1],self.origin[2]-dim_z*self.spacing[2],self.origin[2]])
+            if(ax==2):   ext_=np.array([self.origin[0],self.origin[0]+dim_x*self.spacing[0],self.origin[2]-dim_z*self.spacing[2],self.origin[2]])
+            if(ax==3):   ext_=np.array([self.origin[0],self.origin[0]+dim_x*self.spacing[0],self.origin[1]-dim_y*self.spacing[1],self.origin[1]])
+
+        if(len(np.shape(self.volume))==2):  ext_=np.array([self.origin[1],self.origin[1]-self.dim_y*self.spacing[1],self.origin[0]-self.dim_x*self.spacing[0],self.origin[0]])
+        
+        if rot: ext_ = np.array([ext_[3],ext_[2],ext_[0],ext_[1]])
+        #if rot: ext_ = [ext[2],ext[3],ext[1],ext[0]] #dosi ??
+            
+        return ext_
+            
+def BuildPyramid(volume, pyramid, factors):
+    """
+    Fill 'pyramid' with the block averages of 'volume' for each factor,
+    each level being computed from the previous one. Values keep the volume type.
+    """
+    level, previous = volume, 1
+    for factor in factors:
+        f = factor//previous
+        shape = [(d//f)*f for d in np.shape(level)]
+        if(min(shape)==0):  return
+        blocks = level[:shape[0],:shape[1],:shape[2]].reshape(shape[0]//f, f, shape[1]//f, f, shape[2]//f, f)
+        level = (blocks.sum(axis=(1,3,5), dtype=np.float32)/f**3).astype(volume.dtype)
+        pyramid[factor], previous = level, factor
+
+class RTCTVolume(RTGeneralVolume):
+    
+    def __init__(self):
+        
+        super().__init__()
+        self.x1_lim = self.x2_lim = self.x3_lim =(0,self.dim_x)	        # projections range
+        self.y1_lim = self.y2_lim = self.y3_lim = (0,self.dim_x)	# projections range
+        #self.im1 = self.im2 = self.im3 = self.im = self.volume[0,:,:]   # scan projections
+        #self.ext7 = self.ext8 = self.ext9 = self.extent = [0,100,0,100] # scan projections dimensions
+        self.colormap = P.get_cmap('Greys')                             # colormap
+        
+class RTDosiVolume(RTGeneralVolume):
+    
+    def __init__(self):
+        
+        super().__init__()
+        self.levels = np.array([0.2,0.3,0.4,0.5,0.6,0.7,0.8,0.9,1]) 	# isodose levels
+        self.D_PTV = 1 #np.nan                                          # PTV average dose
+        self.colormap = P.get_cmap('jet')                               # colormap
+        self.show = False                                               # show isodoses
+        self.showOption = 1                                             # display option (1:,2:,3:)
+        self.tables = {}                                                # CT to dosimetry slices, see SliceTable
+        self.onCT = False                                               # overlay the dose resampled on the CT grid
+        self.resampled = None                                           # dose resampled on the CT grid
+        self.resampledFrom = (None, None)                               # CT and dose volumes it was resampled from
+        self.stats = {}                                                 # statistics of the dose volumes, see Statistics
+        
+    def PrintColorMap(self):
+        print(self.colormap)
+
+    def SliceTable(self, ct, ax):
+        """
+	return the lookup table of the slices along axis 'ax' in the dosimetry volume
+	corresponding to each slice of the CT volume (nearest slice, -1 outside the dosimetry volume).
+	Tables are computed once per geometry.
+	"""
+        key = (ax, np.shape(ct.volume), tuple(ct.origin), tuple(ct.spacing), tuple(ct.direction),
+               np.shape(self.volume), tuple(self.origin), tuple(self.spacing), tuple(self.direction))
+
+        if key not in self.tables:
+            index = np.rint(self.Index(ax-1, ct.Position(ax-1, np.arange(np.shape(ct.volume)[ax-1])))).astype(int)
+            index[(index<0)|(index>=np.shape(self.volume)[ax-1])] = -1
+            self.tables[key] = index
+
+        return self.tables[key]
+
+    def slice_(self, ct, ax, slice_ct):
+        """
+	return the slice along axis 'ax' in the dosimetry volume 
+	corresponding to the slice "slice_ct" in the CT volume (-1 if outside)
+	"""
+        return self.SliceTable(ct, ax)[slice_ct]
+
+    def Statistics(self, volume=None, bins=256, percentiles=(2,5,50,95,98)):
+        """
+	return the statistics of a dose volume (the dosimetry volume by default):
+	global maximum, maximum of each slice along each axis, histogram and percentiles.
+	They are computed once per volume, call ClearStatistics if the dose values are modified.
+	"""
+        if volume is None:  volume = self.volume
+
+        entry = self.stats.get(id(volume))
+        if entry is None or entry[0] is not volume:
+            axes = range(np.ndim(volume))
+            slice_max = [np.nanmax(volume, axis=tuple(a for a in axes if a!=ax)) for ax in axes]
+            Dmax = float(np.nanmax(slice_max[0]))
+            values = volume[np.isfinite(volume)]
+            histogram, edges = np.histogram(values, bins=bins, range=(0, Dmax if Dmax>0 else 1))
+            stats = {'max': Dmax, 'slice max': slice_max, 'histogram': histogram, 'edges': edges,
+                     'percentiles': dict(zip(percentiles, np.percentile(values, percentiles))) if values.size else {}}
+            entry = self.stats[id(volume)] = (volume, stats)
+
+        return entry[1]
+
+    def ClearStatistics(self):
+        self.stats = {}
+
+    def Assign(self, other):
+        RTGeneralVolume.Assign(self, other)
+        self.stats = other.stats
+
+    def Resample(self, ct, chunk=16):
+        """
+	return the dose resampled on the grid of the CT volume 'ct'
+	(trilinear interpolation, 0 outside the dosimetry volume).
+	Both grids are axis-aligned, so the interpolation is done axis by axis,
+	by chunks of CT slices to bound the memory used.
+	"""
+        coords = [self.Index(ax, ct.Position(ax, np.arange(n))) for ax, n in enumerate(np.shape(ct.volume))]
+        resampled = np.zeros(np.shape(ct.volume), dtype=np.float32)
+
+        for k in range(0, len(coords[0]), chunk):
+            tmp = Interpolate(self.volume, 0, coords[0][k:k+chunk])
+            tmp = Interpolate(tmp, 1, coords[1])
+            resampled[k:k+chunk] = Interpolate(tmp, 2, coords[2])
+
+        return resampled
+
+    def Source(self, ct, ax, slice_ct):
+        """
+	return the volume, its slice and its grid to overlay on the slice "slice_ct" along axis 'ax'
+	of the CT volume (slice -1 if outside the dosimetry volume).
+	With onCT, the dose resampled once on the CT grid is used (see Resample).
+	"""
+        if self.onCT:
+            if(self.resampled is None)or(self.resampledFrom[0] is not ct.volume)or(self.resampledFrom[1] is not self.volume):
+                self.resampled = self.Resample(ct)
+                self.resampledFrom = (ct.volume, self.volume)
+            return self.resampled, slice_ct, ct
+
+        return self.volume, self.slice_(ct, ax, slice_ct), self
+
+    def Overlay(self, ct, ax, slice_ct, rot=False):
+        """
+	return the dose image and its extent to overlay on the slice "slice_ct" along axis 'ax'
+	of the CT volume, or None if this slice is outside the dosimetry volume.
+	"""
+        volume, slice_, grid = self.Source(ct, ax, slice_ct)
+        if(slice_<0):   return None
+        return self.image(ax, slice_, rot, volume), grid.extent_(ax, rot)
+
+def Interpolate(array, axis, coords):
+    """
+    Linear interpolation of 'array' along 'axis' at the fractional indices 'coords'
+    (0 outside the array)
+    """
+    n = np.shape(array)[axis]
+    i0 = np.clip(np.floor(coords).astype(int), 0, max(n-2, 0))
+    w = (coords - i0).astype(np.float32)
+    shape = [1]*np.ndim(array)
+    shape[axis] = len(coords)
+    w = w.reshape(shape)
+
+    out = np.take(array, i0, axis=axis)*(1-w) + np.take(array, np.minimum(i0+1, n-1), axis=axis)*w
+    outside = ((coords<0)|(coords>n-1)).reshape(shape)
+    return np.where(outside, np.float32(0), out).astype(np.float32)
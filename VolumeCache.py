@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+###################################################
+#   	  On-disk cache of the opened volumes
+# 		   	----
+#           	P. Lansonneur 2019
+###################################################
+
+import numpy as np
+import hashlib, json
+import os
+
+class VolumeCache():
+    """
+    Persistent cache of the volumes built by the loaders.
+    Each entry is the final (rescaled and flipped) volume saved as a raw .npy file,
+    plus a .json file holding the geometry (spacing, origin, ...).
+    Cached volumes are memory-mapped, so slices are only read from disk when displayed.
+    The cache is disabled by default (it copies the patient volumes to the disk, see File > Use volume cache),
+    and the least recently used entries are removed beyond 'limit' bytes.
+    """
+
+    def __init__(self, directory=None, limit=20*2**30):
+
+        self.enabled = False                                            # use the cache?
+        self.directory = directory                                      # cache directory
+        self.limit = limit                                              # maximum size of the entries (bytes)
+        if self.directory is None:  self.directory = os.path.join(os.path.expanduser('~'), '.pyRTViewer', 'cache')
+
+    def Key(self, uid, filelist):
+        """
+        Return the cache key of a serie,
+        built from its SeriesInstanceUID and the modification time of each file
+        """
+        h = hashlib.sha1(str(uid).encode())
+        for f in sorted(filelist):
+            st = os.stat(f)
+            h.update('{0}:{1}:{2}'.format(os.path.basename(f), st.st_mtime_ns, st.st_size).encode())
+        return h.hexdigest()
+
+    def Load(self, key):
+        """
+        Return the memory-mapped volume and the geometry saved under 'key',
+        or None if there is no such entry
+        """
+        if not self.enabled:    return None
+        path = os.path.join(self.directory, key)
+
+        try:
+            with open(path + '.json') as f:     infos = json.load(f)
+            volume = np.load(path + '.npy', mmap_mode='r')
+        except (OSError, ValueError):   return None
+
+        try:    os.utime(path + '.json')  # most recently used, see Evict
+        except OSError:     pass
+        return volume, infos
+
+    def Save(self, key, volume, **infos):
+        """
+        Save a volume and its geometry under 'key'.
+        Files are written under a temporary name first, so that
+        an interrupted save never leaves a truncated entry.
+        """
+        if not self.enabled:    return
+        path = os.path.join(self.directory, key)
+
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            np.save(path + '.tmp.npy', np.ascontiguousarray(volume))
+            os.replace(path + '.tmp.npy', path + '.npy')
+            with open(path + '.tmp.json', 'w') as f:    json.dump(infos, f)
+            os.replace(path + '.tmp.json', path + '.json') # the .json is written last: it marks a complete entry
+            self.Evict(key)
+        except OSError:     pass # the cache is optional
+
+    def Create(self, key, shape, dtype):
+        """
+        Return a writable memory-mapped volume to be filled chunk by chunk and then saved under 'key'
+        (see Commit), for volumes that may not fit in memory. None if the cache is disabled or not writable.
+        """
+        if not self.enabled:    return None
+        path = os.path.join(self.directory, key)
+
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            return np.lib.format.open_memmap(path + '.tmp.npy', mode='w+', dtype=dtype, shape=tuple(shape))
+        except OSError:     return None
+
+    def Commit(self, key, volume, **infos):
+        """
+        Save the geometry of a volume filled after Create(key, ...),
+        and return the volume memory-mapped read-only
+        """
+        path = os.path.join(self.directory, key)
+        volume.flush()
+        del volume
+        os.replace(path + '.tmp.npy', path + '.npy')
+        with open(path + '.tmp.json', 'w') as f:    json.dump(infos, f)
+        os.replace(path + '.tmp.json', path + '.json')
+        self.Evict(key)
+        return np.load(path + '.npy', mmap_mode='r')
+
+    def Evict(self, keep=None):
+        """
+        Remove the least recently used entries (modification time of their .json) but 'keep',
+        until the cache holds at most 'limit' bytes
+        """
+        entries = []
+        for f in os.listdir(self.directory):
+            if not f.endswith('.json') or f.endswith('.tmp.json'):  continue
+            path = os.path.join(self.directory, f[:-len('.json')])
+            try:    entries += [(os.path.getmtime(path + '.json'), os.path.getsize(path + '.npy'), path)]
+            except OSError:     continue
+
+        total = sum([size for _, size, _ in entries])
+        for _, size, path in sorted(entries):
+            if(total<=self.limit):  break
+            if(os.path.basename(path)==keep):   continue
+            for ext in ['.json', '.npy']:
+                try:    os.remove(path + ext)
+                except OSError:     pass
+            total -= size
+
+    def Clear(self):
+        """
+        Remove every entry of the cache, and the temporary files (.tmp.npy, .tmp.json) of interrupted loads
+        """
+        if not os.path.isdir(self.directory):   return
+        for f in os.listdir(self.directory):
+            if f.endswith('.npy') or f.endswith('.json'):   os.remove(os.path.join(self.directory, f))
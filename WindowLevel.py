@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+###################################################
+#   	  Window / level of the CT display
+# 		   	----
+#           	P. Lansonneur 2019
+###################################################
+
+import numpy as np
+from collections import OrderedDict
+
+# display ranges (HU) of the Scale menu
+PRESETS = OrderedDict([('HOUNSFIELD', (-1000, 2000)),
+                       ('SOFT TISSUE', (-160, 240)),
+                       ('MEDIASTINUM', (-125, 225)),
+                       ('LUNG', (-1350, 150)),
+                       ('BONE', (-500, 1300)),
+                       ('BRAIN', (0, 80))])
+
+class WindowLevel():
+    """
+    Map CT pixel values to RGBA display values.
+    For int16 images, the 65536 possible raw values are mapped once in a lookup table,
+    so that displaying a slice is a single np.take.
+    """
+
+    def __init__(self):
+
+        self.window = 3000                                              # width of the displayed range
+        self.level = 500                                                # center of the displayed range
+        self.tables = {}                                                # lookup table of the current settings, see Table
+        self.autoRange = (0, 1)                                         # full range of the volume, see Auto
+        self.autoFrom = None                                            # volume it was computed from
+        self.autoPercentiles = (0.5, 99.5)                              # percentiles of the volume histogram giving the AUTO range
+
+    def Range(self):
+        return self.level - self.window/2., self.level + self.window/2.
+
+    def SetRange(self, minI, maxI):
+        self.window = max(float(maxI) - float(minI), 1e-6)
+        self.level = (float(maxI) + float(minI))/2.
+
+    def Auto(self, volume):
+        """
+	Set the range to the percentiles 'autoPercentiles' of the histogram of a volume (see Histogram),
+	which is accumulated while the volume is loaded: while it is streamed, the range is the one
+	of the slices decoded so far. Without histogram, it is the full range of the volume, computed once per volume.
+	"""
+        histogram = volume.histogram
+        if histogram is not None and histogram.Total()>0:
+            self.SetRange(*histogram.Percentiles(self.autoPercentiles))
+            return
+        if(self.autoFrom is not volume.volume):
+            self.autoFrom = volume.volume
+            if volume.volume.size:  self.autoRange = volume.Rescale(np.array([np.min(volume.volume), np.max(volume.volume)]))
+        self.SetRange(*self.autoRange)
+
+    def Colors(self, values, colormap):
+        """
+	Return the RGBA uint8 colors of physical values
+	"""
+        minI, maxI = self.Range()
+        return colormap(np.clip((values - minI)/(maxI - minI), 0, 1), bytes=True)
+
+    def Table(self, colormap, slope=1, intercept=0):
+        """
+	Return the RGBA uint8 lookup table of the 65536 int16 raw values, in uint16 order (see Apply).
+	Only the table of the current settings is kept.
+	"""
+        key = (self.window, self.level, colormap.name, slope, intercept)
+        if key not in self.tables:
+            raw = np.arange(65536, dtype=np.uint16).view(np.int16).astype(np.float32)
+            self.tables = {key: self.Colors(raw*np.float32(slope) + np.float32(intercept), colormap)}
+        return self.tables[key]
+
+    def Apply(self, image, colormap, slope=1, intercept=0):
+        """
+	Return the RGBA uint8 display of a raw image
+	"""
+        if(image.dtype==np.int16):  return np.take(self.Table(colormap, slope, intercept), image.view(np.uint16), axis=0)
+        return self.Colors(image*np.float32(slope) + np.float32(intercept), colormap)
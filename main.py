@@ -8,124 +8,74 @@
 
 import matplotlib.pyplot as P
 import numpy as np
-import SimpleITK as sitk
-import pydicom, pydicom.uid
-from pydicom.dataset import Dataset, FileDataset
-import datetime, time
-import os
-import vtk
-from vtk.qt.QVTKRenderWindowInteractor import QVTKRenderWindowInteractor
+import multiprocessing
 
 import warnings
 warnings.filterwarnings("ignore", message="numpy.dtype size changed")
 warnings.filterwarnings("ignore", message="No contour levels were found")
 warnings.filterwarnings("ignore", message="converting a masked element to nan")
 
-from matplotlib.path import Path
-import matplotlib.patches as patches
-from scipy.ndimage import rotate, zoom, map_coordinates
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg
 from matplotlib.figure import Figure
+from matplotlib.collections import LineCollection
+from matplotlib.lines import Line2D
+from functools import partial
 
 import sys
 from fbs_runtime.application_context.PyQt5 import ApplicationContext
 from PyQt5.QtWidgets import *
-from PyQt5 import QtCore, QtGui, Qt
+from PyQt5 import QtCore
 from ROI import ROISet
+from Volume import RTCTVolume, RTDosiVolume
+from VolumeCache import VolumeCache
+from Surface import SurfaceBuilder
+from Isodose import IsodoseCache, Contours
+from MPR import Reslicer, ViewPlane, PixelToExtent
+from WindowLevel import WindowLevel, PRESETS
+
+PLACEHOLDER = (90, 90, 110, 255)        # color of the CT pixels not decoded yet, see Volume.Undecoded
     
-class RTGeneralVolume():
-    
-    def __init__(self):
-
-        self.open = False					        # is opened?
-        self.dim_x = self.dim_y = self.dim_z = 100		        # scan dimensions
-        self.volume = np.zeros((self.dim_x,self.dim_y,self.dim_z))	# volume
-        self.spacing = [1, 1, 1]				        # spacing
-        self.origin = [0, 0, 0]					        # origin
-        self.filename = None                                            # filename
-
-    def image(self, ax, slice_=0, rot=False):
-
-        if(len(np.shape(self.volume))==3):
-          
-            if(ax==1):   im = self.volume[slice_,:,:].T
-            if(ax==2):   im = self.volume[:,slice_,:].T
-            if(ax==3):   im = self.volume[:,:,slice_].T
-
-        if(len(np.shape(self.volume))==2):  im = self.volume[:,:]
-
-        if rot: im = np.rot90(im)
-        
-        return im
-        
-    def extent_(self, ax, rot=False):
-
-        if(len(np.shape(self.volume))==3):
-            if(ax==1):   ext_=np.array([self.origin[1],self.origin[1]-self.dim_y*self.spacing[1],self.origin[2]-self.dim_z*self.spacing[2],self.origin[2]])
-            if(ax==2):   ext_=np.array([self.origin[0],self.origin[0]+self.dim_x*self.spacing[0],self.origin[2]-self.dim_z*self.spacing[2],self.origin[2]])
-            if(ax==3):   ext_=np.array([self.origin[0],self.origin[0]+self.dim_x*self.spacing[0],self.origin[1]-self.dim_y*self.spacing[1],self.origin[1]])
-
-        if(len(np.shape(self.volume))==2):  ext_=np.array([self.origin[1],self.origin[1]-self.dim_y*self.spacing[1],self.origin[0]-self.dim_x*self.spacing[0],self.origin[0]])
-        
-        if rot: ext_ = np.array([ext_[3],ext_[2],ext_[0],ext_[1]])
-        #if rot: ext_ = [ext[2],ext[3],ext[1],ext[0]] #dosi ??
-            
-        return ext_
-            
-class RTCTVolume(RTGeneralVolume):
-    
-    def __init__(self):
-        
-        super().__init__()
-        self.x1_lim = self.x2_lim = self.x3_lim =(0,self.dim_x)	        # projections range
-        self.y1_lim = self.y2_lim = self.y3_lim = (0,self.dim_x)	# projections range
-        #self.im1 = self.im2 = self.im3 = self.im = self.volume[0,:,:]   # scan projections
-        #self.ext7 = self.ext8 = self.ext9 = self.extent = [0,100,0,100] # scan projections dimensions
-        self.colormap = P.get_cmap('Greys')                             # colormap
-        
-class RTDosiVolume(RTGeneralVolume):
-    
-    def __init__(self):
-        
-        super().__init__()
-        self.levels = np.array([0.2,0.3,0.4,0.5,0.6,0.7,0.8,0.9,1]) 	# isodose levels
-        self.D_PTV = 1 #np.nan                                          # PTV average dose
-        self.colormap = P.get_cmap('jet')                               # colormap
-        self.show = False                                               # show isodoses
-        self.showOption = 1                                             # display option (1:,2:,3:)
-        
-    def PrintColorMap(self):
-        print(self.colormap)
-
-    def slice_(self, ct, ax, slice_ct):
-        """
-	return the slice along axis 'ax' in the dosimetry volume 
-	corresponding to the slice "slice_ct" in the CT volume
-	"""
-        if(ax==1):  condition = (ct.origin[0] + slice_ct*ct.spacing[0] >= self.origin[0] + self.dim_x*self.spacing[0])
-        if(ax==2):  condition = (ct.origin[1] + slice_ct*ct.spacing[1] >= self.origin[1] + self.dim_y*self.spacing[1])
-        if(ax==3):  condition = (ct.origin[2] + slice_ct*ct.spacing[2] >= self.origin[2] + self.dim_z*self.spacing[2])
-        
-        if (ct.origin[ax-1] + slice_ct*ct.spacing[ax-1] <= self.origin[ax-1]):  return 0
-        if condition:   return -1
-        else:
-            if(ax==1):  return int((slice_ct-int((self.origin[ax-1] - ct.origin[ax-1])/ct.spacing[ax-1]))*ct.spacing[ax-1]/self.spacing[ax-1])
-            if(ax==2)or(ax==3): return int((slice_ct+int((self.origin[ax-1] - ct.origin[ax-1])/ct.spacing[ax-1]))*ct.spacing[ax-1]/self.spacing[ax-1])
-            
 class RTMainWindow(QMainWindow):
    
-    from OpenFile import OpenFile, OpenDicomSerie, OpenDosi, OpenROI
+    from OpenFile import OpenFile, OpenDicomSerie, OpenDosi, OpenROI, OnLoadProgress, CancelLoads
+    from DVH import ShowDVH
+    from Gamma import ShowGamma
+    from Profile import ShowProfile, UpdateProfile
+    from Histogram import ShowHistogram
+    from Surface import ShowSurfaces
     from ROI import ROISet
 
     def __init__(self):
         
         self.myCTVolume = RTCTVolume()
         self.myDosiVolume = RTDosiVolume()
-        self.w1_moved = self.w2_moved = self.w3_moved = True
+        self.myGammaVolume = RTDosiVolume()  # gamma index of the dosimetry, see Gamma.ShowGamma
+        self.myROISet = ROISet()
+        self.myCache = VolumeCache()
+        self.mySurfaces = SurfaceBuilder()
+        self.surfaceKeys = set()            # surfaces shown in the 3D view, see ShowSurfaces
+        self.myIsodoses = IsodoseCache()
+        self.myWindowLevel = WindowLevel()
+        self.myReslicer = Reslicer()
+        self.myPlane = None                 # plane of the oblique view through the CT centre, see ObliquePlane
+        self.planeKey = None                # orientation and CT geometry it was computed for
+        self.w1_moved = self.w2_moved = self.w3_moved = self.w4_moved = True
         self.rot1 = self.rot2 = self.rot3 = True
         self.inv_scale = False
         #self.c_scale = 'HOUNSFIELD'
         self.c_scale = 'AUTO'
+        self.artists = {}                   # artists of each view, see InitArtists
+        self.backgrounds = {}               # background of each view, for blitting
+        self.fps = 30                       # target frame rate of the slice rendering
+        self.pending = set()                # views waiting for a redraw, see RequestRender
+        self.rendered = {}                  # slice last rendered in each view
+        self.renderedLevel = {}             # pyramid level last rendered in each view, see Level
+        self.limits = {}                    # axis limits (zoom) of the views 1-3, see SetLimits
+        self.drag = None                    # window/level drag start, see OnPress
+        self.loads = set()                  # files being loaded, see OpenFile.StartLoad
+        self.profileMode = False            # left mouse button draws the profile line, see ShowProfile
+        self.profile = None                 # view and ends of the profile line
+        self.ProfileWindow = None
         
         super().__init__()
         self.initUI()
@@ -136,8 +86,15 @@ class RTMainWindow(QMainWindow):
         self.setWindowTitle('PyRTViewer')              
         self.resize(700, 750)
         sb = self.statusBar()
+        self.progressBar = QProgressBar(maximumWidth=150, textVisible=False)
+        self.cancelButton = QPushButton('Cancel', clicked=self.CancelLoads)
+        sb.addPermanentWidget(self.progressBar)
+        sb.addPermanentWidget(self.cancelButton)
+        self.progressBar.hide()
+        self.cancelButton.hide()
         self.createGridLayout()
         self.createMenuBar()
+        self.mySurfaces.ready.connect(self.addSurface)
 
     def createMenuBar(self):
         
@@ -150,6 +107,9 @@ class RTMainWindow(QMainWindow):
         fileMenu.addAction(QAction('Import structures...', self, triggered=self.OpenROI))
         #fileMenu.addAction(QAction('Import a RP file...', self))
         fileMenu.addSeparator()
+        fileMenu.addAction(QAction('Use volume cache', self, checkable=True, checked=self.myCache.enabled, toggled=self.SetCache))
+        fileMenu.addAction(QAction('Clear volume cache', self, triggered=self.myCache.Clear))
+        fileMenu.addSeparator()
         fileMenu.addAction(QAction('Save as...', self))
         fileMenu.addAction(QAction('Exit', self, shortcut="Ctrl+Q",triggered=QApplication.instance().quit))
 
@@ -167,7 +127,8 @@ class RTMainWindow(QMainWindow):
         scalemenu = menubar.addMenu('Scale')
         ag = QActionGroup(self, exclusive=True)
         scalemenu.addAction(ag.addAction(QAction('Auto', self, checkable=True, triggered=partial(self.SetScale,'AUTO'))))
-        scalemenu.addAction(ag.addAction(QAction('Hounsfield', self, checkable=True, triggered=partial(self.SetScale,'HOUNSFIELD'))))
+        for preset in PRESETS:
+            scalemenu.addAction(ag.addAction(QAction(preset.capitalize(), self, checkable=True, triggered=partial(self.SetScale,preset))))
         scalemenu.addSeparator()
         scalemenu.addAction(QAction('Invert scale', self, triggered=self.InvertScale))
         #scalemenu.invoke(0)
@@ -175,14 +136,15 @@ class RTMainWindow(QMainWindow):
         ### Tool menu
         toolmenu = menubar.addMenu('Tools')
         toolmenu.addAction(QAction('Isodoses', self))
-        toolmenu.addAction(QAction('Profile', self))
-        toolmenu.addAction(QAction('Histogram', self))
-        toolmenu.addAction(QAction('Gamma', self))
-        toolmenu.addAction(QAction('Iso-surface', self))
+        toolmenu.addAction(QAction('Resample dose on CT', self, checkable=True, toggled=self.SetDoseOnCT))
+        toolmenu.addAction(QAction('Profile', self, checkable=True, toggled=self.ShowProfile))
+        toolmenu.addAction(QAction('Histogram', self, triggered=self.ShowHistogram))
+        toolmenu.addAction(QAction('Gamma', self, triggered=self.ShowGamma))
+        toolmenu.addAction(QAction('Iso-surface', self, triggered=self.ShowSurfaces))
 
         ### ROI menu
         roimenu = menubar.addMenu('Structures')
-        roimenu.addAction(QAction('Compute DVH...', self, enabled=True))
+        roimenu.addAction(QAction('Compute DVH...', self, enabled=True, triggered=self.ShowDVH))
         roimenu.addAction(QAction('show ROI', self, triggered=self.showROI))
         roimenu.addAction(QAction('Normalize dosi to PTV dose', self))
 
@@ -190,7 +152,7 @@ class RTMainWindow(QMainWindow):
         menubar.addAction(QAction('Infos', self))
         
     def createGridLayout(self):
-        global w1, w2, w3, fc1, fc2, fc3, vtkWidget
+        global w1, w2, w3, w4, fc1, fc2, fc3, fc4, vtkWidget
         
         self.horizontalGroupBox = QGroupBox()
         layout = QGridLayout()
@@ -199,8 +161,9 @@ class RTMainWindow(QMainWindow):
         fc1 = FigureCanvasQTAgg(Figure())
         fc2 = FigureCanvasQTAgg(Figure())
         fc3 = FigureCanvasQTAgg(Figure())
+        fc4 = FigureCanvasQTAgg(Figure())   # oblique view, see ObliquePlane
 
-        for fig in [fc1, fc2, fc3]:
+        for fig in [fc1, fc2, fc3, fc4]:
             ax = fig.figure.gca()
             ax.axis('equal')
             ax.set_xticks([])
@@ -208,7 +171,10 @@ class RTMainWindow(QMainWindow):
             for feat in ['top','bottom','left','right']:    ax.spines[feat].set_linewidth(0)
             fig.figure.subplots_adjust(left=0, bottom=0, right=1, top=1, wspace=0, hspace=0)
     
-        vtkWidget = QVTKWidget()
+        vtkWidget = None                    # 3D view, created on first use (see View3D)
+        self.vtkPanel = QWidget()
+        self.vtkPanel.setLayout(QVBoxLayout())
+        self.vtkPanel.layout().setContentsMargins(0, 0, 0, 0)
         w1 = QSlider(QtCore.Qt.Horizontal, minimum = 0, maximum = self.myCTVolume.dim_x)
         w2 = QSlider(QtCore.Qt.Horizontal, minimum = 0, maximum = self.myCTVolume.dim_y)
         w3 = QSlider(QtCore.Qt.Horizontal, minimum = 0, maximum = self.myCTVolume.dim_z)
@@ -216,10 +182,41 @@ class RTMainWindow(QMainWindow):
         w1.setValue(int(self.myCTVolume.dim_x/2))
         w2.setValue(int(self.myCTVolume.dim_y/2))
         w3.setValue(int(self.myCTVolume.dim_z/2))
+        w4 = QSlider(QtCore.Qt.Horizontal, minimum = 0, maximum = 0) # offset of the oblique plane (mm)
         
+        self.renderTimer = QtCore.QTimer(self)
+        self.renderTimer.setInterval(int(1000/self.fps))
+        self.renderTimer.timeout.connect(self.Render)
+        self.idleTimer = QtCore.QTimer(self)    # full resolution once the sliders are idle
+        self.idleTimer.setSingleShot(True)
+        self.idleTimer.setInterval(250)
+        self.idleTimer.timeout.connect(self.RenderFull)
+
         w1.valueChanged.connect(self.w1move)
         w2.valueChanged.connect(self.w2move)
         w3.valueChanged.connect(self.w3move)
+        w4.valueChanged.connect(self.w4move)
+
+        # oblique view: the plane of ax1, ax2 or ax3 tilted and spun, beside the 3D view
+        self.planeView = QComboBox()
+        self.planeView.addItems(['ax1', 'ax2', 'ax3'])
+        self.planeTilt = QSpinBox(minimum=-90, maximum=90, prefix='tilt ', suffix='\u00b0')
+        self.planeSpin = QSpinBox(minimum=-90, maximum=90, prefix='spin ', suffix='\u00b0')
+        self.planeView.currentIndexChanged.connect(self.MovePlane)
+        self.planeTilt.valueChanged.connect(self.MovePlane)
+        self.planeSpin.valueChanged.connect(self.MovePlane)
+        controls = QHBoxLayout()
+        for widget in [self.planeView, self.planeTilt, self.planeSpin]: controls.addWidget(widget)
+        controls.addWidget(w4, 1)
+        self.obliquePanel = QWidget()
+        self.obliquePanel.setLayout(QVBoxLayout())
+        self.obliquePanel.layout().setContentsMargins(0, 0, 0, 0)
+        self.obliquePanel.layout().addWidget(fc4)
+        self.obliquePanel.layout().addLayout(controls)
+        self.panel4 = QTabWidget()
+        self.panel4.addTab(self.vtkPanel, '3D')
+        self.panel4.addTab(self.obliquePanel, 'Oblique')
+        self.panel4.currentChanged.connect(self.MovePlane)
 
 ##        check1 = QCheckBox("isodoses")
 ##        check1.setChecked(False)
@@ -238,7 +235,7 @@ class RTMainWindow(QMainWindow):
         layout.addWidget(w1,0,0)
         layout.addWidget(w2,0,1)
         layout.addWidget(w3,3,0)
-        layout.addWidget(vtkWidget,2,1)
+        layout.addWidget(self.panel4,2,1)
         #layout.addWidget(pbar, 3, 1)
         #layout.addWidget(check1, 4, 0)
         #layout.addWidget(check2, 4, 1)        
@@ -253,6 +250,17 @@ class RTMainWindow(QMainWindow):
         fc1.figure.canvas.mpl_connect('scroll_event', self.on_mousewheel1)
         fc2.figure.canvas.mpl_connect('scroll_event', self.on_mousewheel2)
         fc3.figure.canvas.mpl_connect('scroll_event', self.on_mousewheel3)
+        fc4.figure.canvas.mpl_connect('scroll_event', self.on_mousewheel4)
+
+        for fc in [fc1, fc2, fc3, fc4]:
+            fc.mpl_connect('button_press_event', self.OnPress)
+            fc.mpl_connect('motion_notify_event', self.OnDrag)
+            fc.mpl_connect('button_release_event', self.OnRelease)
+
+        fc1.mpl_connect('draw_event', partial(self.OnDraw, 1))
+        fc2.mpl_connect('draw_event', partial(self.OnDraw, 2))
+        fc3.mpl_connect('draw_event', partial(self.OnDraw, 3))
+        fc4.mpl_connect('draw_event', partial(self.OnDraw, 4))
 
         #if(self.myDosiVolume.showOption==3):    self.cbaxes = fc1.figure.add_axes([0.78,0.67,0.02,0.31])
 
@@ -271,21 +279,94 @@ class RTMainWindow(QMainWindow):
         
     def on_mousewheel3(self,event):
         w3.setValue(w3.value()-event.step)
+
+    def on_mousewheel4(self,event):
+        w4.setValue(w4.value()-event.step)
         
     def w1move(self):
-        self.w1_moved = True
-        self.update()
-        self.w1_moved = False
+        if self.myCTVolume.stream is not None:  self.myCTVolume.stream.focus = w1.value() # decode this slice next
+        self.RequestRender(1)
 	
     def w2move(self):
-        self.w2_moved = True
-        self.update()
-        self.w2_moved = False
+        self.RequestRender(2)
         
     def w3move(self):
-        self.w3_moved = True
-        self.update()
-        self.w3_moved = False
+        self.RequestRender(3)
+
+    def w4move(self):
+        self.RequestRender(4)
+
+    def MovePlane(self, *args):
+        """
+	Redraw the oblique view after a change of its plane, or when it is shown
+	"""
+        self.rendered.pop(4, None)
+        self.RequestRender(4)
+
+    def RequestRender(self, view):
+        """
+	Schedule the redraw of a view.
+	Requests are coalesced: each view is redrawn at most once per frame (see fps),
+	with the latest slice requested, whatever the number of slider or mouse wheel events.
+	"""
+        self.pending.add(view)
+        self.idleTimer.start()
+        if not self.renderTimer.isActive():
+            self.Render() # idle: render now, then throttle the next requests
+            self.renderTimer.start()
+
+    def Render(self):
+        """
+	Redraw the views with pending requests, skipping the views whose slice is unchanged
+	"""
+        if not self.pending:
+            self.renderTimer.stop()
+            return
+
+        sliders = {1:w1, 2:w2, 3:w3, 4:w4}
+        views = [view for view in self.pending if self.rendered.get(view) != sliders[view].value()]
+        self.pending = set()
+
+        self.w1_moved, self.w2_moved, self.w3_moved, self.w4_moved = (1 in views), (2 in views), (3 in views), (4 in views)
+        if views:   self.update(coarse=True)
+        self.w1_moved = self.w2_moved = self.w3_moved = self.w4_moved = False
+
+    def RefreshStream(self):
+        """
+	Redraw the views showing CT pixels not decoded yet, as the slices of a streamed CT are decoded
+	"""
+        for view, a in self.artists.items():
+            if a.get('undecoded') is not None:
+                self.rendered.pop(view, None)
+                self.RequestRender(view)
+
+    def RenderFull(self):
+        """
+	Redraw at full resolution the views drawn from a coarser pyramid level while scrolling
+	"""
+        views = [view for view, level in self.renderedLevel.items() if level>1]
+        self.w1_moved, self.w2_moved, self.w3_moved, self.w4_moved = (1 in views), (2 in views), (3 in views), (4 in views)
+        if views:   self.update()
+        self.w1_moved = self.w2_moved = self.w3_moved = self.w4_moved = False
+
+    def Level(self, view, rot):
+        """
+	Return the coarsest pyramid level of the CT volume still having at least
+	one pixel per canvas pixel, given the size of the canvas and the zoom of a view
+	"""
+        ct = self.myCTVolume
+        if(len(np.shape(ct.volume))!=3):    return 1
+        if(view==4):    return 2 if max(self.ObliquePlane().shape)>256 else 1 # one pixel out of 2, see UpdateOblique
+
+        ax = {1:fc1, 2:fc2, 3:fc3}[view].figure.gca()
+        n = [d for i, d in enumerate(np.shape(ct.volume)) if i!=view-1]
+        rows, cols = (n[0], n[1]) if rot else (n[1], n[0])
+        ext = ct.extent_(view, rot)
+        zoom_x = abs(np.diff(ax.get_xlim())[0]/(ext[1]-ext[0]))
+        zoom_y = abs(np.diff(ax.get_ylim())[0]/(ext[3]-ext[2]))
+        ratio = min(cols*zoom_x/max(ax.bbox.width, 1), rows*zoom_y/max(ax.bbox.height, 1))
+
+        return max([level for level in ct.Pyramid() if level<=ratio], default=1)
 
     def SetScales(self):
         """
@@ -297,6 +378,27 @@ class RTMainWindow(QMainWindow):
         w1.setValue(int(self.myCTVolume.dim_x/2))
         w2.setValue(int(self.myCTVolume.dim_y/2))
         w3.setValue(int(self.myCTVolume.dim_z/2))
+        if(len(np.shape(self.myCTVolume.volume))==3):
+            half = np.linalg.norm(np.shape(self.myCTVolume.volume)*np.abs(np.array(self.myCTVolume.spacing, dtype=float)))/2.
+            w4.setRange(-int(half), int(half))
+        w4.setValue(0)
+        self.limits = {} # full field of view of the new volume
+
+    def SetLimits(self):
+        """
+	Set the axis limits of the views 1-3, once per volume and orientation: the full extent of the CT,
+	or the zoom kept across redraws. Level reads them to choose the pyramid level.
+	"""
+        ct = self.myCTVolume
+        if len(np.shape(ct.volume)) not in [2, 3]:  return
+        views = [(1, self.rot1)] if(len(np.shape(ct.volume))==2) else [(1, self.rot1), (2, self.rot2), (3, self.rot3)]
+        for view, rot in views:
+            if view not in self.limits:
+                ext = ct.extent_(view, rot)
+                self.limits[view] = ((ext[0], ext[1]), (ext[2], ext[3]))
+            ax = {1:fc1, 2:fc2, 3:fc3}[view].figure.gca()
+            ax.set_xlim(*self.limits[view][0])
+            ax.set_ylim(*self.limits[view][1])
 
     def Clear_axes(self, ClearAll = False):
         """
@@ -306,137 +408,310 @@ class RTMainWindow(QMainWindow):
         if self.w1_moved:  fc1.figure.gca().clear()
         if self.w2_moved:  fc2.figure.gca().clear()                        
         if self.w3_moved:  fc3.figure.gca().clear()
+        if self.w4_moved:  fc4.figure.gca().clear()
             
         if(ClearAll == True):
-            for fig in [fc1, fc2, fc3]: fig.figure.gca().clear()
+            for fig in [fc1, fc2, fc3, fc4]: fig.figure.gca().clear()
+
+    def InitArtists(self):
+        """
+	Clear the axes and create the artists of each view once.
+	Slider moves then only update the data of these artists (see update)
+	"""
+        for view in self.limits:    # zoom kept, see SetLimits
+            ax = {1:fc1, 2:fc2, 3:fc3}[view].figure.gca()
+            self.limits[view] = (ax.get_xlim(), ax.get_ylim())
+        self.Clear_axes(ClearAll = True)
+        self.artists = {}
+
+        for view, fc in zip([1,2,3,4], [fc1,fc2,fc3,fc4]):
+            ax = fc.figure.gca()
+            artists = {}
+            artists['ct'] = ax.imshow(np.zeros((1,1)), cmap=self.myCTVolume.colormap, animated=True)
+            artists['dose'] = ax.imshow(np.zeros((1,1)), alpha=0.5, cmap=self.myDosiVolume.colormap, animated=True, visible=False)
+            artists['gamma'] = ax.imshow(np.zeros((1,1)), alpha=0.5, cmap='RdYlGn_r', vmin=0, vmax=2, animated=True, visible=False)
+            artists['isodoses'] = ax.add_collection(LineCollection([], linewidths=1, animated=True))
+            if(view==1)or(view==4):
+                artists['ROI'] = ax.add_collection(LineCollection([], linewidths=1, animated=True))
+            if(view==1):
+                artists['ROI points'] = ax.scatter([], [], marker='*', zorder=3, animated=True)
+            artists['profile'] = ax.add_line(Line2D([], [], color='b', marker='o', linewidth=1, animated=True, visible=False))
+            self.artists[view] = artists
+
+        # isodose legend, drawn from proxy lines so that it outlives the contours of each frame
+        option = self.myDosiVolume.showOption
+        if self.myDosiVolume.open and self.myDosiVolume.show and (option==1 or option==2):
+            levels = self.myDosiVolume.levels
+            colors = self.myDosiVolume.colormap((levels - levels.min())/max(np.ptp(levels), 1e-9))
+            handles = [Line2D([], [], color=c, linewidth=1, label='{0} %'.format(int(100*l))) for c,l in zip(colors, levels)]
+            leg = fc1.figure.gca().legend(handles=handles, frameon=False, title="$D_{max}$" if option==1 else "$D_{PTV}$")
+            leg.set_animated(True)
+            if self.inv_scale:
+                for text in leg.get_texts():	text.set_color("white")
+                leg.get_title().set_color("white")
+            self.artists[1]['legend'] = leg
+
+        self.SetLimits()
+        self.backgrounds = {}
+
+    def OnDraw(self, view, event):
+        """
+	Called after each full redraw of a figure:
+	save its background for blitting and draw the animated artists over it
+	"""
+        fc = {1:fc1, 2:fc2, 3:fc3, 4:fc4}[view]
+        if(event is not None)and(event.canvas is not fc):   return
+        self.backgrounds[view] = fc.copy_from_bbox(fc.figure.bbox)
+        self.DrawArtists(view)
+
+    def DrawArtists(self, view):
+        """
+	Draw the animated artists of a view
+	"""
+        ax = {1:fc1, 2:fc2, 3:fc3, 4:fc4}[view].figure.gca()
+        a = self.artists.get(view, {})
+        for key in ['ct', 'dose', 'gamma', 'isodoses', 'ROI', 'ROI points', 'profile', 'legend']:
+            artist = a.get(key)
+            if artist is not None and artist.get_visible():  ax.draw_artist(artist)
+
+    def Blit(self, view):
+        """
+	Redraw a view: restore its background and draw its animated artists over it,
+	or request a full redraw if there is no background yet
+	"""
+        fc = {1:fc1, 2:fc2, 3:fc3, 4:fc4}[view]
+        if self.backgrounds.get(view) is None:
+            fc.draw_idle()
+            return
+        fc.restore_region(self.backgrounds[view])
+        self.DrawArtists(view)
+        fc.blit(fc.figure.bbox)
 
     def UpdateAll(self):
         """
 	Update each axes
 	"""
-        self.w1_moved = self.w2_moved = self.w3_moved = True
+        self.InitArtists()
+        self.w1_moved = self.w2_moved = self.w3_moved = self.w4_moved = True
         self.update()
         self.statusBar().showMessage('')
-        self.w1_moved = self.w2_moved = self.w3_moved = False
+        self.w1_moved = self.w2_moved = self.w3_moved = self.w4_moved = False
 	
-    def update(self):
+    def update(self, coarse=False):
         
         #print(w1.value(),w2.value(),w3.value())
 
-        ax1 = fc1.figure.gca()
-        ax2 = fc2.figure.gca()
-        ax3 = fc3.figure.gca()
+        if not self.artists:    self.InitArtists()
+        if(self.c_scale=='AUTO'):   self.myWindowLevel.Auto(self.myCTVolume)
 
-        self.Clear_axes()
-        
-        ### CT        
-        if(len(np.shape(self.myCTVolume.volume))==3):
+        views = [(1, w1.value(), self.rot1, self.w1_moved), (2, w2.value(), self.rot2, self.w2_moved), (3, w3.value(), self.rot3, self.w3_moved)]
+        if(len(np.shape(self.myCTVolume.volume))==2):   views = [(1, 0, self.rot1, self.w1_moved)]
+        elif fc4.isVisible():   views.append((4, w4.value(), None, self.w4_moved))
 
-            if self.w1_moved:	ax1.imshow(self.myCTVolume.image(1, w1.value(), self.rot1), extent=self.myCTVolume.extent_(1, self.rot1), cmap=self.myCTVolume.colormap)
-            if self.w2_moved:	ax2.imshow(self.myCTVolume.image(2, w2.value(), self.rot2), extent=self.myCTVolume.extent_(2, self.rot2), cmap=self.myCTVolume.colormap)
-            if self.w3_moved:	ax3.imshow(self.myCTVolume.image(3, w3.value(), self.rot3), extent=self.myCTVolume.extent_(3, self.rot3), cmap=self.myCTVolume.colormap)            
-	    
-        if(len(np.shape(self.myCTVolume.volume))==2):   ax1.imshow(self.myCTVolume.image(1, 0, self.rot1), extent=self.myCTVolume.extent_(1, self.rot1), cmap=self.myCTVolume.colormap)
+        for view, slice_, rot, moved in views:
+            if moved:
+                level = self.Level(view, rot) if coarse else 1
+                if(view==4):    self.UpdateOblique(level)
+                else:   self.UpdateView(view, slice_, rot, level)
+                self.rendered[view], self.renderedLevel[view] = slice_, level
 
+        ### profile tool
+        if self.profile is not None and any(moved for view, slice_, rot, moved in views if view==self.profile['view']):
+            self.UpdateProfile()
 
-		### profile tool
-##		if profile_show:
-##			profile_ax.plot([xp1, xp2],[yp1, yp2], 'bo-')
-##			Update_profile()
+	#Set_axes_lim()
 
-        ### Dosimetry
-        if self.myDosiVolume.open and self.myDosiVolume.show:	
+        for view, slice_, rot, moved in views:
+            if moved:   self.Blit(view)
 
-            dosemap = self.myDosiVolume.colormap
-            levels = self.myDosiVolume.levels
-            option = self.myDosiVolume.showOption
-            D_PTV = self.myDosiVolume.D_PTV
-            
-            if self.w1_moved:
-                dos1 = self.myDosiVolume.image(1, self.myDosiVolume.slice_(self.myCTVolume, 1, w1.value())-1, self.rot1)
-                ext1_dosi = self.myDosiVolume.extent_(1, self.rot1)
-                if(option==1):  cs1 = ax1.contour(np.flipud(dos1), np.nanmax(dos1)*levels, cmap = dosemap, linewidths=1, extent=ext1_dosi)
-                if(option==2):  cs1 = ax1.contour(np.flipud(dos1), D_PTV*levels, cmap = dosemap, linewidths=1, extent=ext1_dosi)
-                if(option==3):  cs1 = ax1.imshow(np.ma.masked_where(dos1<0.05*np.nanmax(self.myDosiVolume.volume),dos1), alpha=0.5, cmap = dosemap, extent=ext1_dosi)
-
-            if self.w2_moved:
-                dos2 = self.myDosiVolume.image(2, self.myDosiVolume.slice_(self.myCTVolume, 2, w2.value())-1, self.rot2)
-                ext2_dosi = self.myDosiVolume.extent_(2, self.rot2)
-                if(option==1):  cs2 = ax2.contour(np.flipud(dos2), np.nanmax(dos2)*levels, cmap = dosemap, linewidths=1, extent=ext2_dosi)
-                if(option==2):  cs2 = ax2.contour(np.flipud(dos2), D_PTV*levels, cmap = dosemap, linewidths=1, extent=ext2_dosi)
-                if(option==3):  cs2 = ax2.imshow(np.ma.masked_where(dos2<0.05*np.nanmax(self.myDosiVolume.volume),dos2), alpha=0.5, cmap = dosemap, extent=ext2_dosi)
-
-            if self.w3_moved:
-                dos3 = self.myDosiVolume.image(3, self.myDosiVolume.slice_(self.myCTVolume, 3, w3.value())-1, self.rot3)
-                ext3_dosi = self.myDosiVolume.extent_(3, self.rot3)
-                if(option==1):  cs3 = ax3.contour(np.flipud(dos3), np.nanmax(dos3)*levels, cmap = dosemap, linewidths=1, extent=ext3_dosi)
-                if(option==2):  cs3 = ax3.contour(np.flipud(dos3), D_PTV*levels, cmap = dosemap, linewidths=1, extent=ext3_dosi)
-                if(option==3):  cs3 = ax3.imshow(np.ma.masked_where(dos3<0.05*np.nanmax(self.myDosiVolume.volume),dos3), alpha=0.5, cmap = dosemap, extent=ext3_dosi)
-                
-            if(option==1 or 2):
-                try:
-                    #for g in range(len(cs1.collections)):	cs1.collections[g].set_label('{0} Gy'.format(int(100*levels[g])))
-                    for g in range(len(cs1.collections)):	cs1.collections[g].set_label('{0} %'.format(int(100*levels[g])))
-                    if(self.w1_moved and option==1):	leg = ax1.legend(frameon=False,title="$D_{max}$")
-                    if(self.w1_moved and option==2):	leg = ax1.legend(frameon=False,title="$D_{PTV}$")
-                    if self.inv_scale and self.w1_moved:	
-                            for text in leg.get_texts():	text.set_color("white")
-                            leg.get_title().set_color("white")
-                except Exception:   pass
+    def UpdateView(self, view, slice_, rot, level=1):
+        """
+	Update the artists of a view for the CT slice 'slice_',
+	the CT being drawn from the pyramid level 'level' (see Level)
+	"""
+        ax = {1:fc1, 2:fc2, 3:fc3}[view].figure.gca()
+        a = self.artists[view]
+
+        ### CT
+        ct = self.myCTVolume
+        ext = ct.extent_(view, rot)
+        if(level>1):
+            volume = ct.Pyramid()[level]
+            a['raw'] = ct.image(view, min(slice_//level, np.shape(volume)[view-1]-1), rot, volume, rescale=False)
+            a['ct'].set_extent(ct.extent_(view, rot, level))
+        else:
+            a['raw'] = ct.image(view, slice_, rot, rescale=False)
+            a['ct'].set_extent(ext)
+        a['undecoded'] = ct.Undecoded(view, slice_, rot) if(level==1) else None
+        self.SetCTData(view)
 
-            if(option==3):
-                try:    
-                        cbar = P.colorbar(cs1, cax=cbaxes)
-                        if self.inv_scale and w1_moved:      cbaxes.tick_params(colors = "white")#,grid_color = "white")
-                except Exception:	pass
+        ### Dosimetry
+        a['isodoses'].set_segments([])
+        a['dose'].set_visible(False)
+
+        dosi = self.myDosiVolume
+        option = dosi.showOption
+
+        if dosi.open and dosi.show and (option==1 or option==2):
+            lines = self.myIsodoses.Lines(dosi, self.myCTVolume, view, slice_, rot)
+            if lines is not None:
+                segments, indices = lines
+                levels = dosi.levels
+                colors = dosi.colormap((levels - levels.min())/max(np.ptp(levels), 1e-9))
+                a['isodoses'].set_segments(segments)
+                a['isodoses'].set_color(colors[indices])
+
+        if dosi.open and dosi.show and (option==3):
+            overlay = dosi.Overlay(self.myCTVolume, view, slice_, rot)
+            if overlay is not None:
+                dos, ext_dosi = overlay
+                a['dose'].set_data(np.ma.masked_where(dos<0.05*dosi.Statistics()['max'],dos))
+                a['dose'].set_extent(ext_dosi)
+                a['dose'].autoscale()
+                a['dose'].set_visible(True)
+
+        ### Gamma index
+        a['gamma'].set_visible(False)
+        gamma = self.myGammaVolume
+        if gamma.open and gamma.show:
+            overlay = gamma.Overlay(self.myCTVolume, view, slice_, rot)
+            if overlay is not None:
+                values, ext_gamma = overlay
+                a['gamma'].set_data(np.ma.masked_invalid(values))
+                a['gamma'].set_extent(ext_gamma)
+                a['gamma'].set_visible(True)
+
+        ### Profile line
+        a['profile'].set_visible(self.profile is not None and self.profile['view']==view)
+        if a['profile'].get_visible():  a['profile'].set_data(*zip(self.profile['start'], self.profile['end']))
 
 	### Structures
-        try:
-            if self.w1_moved:
-                
-                for ROI_index in range(self.myROISet.N_ROI):
-                    
-                    x = self.myROISet.infos[ROI_index,1]
-                    y = self.myROISet.infos[ROI_index,2]
-                    z = self.myROISet.infos[ROI_index,3]
-                    N_vert_cumul = self.myROISet.infos[ROI_index,4]
-                    ROI_color = self.myROISet.infos[ROI_index,5]
-
-                    if self.rot1: 	y,x = x,y
-
-                    z_s = ((z - self.myCTVolume.origin[0])/self.myCTVolume.spacing[0]).astype(int) # scale vertices coordinates to voxel unit
-
-                    if not (w1.value() in z_s):   continue
-                    
-                    index = np.where(z_s == w1.value()) # indices of the slice concerned
-                    
-                    if(len(N_vert_cumul)>1): ### surface contours
-                        for count in range(len(index[0])):
-                            if (index[0][count] in N_vert_cumul):	
-                                mini = N_vert_cumul[np.where(N_vert_cumul==index[0][count])[0][0]-1]
-                                maxi = N_vert_cumul[np.where(N_vert_cumul==index[0][count])[0][0]]  # get 1st and last indices of the contour,
-                                if (maxi<=mini):    continue
-                                vertices = np.append(y[mini:maxi],x[mini:maxi]).reshape(2,-1).T # get the vertices coordinates of the contour,
-                                path = Path(vertices, closed=True)				# make them a path,
-                                patch = patches.PathPatch(path, facecolor='none', edgecolor=ROI_color, lw = 1) #zorder=3 to display in front
-                                ax1.add_patch(patch)                                                        
-
-                    elif(len(N_vert_cumul)==1):     ax1.plot([y[0]],[x[0]],color=ROI_color,marker = '*',zorder=3) ### points
-
-        except Exception:	pass
-        
-	#Set_axes_lim()
-       
-        if self.c_scale=='HOUNSFIELD':  self.SetDisplayRange(-1000,2000)
-        if self.c_scale=='USER':	self.SetDisplayRange(0,30)
+        if(view==1):
+            segments, colors, points, points_colors = [], [], [], []
+
+            for ROI_index, slices in enumerate(self.myROISet.SliceIndex(self.myCTVolume)):
+
+                ROI_color = self.myROISet.infos[ROI_index,5]
+
+                for vertices in slices.get(slice_, []):
 
-        if self.w1_moved:   fc1.draw()
-        if self.w2_moved:   fc2.draw()
-        if self.w3_moved:   fc3.draw()
+                    if not rot:     vertices = vertices[:,::-1]
+
+                    if(len(vertices)>1):    ### surface contours
+                        segments.append(np.vstack([vertices, vertices[:1]]))
+                        colors.append(ROI_color)
+
+                    else:   ### points
+                        points.append(vertices[0])
+                        points_colors.append(ROI_color)
+
+            a['ROI'].set_segments(segments)
+            a['ROI'].set_color(colors)
+            a['ROI points'].set_offsets(np.reshape(points, (-1,2)))
+            a['ROI points'].set_color(points_colors)
+
+    def ObliquePlane(self):
+        """
+	Return the plane of the oblique view: the plane of the view chosen (ax1, ax2 or ax3) through the centre
+	of the CT, tilted and spun (see MPR.ViewPlane), moved along its normal by the slider (mm)
+	"""
+        ct = self.myCTVolume
+        key = (self.planeView.currentIndex()+1, self.planeTilt.value(), self.planeSpin.value(),
+               np.shape(ct.volume), tuple(ct.origin), tuple(ct.spacing), tuple(ct.direction))
+        if(key!=self.planeKey):
+            self.myPlane, self.planeKey = ViewPlane(ct, *key[:3]), key
+        return self.myPlane.Moved(w4.value())
+
+    def UpdateOblique(self, stride=1):
+        """
+	Update the artists of the oblique view, resliced on one pixel out of 'stride' along each side.
+	The CT, the dose and the ROI masks are resliced in one map_coordinates call each,
+	on grids computed once per plane orientation (see MPR.Reslicer)
+	"""
+        ax = fc4.figure.gca()
+        a = self.artists[4]
+        plane = self.ObliquePlane()
+        ext = plane.Extent(stride)
+
+        ### CT
+        ct = self.myCTVolume
+        a['raw'] = self.myReslicer.Reslice(plane, ct, stride=stride) # NaN (transparent) outside the CT
+        a['undecoded'] = None
+        if ct.stream is not None:
+            decoded = ct.stream.decoded
+            index = np.rint(self.myReslicer.Coordinates(plane, ct, stride)[0])
+            undecoded = (index>=0)&(index<len(decoded))&~decoded[np.clip(index, 0, len(decoded)-1).astype(int)]
+            if undecoded.any(): a['undecoded'] = undecoded
+        a['ct'].set_extent(ext)
+        self.SetCTData(4)
+        full = plane.Extent()
+        ax.set_xlim(full[0], full[1])
+        ax.set_ylim(full[2], full[3])
+
+        ### Dosimetry
+        a['isodoses'].set_segments([])
+        a['dose'].set_visible(False)
+
+        dosi = self.myDosiVolume
+        option = dosi.showOption
+
+        if dosi.open and dosi.show and (option in [1,2,3]):
+            dose = self.myReslicer.Reslice(plane, dosi, stride=stride)
+            if(option==3):
+                a['dose'].set_data(np.ma.masked_where(~(dose>=0.05*dosi.Statistics()['max']), dose))
+                a['dose'].set_extent(ext)
+                a['dose'].autoscale()
+                a['dose'].set_visible(True)
+
+            elif np.isfinite(dose).any():
+                levels = dosi.levels
+                norm = float(np.nanmax(dose)) if(option==1) else float(dosi.D_PTV)
+                colors = dosi.colormap((levels - levels.min())/max(np.ptp(levels), 1e-9))
+                segments, indices = [], []
+                for k, lines in Contours(dose, levels, norm):
+                    segments += [PixelToExtent(line, ext, np.shape(dose)) for line in lines]
+                    indices += [k]*len(lines)
+                a['isodoses'].set_segments(segments)
+                a['isodoses'].set_color(colors[np.array(indices, dtype=int)])
+
+        ### Gamma index
+        a['gamma'].set_visible(False)
+        gamma = self.myGammaVolume
+        if gamma.open and gamma.show:
+            a['gamma'].set_data(np.ma.masked_invalid(self.myReslicer.Reslice(plane, gamma, stride=stride)))
+            a['gamma'].set_extent(ext)
+            a['gamma'].set_visible(True)
+
+        a['profile'].set_visible(False)
+
+        ### Structures, contoured on their masks resliced
+        segments, colors = [], []
+        if self.myROISet.open:
+            for ROI_index in range(self.myROISet.N_ROI):
+                mask = self.myReslicer.Mask(plane, self.myROISet, ROI_index, ct, stride)
+                if not mask.any():  continue
+                for k, lines in Contours(mask.astype(np.float32), [0.5], norm=1.):
+                    segments += [PixelToExtent(line, ext, np.shape(mask)) for line in lines]
+                    colors += [self.myROISet.infos[ROI_index,5]]*len(lines)
+        a['ROI'].set_segments(segments)
+        a['ROI'].set_color(colors)
+
+    def SetCache(self, enabled):
+        self.myCache.enabled = enabled
+
+    def SetDoseOnCT(self, onCT):
+        self.myDosiVolume.onCT = onCT
+        self.UpdateAll()
 
     def SetScale(self, scale):
+        """
+	Set the display range: 'AUTO' (full range of the CT), 'USER' or one of the PRESETS
+	"""
         self.c_scale=scale
-        self.UpdateAll()
+        if(scale=='AUTO'):  self.myWindowLevel.Auto(self.myCTVolume)
+        if(scale=='USER'):  self.myWindowLevel.SetRange(0,30)
+        if scale in PRESETS:    self.myWindowLevel.SetRange(*PRESETS[scale])
+        self.ApplyWindow()
         
     def SetDisplayRange(self, minI, maxI):
         """ 
@@ -444,12 +719,77 @@ class RTMainWindow(QMainWindow):
 	>>>Usage:
 	SetDisplayRange(-1000, 2000) #Hounsfield scale
 	"""
-        for fig in [fc1, fc2, fc3]:
-            for im in fig.figure.gca().get_images():#    im.set_clim(minI, maxI)
-                if self.myDosiVolume.open and self.myDosiVolume.show:
-                    if(len(fig.figure.gca().get_images())>0):   fig.figure.gca().get_images()[0].set_clim(minI, maxI)
-            else:
-                for im in fig.figure.gca().get_images():    im.set_clim(minI, maxI)
+        self.myWindowLevel.SetRange(minI, maxI)
+        self.ApplyWindow()
+
+    def ApplyWindow(self):
+        """
+	Redraw the CT of each view with the current window/level,
+	from the raw slices already displayed (no slicing, no contouring)
+	"""
+        for view, a in self.artists.items():
+            if 'raw' in a:
+                self.SetCTData(view)
+                self.Blit(view)
+
+    def SetCTData(self, view):
+        """
+	Display the raw CT slice of a view with the current window/level,
+	the pixels not decoded yet being drawn with the PLACEHOLDER color
+	"""
+        ct = self.myCTVolume
+        a = self.artists[view]
+        data = self.myWindowLevel.Apply(a['raw'], ct.colormap, ct.slope, ct.intercept)
+        if a.get('undecoded') is not None:  data[a['undecoded']] = PLACEHOLDER
+        a['ct'].set_data(data)
+
+    def OnPress(self, event):
+        """
+	Start a window/level drag with the right mouse button,
+	or a profile line with the left mouse button in profile mode (see ShowProfile)
+	"""
+        if(event.button==3):
+            self.drag = (event.x, event.y, self.myWindowLevel.window, self.myWindowLevel.level)
+
+        if(event.button==1)and self.profileMode and(event.inaxes is not None)and(event.canvas in [fc1, fc2, fc3]):
+            view = [fc1, fc2, fc3].index(event.canvas) + 1
+            old = self.profile['view'] if self.profile is not None else None
+            self.profile = {'view': view, 'start': (event.xdata, event.ydata), 'end': (event.xdata, event.ydata), 'drag': True}
+            if old is not None and old!=view:   self.MoveProfile(old)
+            self.MoveProfile(view)
+
+    def OnDrag(self, event):
+        """
+	Window/level drag: horizontal moves change the window, vertical moves the level.
+	Profile line drag: the line ends at the mouse
+	"""
+        if self.profile is not None and self.profile['drag'] and(event.inaxes is not None):
+            if(event.canvas is [fc1, fc2, fc3][self.profile['view']-1]):
+                self.profile['end'] = (event.xdata, event.ydata)
+                self.MoveProfile(self.profile['view'])
+
+        if self.drag is None:   return
+        x, y, window, level = self.drag
+        self.c_scale = 'USER'
+        self.myWindowLevel.window = max(window*(1 + (event.x - x)/200.), 1)
+        self.myWindowLevel.level = level + window*(event.y - y)/200.
+        self.ApplyWindow()
+
+    def OnRelease(self, event):
+        self.drag = None
+        if self.profile is not None:    self.profile['drag'] = False
+
+    def MoveProfile(self, view):
+        """
+	Redraw the profile line of a view and its profile
+	"""
+        a = self.artists.get(view)
+        if not a:   return
+        a['profile'].set_visible(self.profile is not None and self.profile['view']==view)
+        if a['profile'].get_visible():
+            a['profile'].set_data(*zip(self.profile['start'], self.profile['end']))
+            self.UpdateProfile()
+        self.Blit(view)
 
     def InvertScale(self):
         """
@@ -457,19 +797,42 @@ class RTMainWindow(QMainWindow):
 	"""
         if(self.myCTVolume.colormap==P.get_cmap('Greys')):
             self.myCTVolume.colormap = P.get_cmap('Greys_r')
-            for fig in [fc1, fc2, fc3]: fig.figure.gca().set_facecolor('0')
-            vtkWidget.ren.SetBackground(0,0,0) # black background
+            for fig in [fc1, fc2, fc3, fc4]: fig.figure.gca().set_facecolor('0')
+            self.inv_scale = True
             
         else:
             self.myCTVolume.colormap = P.get_cmap('Greys')
-            for fig in [fc1, fc2, fc3]: fig.figure.gca().set_facecolor('1')
-            vtkWidget.ren.SetBackground(1,1,1) # white background
-            
-        self.UpdateAll()
-        vtkWidget.update()
+            for fig in [fc1, fc2, fc3, fc4]: fig.figure.gca().set_facecolor('1')
+            self.inv_scale = False
+
+        leg = self.artists.get(1, {}).get('legend')
+        if leg is not None:
+            for text in leg.get_texts() + [leg.get_title()]:    text.set_color("white" if self.inv_scale else "black")
+
+        self.ApplyWindow()
+        for fig in [fc1, fc2, fc3, fc4]: fig.draw_idle() # new background
+        if vtkWidget is not None:
+            vtkWidget.ren.SetBackground(*((0,0,0) if self.inv_scale else (1,1,1))) # black or white background
+            vtkWidget.update()
+
+    def View3D(self):
+        """
+	Return the 3D view. VTK is only loaded and the view created
+	the first time structures or surfaces are shown, to start faster.
+	"""
+        global vtkWidget
+        if vtkWidget is None:
+            from View3D import QVTKWidget
+            vtkWidget = QVTKWidget()
+            if self.inv_scale:  vtkWidget.ren.SetBackground(0,0,0) # black background
+            self.vtkPanel.layout().addWidget(vtkWidget)
+        self.panel4.setCurrentWidget(self.vtkPanel)
+        return vtkWidget
 
     def showROI(self):
         
+        vtkWidget = self.View3D()
+        vtkWidget.clearROI()
         for i in range(0,self.myROISet.N_ROI):  vtkWidget.addROI(self.myROISet, i)
 
         # set camera focal point
@@ -479,105 +842,20 @@ class RTMainWindow(QMainWindow):
         vtkWidget.camera.SetFocalPoint( (np.max(x)+np.min(x))/2., (np.max(y)+np.min(y))/2., (np.max(z)+np.min(z))/2. )
         vtkWidget.ren.ResetCamera()
         
+    def addSurface(self, key, mesh, properties):
+        if key not in self.surfaceKeys: return # surface of a previous request, see ShowSurfaces
+        self.View3D().addSurface(key, mesh, **properties)
+        self.statusBar().showMessage('')
+
     def rotateAxes(self, ax):
         if(ax==1):  self.rot1 = not self.rot1
         if(ax==2):  self.rot2 = not self.rot2
         if(ax==3):  self.rot3 = not self.rot3
+        self.limits.pop(ax, None) # full extent in the new orientation, see SetLimits
         self.UpdateAll()
         
-class QVTKWidget(QVTKRenderWindowInteractor):
-    
-    def __init__(self):
-
-        QVTKRenderWindowInteractor.__init__(self)
-        self.ren = vtk.vtkRenderer()
-        self.GetRenderWindow().AddRenderer(self.ren)
-        self.ren.SetBackground(1, 1, 1) # white background
-   
-        self.camera = self.ren.GetActiveCamera()
-        self.update()
-
-    def createSphereSource(self):
-        
-        # Create source
-        source = vtk.vtkSphereSource()
-        source.SetCenter(0, 0, 0)
-        source.SetRadius(5.0)
-
-        # Create a mapper
-        mapper = vtk.vtkPolyDataMapper()
-        mapper.SetInputConnection(source.GetOutputPort())
-
-        # Create an actor
-        actor = vtk.vtkActor()
-        actor.SetMapper(mapper)
-        self.ren.AddActor(actor)
-
-    def addROI(self, ROISet, ROI_index):
-        
-        x = ROISet.infos[ROI_index,1]
-        y = ROISet.infos[ROI_index,2]
-        z = ROISet.infos[ROI_index,3]
-        N_vert_cumul = ROISet.infos[ROI_index,4]
-        ROI_color = ROISet.infos[ROI_index,5]
-        
-        if(len(N_vert_cumul)<=1):   return ### only surface contours
-
-        for i in range(0,len(N_vert_cumul)-1):
-            
-            mini = N_vert_cumul[i]
-            maxi = N_vert_cumul[i+1]  # get 1st and last indices of each contours
-            
-            if (maxi<=mini): continue
-        
-            pd = vtk.vtkPolyData()
-            points = vtk.vtkPoints()
-            lines = vtk.vtkCellArray()
-
-            for j in range(0, maxi-mini):    points.InsertPoint(j, x[mini:maxi][j], y[mini:maxi][j], z[mini:maxi][j])
-
-            vertex_indices = list(range(0, maxi-mini))
-            vertex_indices.append(0) # close the contour
-            
-            lines.InsertNextCell(maxi-mini + 1, vertex_indices)    
-        
-            pd.SetPoints(points)
-            pd.SetLines(lines)
-
-            Mapper = vtk.vtkPolyDataMapper()
-            Mapper.SetInputDataObject(pd)
-        
-            actor = vtk.vtkActor()
-            actor.SetMapper(Mapper)
-            actor.GetProperty().SetColor(ROI_color) 
-            
-            self.ren.AddActor(actor)  # add vtkActor for each contour                                                  
-
-        #elif(len(N_vert_cumul)==1):     ax1.plot([y[0]],[x[0]],color=ROI_color,marker = '*',zorder=3) ### points
-       
-    def update(self):
-        
-        self.iren = self.GetRenderWindow().GetInteractor()
-
-##        axes = vtk.vtkAxesActor()
-##        tmp = vtk.vtkOrientationMarkerWidget()
-####        rgba = [0] * 4
-####        colors.GetColor("Carrot", rgba)
-####        widget.SetOutlineColor(rgba[0], rgba[1], rgba[2])
-##        tmp.SetOrientationMarker(axes)
-##        tmp.SetInteractor(self.iren)
-##        tmp.SetViewport(0.0, 0.0, 0.4, 0.4)
-##        tmp.SetEnabled(1)
-##        tmp.InteractiveOn()
-        
-        style = vtk.vtkInteractorStyleTrackballCamera()
-        self.iren.SetInteractorStyle(style)
-        self.iren.Initialize()
-        self.iren.Start()
-
-
-        
 if __name__ == '__main__':
+    multiprocessing.freeze_support()     # gamma index workers are spawned, see GammaIndex
     appctxt = ApplicationContext()       # 1. Instantiate ApplicationContext
     window = RTMainWindow()
     window.show()
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+###################################################
+#   	  Tests of the dose-volume histograms
+# 		   	----
+#           	P. Lansonneur 2019
+###################################################
+
+import numpy as np
+import pytest
+from pydicom.dataset import Dataset
+from ROI import ROISet
+from Volume import RTDosiVolume
+from DVH import ComputeDVH
+
+def BoxROISet(x, y, planes):
+    """
+    ROI set of a single box: the rectangle x[0]-x[1], y[0]-y[1] (mm) contoured on each plane (z in mm)
+    """
+    contours = []
+    for z in planes:
+        contour = Dataset()
+        contour.ContourData = [v for px, py in [(x[0],y[0]), (x[1],y[0]), (x[1],y[1]), (x[0],y[1])] for v in (px, py, z)]
+        contours.append(contour)
+    item = Dataset()
+    item.ContourSequence = contours
+    item.ROIDisplayColor = [255, 0, 0]
+    name = Dataset()
+    name.ROIName = 'box'
+    ds = Dataset()
+    ds.ROIContourSequence, ds.StructureSetROISequence = [item], [name]
+
+    roiset = ROISet()
+    roiset.N_ROI = 1
+    roiset.GetInfos(ds, 0)
+    roiset.open = True
+    return roiset
+
+def DoseGrid(direction):
+    """
+    Dose of 2 mm voxels, increasing linearly with x (Gy/mm), with the DICOM orientation by default
+    """
+    dosi = RTDosiVolume()
+    dosi.spacing, dosi.direction = [2., 2., 2.], direction
+    dosi.origin = [-20., 30., 30.] if direction[1]<0 else [-20., -30., -30.]
+    shape = (20, 30, 30)
+    x = dosi.Position(2, np.arange(shape[2]))
+    dosi.volume = np.broadcast_to((x - x.min() + 1.).astype(np.float32), shape).copy()
+    dosi.dim_x, dosi.dim_y, dosi.dim_z = shape
+    dosi.open = True
+    return dosi
+
+@pytest.mark.parametrize('direction', [[1, -1, -1], [1, 1, 1]])
+@pytest.mark.parametrize('supersampling', [1, 2])
+def test_box_volume(direction, supersampling):
+    dosi = DoseGrid(direction)
+    # box on voxel boundaries: 10 planes of 2 mm, 20 x 16 mm
+    planes = dosi.Position(0, np.arange(5, 15))
+    x, y = (-11., 9.), (-7., 9.)
+    DVH = ComputeDVH(BoxROISet(x, y, planes), dosi, supersampling=supersampling, workers=1)[0]
+
+    assert DVH['volume'] == pytest.approx(10*2.*20.*16./1000.)
+    assert DVH['cumulative'][0] == pytest.approx(1.)
+    # dose linear in x: the mean dose is the dose at the centre of the box
+    x0 = dosi.Position(2, np.arange(30)).min()
+    assert DVH['Dmean'] == pytest.approx(np.mean(x) - x0 + 1., rel=1e-5)
+
+def test_box_volume_supersampled_half_voxels():
+    dosi = DoseGrid([1, -1, -1])
+    # box edges through the voxel centres: only supersampling gives the exact volume
+    planes = dosi.Position(0, np.arange(5, 15))
+    x, y = (-10., 10.), (-6., 10.)
+    exact = 10*2.*20.*16./1000.
+    assert ComputeDVH(BoxROISet(x, y, planes), dosi, supersampling=2, workers=1)[0]['volume'] == pytest.approx(exact)
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+###################################################
+#   	  Tests of the 3D gamma index
+# 		   	----
+#           	P. Lansonneur 2019
+###################################################
+
+import numpy as np
+import pytest
+from Volume import RTDosiVolume
+from Gamma import GammaIndex, PassRate
+
+def Dose(volume, spacing=(2., 2., 2.), origin=(-20., 20., 20.), direction=(1, -1, -1)):
+    dosi = RTDosiVolume()
+    dosi.volume = np.asarray(volume, dtype=np.float32)
+    dosi.dim_x, dosi.dim_y, dosi.dim_z = np.shape(volume)
+    dosi.spacing, dosi.origin, dosi.direction = list(spacing), list(origin), list(direction)
+    dosi.open = True
+    return dosi
+
+def Gaussian(shape=(16, 20, 20)):
+    z, y, x = np.mgrid[0:shape[0], 0:shape[1], 0:shape[2]].astype(float)
+    c = [(n - 1)/2. for n in shape]
+    return 10.*np.exp(-((z-c[0])**2 + (y-c[1])**2 + (x-c[2])**2)/50.)
+
+@pytest.mark.parametrize('workers', [0, 2])
+def test_identical_doses(workers):
+    reference = Dose(Gaussian())
+    gamma = GammaIndex(reference, Dose(Gaussian()), workers=workers, chunk=500)
+    values = gamma.volume[np.isfinite(gamma.volume)]
+    assert values.size>0
+    assert np.all(values==0)
+    assert PassRate(gamma)==1.
+
+def test_uniform_dose_difference():
+    # a difference of half the dose criterion everywhere: gamma 0.5 (exact values with stop=0)
+    reference = Dose(np.full((10, 12, 12), 10.))
+    gamma = GammaIndex(reference, Dose(np.full((10, 12, 12), 10.15)), dd=3., stop=0., workers=0)
+    assert np.allclose(gamma.volume, 0.5, atol=1e-5)
+
+def test_low_dose_threshold():
+    reference = Dose(Gaussian())
+    gamma = GammaIndex(reference, Dose(Gaussian()), threshold=50., workers=0)
+    assert np.array_equal(np.isfinite(gamma.volume), reference.volume>=0.5*reference.volume.max())
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+###################################################
+#   	  Tests of the CT and dose histograms
+# 		   	----
+#           	P. Lansonneur 2019
+###################################################
+
+import numpy as np
+import pytest
+from Histogram import Histogram, FromSparse, VolumeHistogram, ValueHistogram
+
+PERCENTILES = [0.5, 2, 25, 50, 75, 98, 99.5]
+
+def CT(shape=(12, 40, 40), seed=0):
+    """
+    Raw int16 CT-like values: air and soft tissue around 1024 + HU
+    """
+    rng = np.random.default_rng(seed)
+    raw = np.where(rng.random(shape)<0.3, rng.normal(24, 10, shape), rng.normal(1064, 40, shape))
+    return np.rint(raw).astype(np.int16)
+
+@pytest.mark.parametrize('dtype', [np.int16, np.uint16])
+def test_raw_percentiles(dtype):
+    raw = CT().astype(dtype)
+    histogram = VolumeHistogram(raw, Histogram(low=0 if dtype==np.uint16 else -32768, slope=1., intercept=-1024.))
+    assert histogram.Total()==raw.size
+    expected = np.percentile(raw.astype(float) - 1024., PERCENTILES, method='inverted_cdf')
+    assert np.array_equal(histogram.Percentiles(PERCENTILES), expected)
+
+def test_value_percentiles():
+    values = np.random.default_rng(1).gamma(2., 5., (10, 30, 30)).astype(np.float32)
+    values[0, 0, :5] = np.nan
+    histogram = ValueHistogram(values)
+    expected = np.nanpercentile(values, PERCENTILES, method='inverted_cdf')
+    assert histogram.Total()==np.count_nonzero(np.isfinite(values))
+    assert np.allclose(histogram.Percentiles(PERCENTILES), expected, atol=histogram.slope) # within a bin
+
+def test_sparse_round_trip():
+    histogram = VolumeHistogram(CT(), Histogram())
+    copy = FromSparse(histogram.Sparse())
+    assert np.array_equal(copy.counts, histogram.counts)
+    assert np.array_equal(copy.Percentiles(PERCENTILES), histogram.Percentiles(PERCENTILES))
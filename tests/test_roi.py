@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+###################################################
+#   	  Tests of the contour rasterizer
+# 		   	----
+#           	P. Lansonneur 2019
+###################################################
+
+import numpy as np
+from matplotlib.path import Path
+from ROI import FillPolygons
+
+def Star(centre, radius, n, rng):
+    """
+    Random star-shaped polygon: (N,2) (row, column) vertices in pixel units
+    """
+    angles = np.sort(rng.uniform(0, 2*np.pi, n))
+    r = radius*rng.uniform(0.3, 1., n)
+    return np.column_stack([centre[0] + r*np.sin(angles), centre[1] + r*np.cos(angles)])
+
+def Inside(polygons, rows, cols):
+    """
+    Even-odd rule over the polygons, with matplotlib, at the points (rows, cols)
+    """
+    points = np.column_stack([rows.ravel(), cols.ravel()])
+    inside = np.zeros(len(points), dtype=bool)
+    for p in polygons:  inside ^= Path(p).contains_points(points)
+    return inside.reshape(rows.shape)
+
+def test_fill_polygons_matches_path():
+    rng = np.random.default_rng(0)
+    shape = (60, 80)
+    rows, cols = np.mgrid[0:shape[0], 0:shape[1]].astype(float)
+    for _ in range(20):
+        polygons = [Star(rng.uniform(5, 55, 2), rng.uniform(3, 40), rng.integers(3, 30), rng) for _ in range(rng.integers(1, 4))]
+        assert np.array_equal(FillPolygons(polygons, shape), Inside(polygons, rows, cols))
+
+def test_fill_polygons_hole():
+    outer = np.array([[10., 10.], [10., 50.], [50., 50.], [50., 10.]]) + 0.3
+    inner = np.array([[20., 20.], [20., 40.], [40., 40.], [40., 20.]]) + 0.3
+    mask = FillPolygons([outer, inner], (60, 60))
+    rows, cols = np.mgrid[0:60, 0:60].astype(float)
+    assert np.array_equal(mask, Inside([outer, inner], rows, cols))
+    assert not mask[30, 30] and mask[15, 15]
+
+def test_fill_polygons_supersampling():
+    rng = np.random.default_rng(1)
+    n, shape = 4, (40, 40)
+    polygons = [Star((20., 20.), 18., 12, rng)]
+    fraction = FillPolygons(polygons, shape, supersampling=n)
+
+    # sub-pixel centres of each pixel
+    sub = (np.arange(shape[0]*n) + 0.5)/n - 0.5
+    rows, cols = np.meshgrid(sub, sub, indexing='ij')
+    expected = Inside(polygons, rows, cols).reshape(shape[0], n, shape[1], n).mean(axis=(1,3))
+    assert np.allclose(fraction, expected)
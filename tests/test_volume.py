@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+###################################################
+#   	  Tests of the volume geometry and resampling
+# 		   	----
+#           	P. Lansonneur 2019
+###################################################
+
+import numpy as np
+import pytest
+from scipy.ndimage import map_coordinates
+from Volume import RTCTVolume, RTDosiVolume
+
+def Grid(volume, shape, spacing, origin, direction):
+    volume.volume = np.zeros(shape, dtype=np.int16)
+    volume.dim_x, volume.dim_y, volume.dim_z = shape
+    volume.spacing, volume.origin, volume.direction = list(spacing), list(origin), list(direction)
+    volume.open = True
+    return volume
+
+@pytest.mark.parametrize('direction', [[1, -1, -1], [1, 1, 1]])
+def test_position_index(direction):
+    ct = Grid(RTCTVolume(), (5, 6, 7), (2.5, 0.9, 1.1), (-10., 20., 30.), direction)
+    for ax in range(3):
+        index = np.arange(np.shape(ct.volume)[ax])
+        assert np.allclose(ct.Index(ax, ct.Position(ax, index)), index)
+        assert np.allclose(np.diff(ct.Position(ax, index)), direction[ax]*ct.spacing[ax])
+
+@pytest.mark.parametrize('direction', [[1, -1, -1], [1, 1, 1]])
+def test_resample_matches_map_coordinates(direction):
+    rng = np.random.default_rng(0)
+    dosi = Grid(RTDosiVolume(), (12, 15, 14), (3., 2.5, 2.5), (-15., 18., 17.) if direction[1]<0 else (-15., -18., -17.), direction)
+    dosi.volume = rng.random((12, 15, 14)).astype(np.float32)
+    # CT grid finer than the dose and partly outside it
+    ct = Grid(RTCTVolume(), (20, 40, 38), (2., 1.1, 1.2), (-20., 25., 24.) if direction[1]<0 else (-20., -25., -24.), direction)
+
+    coords = [dosi.Index(ax, ct.Position(ax, np.arange(n))) for ax, n in enumerate(np.shape(ct.volume))]
+    expected = map_coordinates(dosi.volume, np.meshgrid(*coords, indexing='ij'), order=1, mode='constant', cval=0.)
+    resampled = dosi.Resample(ct, chunk=7)
+    assert resampled.dtype==np.float32
+    assert (resampled==0).any() and (resampled>0).any()
+    assert np.allclose(resampled, expected, atol=1e-5)